@@ -1,7 +1,69 @@
 """Role-based access control for admin users."""
+import numpy as np
+
+# Record fields that define an admin's access scope, in partition-key order
+SCOPE_COLUMNS = ['grade', 'class', 'region']
+
+
+def _scope_values(value):
+    """Normalize a scope setting into a tuple of allowed values (empty means unrestricted)."""
+    if value is None or (not isinstance(value, (list, tuple, set, frozenset)) and not value):
+        return ()
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(sorted({v for v in value if v is not None and v != ''}, key=str))
+    return (value,)
+
+
+class AccessPolicy:
+    """Compiled admin scope that is evaluated against whole DataFrames at once."""
+    
+    def __init__(self, grades=None, classes=None, regions=None):
+        self.grades = _scope_values(grades)
+        self.classes = _scope_values(classes)
+        self.regions = _scope_values(regions)
+        self.key = (self.grades, self.classes, self.regions)
+    
+    @classmethod
+    def from_role(cls, admin_role):
+        """Compile the scope of an AdminRole."""
+        return cls(admin_role.grade, admin_role.class_section, admin_role.region)
+    
+    def constraints(self):
+        """Return (column, allowed values) pairs for the restricted scope columns."""
+        return [(col, values) for col, values in zip(SCOPE_COLUMNS, self.key) if values]
+    
+    def matches(self, partition):
+        """Check a (grade, class, region) partition key against this scope."""
+        return all(not values or have in values for values, have in zip(self.key, partition))
+    
+    def mask(self, df):
+        """Boolean mask of the rows in df this scope may access."""
+        mask = np.ones(len(df), dtype=bool)
+        for col, values in self.constraints():
+            if col not in df.columns:
+                return np.zeros(len(df), dtype=bool)
+            mask &= df[col].isin(values).to_numpy()
+        return mask
+    
+    def row_index(self, df):
+        """Positions of the rows in df this scope may access."""
+        return np.flatnonzero(self.mask(df))
+    
+    def __eq__(self, other):
+        return isinstance(other, AccessPolicy) and self.key == other.key
+    
+    def __hash__(self):
+        return hash(self.key)
+    
+    def __repr__(self):
+        return f"AccessPolicy(grades={self.grades}, classes={self.classes}, regions={self.regions})"
+
 
 class AdminRole:
-    """Represents an admin user with specific access scope."""
+    """Represents an admin user with specific access scope.
+    
+    grade, class_section and region each accept a single value or a list of values.
+    """
     
     def __init__(self, admin_id, name, grade=None, class_section=None, region=None):
         self.admin_id = admin_id
@@ -10,35 +72,45 @@ class AdminRole:
         self.class_section = class_section
         self.region = region
     
-    def can_access_student(self, student):
-        """Check if admin can access this student's data."""
-        if self.grade and student.get('grade') != self.grade:
-            return False
-        if self.class_section and student.get('class') != self.class_section:
-            return False
-        if self.region and student.get('region') != self.region:
-            return False
+    def get_policy(self):
+        """Compile this admin's scope into a vectorized AccessPolicy."""
+        return AccessPolicy.from_role(self)
+    
+    def _can_access(self, record):
+        """Compare the record's fields with the scope settings directly, independent of AccessPolicy."""
+        for setting, field in ((self.grade, 'grade'), (self.class_section, 'class'), (self.region, 'region')):
+            value = record.get(field)
+            if isinstance(setting, (list, tuple, set, frozenset)):
+                allowed = [v for v in setting if v is not None and v != '']
+                if allowed and value not in allowed:
+                    return False
+            elif setting and value != setting:
+                return False
         return True
     
+    def can_access_student(self, student):
+        """Check if admin can access this student's data.
+        
+        Per-record reference implementation; bulk filtering goes through get_policy().
+        """
+        return self._can_access(student)
+    
     def can_access_quiz(self, quiz):
-        """Check if admin can access this quiz data."""
-        if self.grade and quiz.get('grade') != self.grade:
-            return False
-        if self.class_section and quiz.get('class') != self.class_section:
-            return False
-        if self.region and quiz.get('region') != self.region:
-            return False
-        return True
+        """Check if admin can access this quiz data.
+        
+        Per-record reference implementation; bulk filtering goes through get_policy().
+        """
+        return self._can_access(quiz)
     
     def get_scope_description(self):
         """Return a human-readable description of admin's scope."""
+        policy = self.get_policy()
         parts = []
-        if self.grade:
-            parts.append(f"Grade {self.grade}")
-        if self.class_section:
-            parts.append(f"Class {self.class_section}")
-        if self.region:
-            parts.append(f"Region {self.region}")
+        for label, values in (("Grade", policy.grades), ("Class", policy.classes), ("Region", policy.regions)):
+            if len(values) == 1:
+                parts.append(f"{label} {values[0]}")
+            elif values:
+                parts.append(f"{label}s {', '.join(str(v) for v in values)}")
         return ", ".join(parts) if parts else "All accessible data"
 
 
@@ -0,0 +1,105 @@
+"""Exact aggregate queries over DataManager, backed by materialized per-partition rollups."""
+import logging
+import numpy as np
+import pandas as pd
+from access_control import SCOPE_COLUMNS
+from tracing import annotate, traced
+
+logger = logging.getLogger(__name__)
+
+GROUP_BY_COLUMNS = SCOPE_COLUMNS
+DEFAULT_PERCENTILES = (25, 50, 75, 90)
+ROLLUP_COLUMNS = ['students', 'scored', 'score_sum', 'score_min', 'score_max', 'homework_submitted']
+
+
+def build_student_rollup(tables):
+    """One row per (grade, class, region) partition with counts, score sums/extremes and homework submissions."""
+    students_df = tables['students']
+    if students_df.empty:
+        return pd.DataFrame(columns=SCOPE_COLUMNS + ROLLUP_COLUMNS)
+    return students_df.groupby(SCOPE_COLUMNS, observed=True, dropna=False).agg(
+        students=('quiz_score', 'size'),
+        scored=('quiz_score', 'count'),
+        score_sum=('quiz_score', 'sum'),
+        score_min=('quiz_score', 'min'),
+        score_max=('quiz_score', 'max'),
+        homework_submitted=('homework_submitted', 'sum'),
+    ).reset_index()
+
+
+class Analytics:
+    """Group-by, rate, percentile and top-k queries restricted to an admin's scope.
+
+    Additive statistics come from a rollup materialized once per data snapshot, so
+    "average score by class" costs O(partitions) rather than O(students) and is rebuilt
+    automatically after ingestion. Percentiles and top-k need row values and are computed
+    over the scope's rows with NumPy.
+    """
+
+    def __init__(self, data_manager):
+        self.data_manager = data_manager
+
+    def _scoped_rollup(self, admin_role):
+        rollup = self.data_manager.materialized('student_rollup', build_student_rollup)
+        annotate(rows_scanned=len(rollup))
+        return rollup[admin_role.get_policy().mask(rollup)]
+
+    def _check_dimension(self, by):
+        if by not in GROUP_BY_COLUMNS:
+            raise ValueError(f"Cannot group by '{by}'; choose one of {', '.join(GROUP_BY_COLUMNS)}")
+
+    @traced('analytics.score_stats')
+    def score_stats(self, admin_role, by='class'):
+        """Student count and mean/min/max quiz score per group."""
+        self._check_dimension(by)
+        grouped = self._scoped_rollup(admin_role).groupby(by, observed=True).agg(
+            students=('students', 'sum'),
+            scored=('scored', 'sum'),
+            score_sum=('score_sum', 'sum'),
+            min_score=('score_min', 'min'),
+            max_score=('score_max', 'max'),
+        )
+        grouped = grouped[grouped['students'] > 0]
+        grouped['avg_score'] = (grouped['score_sum'] / grouped['scored']).round(2)
+        return grouped.reset_index()[[by, 'students', 'avg_score', 'min_score', 'max_score']]
+
+    @traced('analytics.homework_rate')
+    def homework_rate(self, admin_role, by='class'):
+        """Homework submission count and rate per group."""
+        self._check_dimension(by)
+        grouped = self._scoped_rollup(admin_role).groupby(by, observed=True)[['students', 'homework_submitted']].sum()
+        grouped = grouped[grouped['students'] > 0]
+        grouped['submission_rate'] = (grouped['homework_submitted'] / grouped['students']).round(4)
+        return grouped.reset_index()
+
+    @traced('analytics.score_percentiles')
+    def score_percentiles(self, admin_role, percentiles=DEFAULT_PERCENTILES, by=None):
+        """Quiz score percentiles over the scope, optionally per group."""
+        df = self.data_manager.get_filtered_students(admin_role)
+        if df.empty:
+            return pd.DataFrame()
+        names = [f"p{p}" for p in percentiles]
+        if by is None:
+            values = np.nanpercentile(df['quiz_score'].to_numpy(dtype=float), percentiles)
+            return pd.DataFrame([dict(zip(names, values))])
+        self._check_dimension(by)
+        result = df.groupby(by, observed=True)['quiz_score'].quantile([p / 100 for p in percentiles]).unstack()
+        result.columns = names
+        return result.reset_index()
+
+    @traced('analytics.top_k')
+    def top_k(self, admin_role, k=10, ascending=False):
+        """The k highest (or, with ascending=True, lowest) quiz scores in the scope."""
+        df = self.data_manager.get_filtered_students(admin_role)
+        if df.empty or k <= 0:
+            return pd.DataFrame()
+        scores = df['quiz_score'].to_numpy(dtype=float)
+        # NaN scores are never ranked; argpartition then picks the k extremes in O(n)
+        ranked = np.flatnonzero(~np.isnan(scores))
+        keys = scores[ranked] if ascending else -scores[ranked]
+        k = min(k, len(ranked))
+        if k == 0:
+            return pd.DataFrame()
+        picked = np.argpartition(keys, k - 1)[:k]
+        picked = picked[np.argsort(keys[picked], kind='stable')]
+        return df.iloc[ranked[picked]].reset_index(drop=True)
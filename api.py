@@ -0,0 +1,298 @@
+"""Headless ASGI API for queries and the deterministic data lookups.
+
+Importing this module only loads the standard library and config, so a replica binds its
+port in milliseconds. pandas, langchain and the data itself are imported/loaded by a
+background warmup started at ASGI startup, or on the first request that needs them.
+
+Run with:
+    uvicorn api:app --host 0.0.0.0 --port 8000
+    python api.py --profile-imports   # import-time profile of the heavy modules
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+from config import API_MAX_SESSIONS, API_WARMUP, DATA_FILE, OPENAI_API_KEY, OPENAI_BASE_URL
+from tracing import get_registry
+
+_MODULE_START = time.perf_counter()
+
+logger = logging.getLogger(__name__)
+
+# Imported during warmup, heaviest last so the data endpoints become usable first
+HEAVY_MODULES = ['numpy', 'pandas', 'access_control', 'data_manager', 'analytics', 'langchain_openai', 'query_agent']
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ApiApp:
+    """ASGI application; heavy state is created once, on warmup or first use."""
+
+    def __init__(self, data_file=DATA_FILE, api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, warmup=API_WARMUP):
+        self.data_file = data_file
+        self.api_key = api_key
+        self.base_url = base_url
+        self.warmup = warmup
+        self.created = time.perf_counter()
+        self.import_seconds = {}
+        self.data_seconds = None
+        self.ready_seconds = None
+        self._modules = {}
+        self._data_manager = None
+        self._agents = OrderedDict()
+        self._lock = threading.RLock()
+        self._agents_lock = threading.Lock()
+        self._routes = {
+            ('GET', '/health'): self._health,
+            ('GET', '/ready'): self._ready,
+            ('GET', '/metrics'): self._metrics,
+            ('GET', '/admins'): self._admins,
+            ('GET', '/students'): self._students,
+            ('GET', '/students/no-homework'): self._no_homework,
+            ('GET', '/performance'): self._performance,
+            ('GET', '/quizzes/upcoming'): self._upcoming_quizzes,
+            ('GET', '/analytics/score-stats'): self._score_stats,
+            ('POST', '/query'): self._query,
+        }
+
+    # Lazy state
+
+    def _module(self, name):
+        """Import a heavy module on first use and record how long it took."""
+        module = self._modules.get(name)
+        if module is None:
+            with self._lock:
+                module = self._modules.get(name)
+                if module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(name)
+                    self.import_seconds[name] = round(time.perf_counter() - start, 4)
+                    self._modules[name] = module
+        return module
+
+    def data_manager(self):
+        if self._data_manager is None:
+            with self._lock:
+                if self._data_manager is None:
+                    start = time.perf_counter()
+                    self._data_manager = self._module('data_manager').open_data_manager(self.data_file)
+                    self.data_seconds = round(time.perf_counter() - start, 4)
+        return self._data_manager
+
+    def _admin(self, params):
+        admin_id = params.get('admin_id')
+        admins = self._module('access_control').DEMO_ADMINS
+        if admin_id not in admins:
+            raise HttpError(404, f"Unknown admin_id: {admin_id}")
+        return admins[admin_id]
+
+    def _agent(self, admin, session_id):
+        """QueryAgent per (admin, session), least recently used sessions dropped beyond API_MAX_SESSIONS."""
+        if not self.api_key:
+            raise HttpError(503, "OPENAI_API_KEY is not configured")
+        key = (admin.admin_id, session_id)
+        with self._agents_lock:
+            agent = self._agents.get(key)
+            if agent is not None:
+                self._agents.move_to_end(key)
+                return agent
+        llm = self._module('llm_client').get_shared_llm(self.api_key, base_url=self.base_url)
+        agent = self._module('query_agent').QueryAgent(self.data_manager(), admin, self.api_key, llm=llm)
+        with self._agents_lock:
+            agent = self._agents.setdefault(key, agent)
+            while len(self._agents) > API_MAX_SESSIONS:
+                self._agents.popitem(last=False)
+        return agent
+
+    def warm_up(self):
+        """Import the heavy modules and load the data; safe to call more than once."""
+        if self.ready_seconds is not None:
+            return
+        try:
+            for name in HEAVY_MODULES:
+                self._module(name)
+            self.data_manager()
+            self.ready_seconds = round(time.perf_counter() - self.created, 4)
+            logger.info(f"API ready in {self.ready_seconds:.2f}s (imports: {self.import_seconds}, data: {self.data_seconds}s)")
+        except Exception as e:
+            logger.error(f"API warmup failed: {str(e)}", exc_info=True)
+
+    def startup_profile(self):
+        return {
+            'module_import_seconds': round(self.created - _MODULE_START, 4),
+            'ready': self.ready_seconds is not None,
+            'ready_seconds': self.ready_seconds,
+            'data_load_seconds': self.data_seconds,
+            'import_seconds': dict(self.import_seconds),
+        }
+
+    # Handlers
+
+    async def _health(self, params, body):
+        return 200, {'status': 'ok'}
+
+    async def _ready(self, params, body):
+        profile = self.startup_profile()
+        return (200 if profile['ready'] else 503), profile
+
+    async def _metrics(self, params, body):
+        profile = self.startup_profile()
+        lines = [
+            "# TYPE dumroo_api_ready gauge",
+            f"dumroo_api_ready {int(profile['ready'])}",
+            "# TYPE dumroo_api_ready_seconds gauge",
+            f"dumroo_api_ready_seconds {profile['ready_seconds'] or 0}",
+            "# TYPE dumroo_api_import_seconds gauge",
+        ]
+        lines += [f'dumroo_api_import_seconds{{module="{name}"}} {secs}' for name, secs in profile['import_seconds'].items()]
+        return 200, "\n".join(lines) + "\n" + get_registry().to_prometheus()
+
+    async def _admins(self, params, body):
+        admins = self._module('access_control').DEMO_ADMINS
+        return 200, [
+            {'admin_id': admin_id, 'name': admin.name, 'scope': admin.get_scope_description()}
+            for admin_id, admin in admins.items()
+        ]
+
+    async def _lookup(self, params, query):
+        admin = self._admin(params)
+        df = await asyncio.to_thread(lambda: query(self.data_manager(), admin))
+        return 200, json.loads(df.to_json(orient='records', date_format='iso')) if len(df) else []
+
+    async def _students(self, params, body):
+        return await self._lookup(params, lambda dm, admin: dm.get_filtered_students(admin))
+
+    async def _no_homework(self, params, body):
+        return await self._lookup(params, lambda dm, admin: dm.query_students_no_homework(admin))
+
+    async def _performance(self, params, body):
+        grade, days_back = _int_param(params, 'grade'), _int_param(params, 'days_back', 7)
+        return await self._lookup(params, lambda dm, admin: dm.query_performance_by_grade(admin, grade, days_back))
+
+    async def _upcoming_quizzes(self, params, body):
+        days_ahead = _int_param(params, 'days_ahead', 7)
+        return await self._lookup(params, lambda dm, admin: dm.query_upcoming_quizzes(admin, days_ahead))
+
+    async def _score_stats(self, params, body):
+        by = params.get('by', 'class')
+        analytics = self._module('analytics')
+        if by not in analytics.GROUP_BY_COLUMNS:
+            raise HttpError(400, f"by must be one of {', '.join(analytics.GROUP_BY_COLUMNS)}")
+        return await self._lookup(params, lambda dm, admin: analytics.Analytics(dm).score_stats(admin, by))
+
+    async def _query(self, params, body):
+        try:
+            request = json.loads(body or b'{}')
+        except json.JSONDecodeError:
+            raise HttpError(400, "Body must be JSON")
+        question = str(request.get('question') or '').strip()
+        if not question:
+            raise HttpError(400, "question is required")
+        admin = self._admin(request)
+        agent = await asyncio.to_thread(self._agent, admin, str(request.get('session_id') or 'default'))
+        # aquery must run on the shared LLM loop that owns the pooled connections
+        loop = self._module('llm_client').get_event_loop()
+        answer = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(agent.aquery(question), loop))
+        return 200, {'admin_id': admin.admin_id, 'question': question, 'answer': answer,
+                     'tokens': agent.last_turn_tokens}
+
+    # ASGI plumbing
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        params = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode()).items()}
+        handler = self._routes.get((scope['method'], scope['path'].rstrip('/') or '/'))
+        try:
+            if handler is None:
+                raise HttpError(404, f"No route for {scope['method']} {scope['path']}")
+            status, payload = await handler(params, body)
+        except HttpError as e:
+            status, payload = e.status, {'error': e.message}
+        except Exception as e:
+            logger.error(f"API error on {scope['path']}: {str(e)}", exc_info=True)
+            status, payload = 500, {'error': 'Internal server error'}
+        await _respond(send, status, payload)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if self.warmup:
+                    threading.Thread(target=self.warm_up, name="api-warmup", daemon=True).start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def _int_param(params, name, default=None):
+    value = params.get(name, default)
+    if value is None:
+        raise HttpError(400, f"{name} is required")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HttpError(400, f"{name} must be an integer")
+
+
+async def _respond(send, status, payload):
+    if isinstance(payload, str):
+        body, content_type = payload.encode('utf-8'), b'text/plain; version=0.0.4; charset=utf-8'
+    else:
+        body, content_type = json.dumps(payload, default=str).encode('utf-8'), b'application/json'
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def profile_imports():
+    """Import time of each heavy module, in warmup order, measured in this (fresh) process."""
+    timings = {}
+    for name in HEAVY_MODULES:
+        start = time.perf_counter()
+        importlib.import_module(name)
+        timings[name] = round(time.perf_counter() - start, 4)
+    return timings
+
+
+app = ApiApp()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the headless query API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--profile-imports", action="store_true", help="Print import times and exit")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.profile_imports:
+        print(f"api module import: {app.created - _MODULE_START:.4f}s")
+        for name, seconds in profile_imports().items():
+            print(f"{name:<20}{seconds:>8.3f}s")
+    else:
+        import uvicorn
+        uvicorn.run("api:app", host=args.host, port=args.port, workers=args.workers)
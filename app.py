@@ -1,10 +1,14 @@
 """Streamlit app for Dumroo Admin Panel AI Query System."""
 import streamlit as st
+import json
 import os
 from dotenv import load_dotenv
 from access_control import DEMO_ADMINS
-from data_manager import DataManager
+from config import DATA_FILE, DEBUG_PANEL_DEFAULT
+from data_manager import data_signature, open_data_manager
+from process_pool import serve_in_processes
 from query_agent import QueryAgent
+from tracing import get_registry
 import logging
 
 # Configure logging
@@ -20,6 +24,21 @@ st.set_page_config(
     layout="wide"
 )
 
+
+@st.cache_resource(max_entries=1, show_spinner="Loading student data...")
+def load_data_manager(data_file, signature):
+    """Load one DataManager per data file version, shared read-only by all sessions.
+    
+    With SERVING_WORKERS > 0, queries run in a pool of worker processes over shared memory.
+    """
+    return serve_in_processes(open_data_manager(data_file))
+
+
+def get_data_manager():
+    """Return the shared DataManager, reloading only when the data file changes."""
+    return load_data_manager(DATA_FILE, data_signature(DATA_FILE))
+
+
 st.title("🎓 Dumroo Admin Panel - AI Query System")
 st.markdown("Ask questions about student data in plain English")
 
@@ -72,22 +91,38 @@ if 'agent' not in st.session_state:
 if 'current_admin' not in st.session_state:
     st.session_state.current_admin = None
 
-# Reinitialize agent if admin changed or API key provided
-if api_key and (st.session_state.current_admin != admin_id or st.session_state.agent is None):
+data_manager = None
+try:
+    data_manager = get_data_manager()
+    metrics = data_manager.get_metrics()
+    st.sidebar.caption(
+        f"📊 {metrics['students']} students, {metrics['quizzes']} quizzes · "
+        f"loaded in {metrics['load_seconds']:.2f}s · {metrics['memory_bytes'] / 1024 / 1024:.1f} MB"
+    )
+except FileNotFoundError as e:
+    st.error(f"Data file not found: {str(e)}")
+    logger.error(f"Data file error: {str(e)}")
+except Exception as e:
+    st.error(f"Error loading data: {str(e)}")
+    logger.error(f"Data load error: {str(e)}", exc_info=True)
+
+# Reinitialize agent if admin or data changed, or API key provided
+if api_key and data_manager is not None and (
+    st.session_state.agent is None
+    or st.session_state.current_admin != admin_id
+    or st.session_state.agent.data_manager is not data_manager
+):
     try:
         # Validate API key format
         if not api_key.startswith('sk-'):
             st.error("Invalid API key format. OpenAI API keys start with 'sk-'")
         else:
             with st.spinner("Initializing AI agent..."):
-                data_manager = DataManager()
+                if st.session_state.current_admin != admin_id:
+                    st.session_state.messages = []  # Clear chat history on admin change
                 st.session_state.agent = QueryAgent(data_manager, admin_role, api_key)
                 st.session_state.current_admin = admin_id
-                st.session_state.messages = []  # Clear chat history on admin change
                 logger.info(f"Agent initialized for admin: {admin_id}")
-    except FileNotFoundError as e:
-        st.error(f"Data file not found: {str(e)}")
-        logger.error(f"Data file error: {str(e)}")
     except Exception as e:
         st.error(f"Error initializing agent: {str(e)}")
         logger.error(f"Agent initialization error: {str(e)}", exc_info=True)
@@ -109,19 +144,29 @@ if prompt := st.chat_input("Ask a question about student data..."):
         with st.chat_message("user"):
             st.markdown(prompt)
         
-        # Get agent response
+        # Stream agent response, showing tool progress until the answer starts
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                try:
-                    response = st.session_state.agent.query(prompt)
-                    st.markdown(response)
-                    # Add assistant message
-                    st.session_state.messages.append({"role": "assistant", "content": response})
-                except Exception as e:
-                    error_msg = f"Error processing query: {str(e)}"
-                    st.error(error_msg)
-                    logger.error(f"Query error: {str(e)}", exc_info=True)
-                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
+            progress = st.empty()
+            progress.caption("Thinking...")
+            
+            def answer_chunks():
+                for kind, text in st.session_state.agent.stream(prompt):
+                    if kind == 'tool':
+                        progress.caption(f"🔎 Looking up {text.replace('_', ' ')}...")
+                    else:
+                        progress.empty()
+                        yield text
+            
+            try:
+                response = st.write_stream(answer_chunks())
+                # Add assistant message
+                st.session_state.messages.append({"role": "assistant", "content": response})
+            except Exception as e:
+                progress.empty()
+                error_msg = f"Error processing query: {str(e)}"
+                st.error(error_msg)
+                logger.error(f"Query error: {str(e)}", exc_info=True)
+                st.session_state.messages.append({"role": "assistant", "content": error_msg})
 
 # Clear chat button
 if st.sidebar.button("🗑️ Clear Chat History"):
@@ -129,3 +174,25 @@ if st.sidebar.button("🗑️ Clear Chat History"):
     if st.session_state.agent:
         st.session_state.agent.memory.clear()
     st.rerun()
+
+# Optional debug panel with per-stage timings of this admin's recent questions
+if st.sidebar.toggle("🐞 Debug panel", value=DEBUG_PANEL_DEFAULT):
+    registry = get_registry()
+    traces = [t for t in registry.recent_traces() if t.admin_id == admin_id]
+    with st.expander("🐞 Debug: last query trace", expanded=True):
+        if not traces:
+            st.caption("No traced queries yet.")
+        else:
+            last = traces[0].to_dict()
+            st.caption(
+                f"{last['path']} · {last['ms']:.1f} ms · {last['llm_calls']} LLM calls · "
+                f"{last['prompt_tokens']} prompt + {last['completion_tokens']} completion tokens"
+            )
+            st.dataframe(last['spans'], use_container_width=True)
+        st.json(registry.snapshot(), expanded=False)
+        st.download_button("Prometheus metrics", registry.to_prometheus(), file_name="metrics.prom")
+        st.download_button(
+            "Traces (JSON lines)",
+            "\n".join(json.dumps(t.to_dict(), default=str) for t in reversed(traces)),
+            file_name="traces.jsonl",
+        )
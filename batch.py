@@ -0,0 +1,166 @@
+"""Run a set of questions for many admins in one pass and write the answers as JSON lines.
+
+Admins with identical scopes share one answer per question. Questions the intent router
+recognizes are computed once over the whole dataset and split by (grade, class, region)
+partition; the rest go through QueryAgent with bounded concurrency.
+
+Example:
+    python batch.py --questions questions.txt --output report.jsonl
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import numpy as np
+from access_control import DEMO_ADMINS, AdminRole
+from config import BATCH_CONCURRENCY, DATA_FILE
+from data_manager import build_partition_index, open_data_manager
+from intent_router import IntentRouter
+from llm_client import get_shared_llm, run_coroutine
+from query_agent import QueryAgent, intent_query, render_local_answer
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Unrestricted role used to run each deterministic query once before splitting it by scope
+_ALL_SCOPES = AdminRole("batch", "Batch runner")
+
+SKIPPED_MESSAGE = "Not answered: this question needs the LLM and no API key was provided."
+
+
+def group_admins(admins):
+    """Group admins by scope key; admins in one group see exactly the same rows."""
+    groups = {}
+    for admin in admins:
+        groups.setdefault(admin.get_policy().key, []).append(admin)
+    return groups
+
+
+def _normalize(question):
+    return ' '.join(question.split())
+
+
+class BatchRunner:
+    """Answers every (admin, question) pair against one shared DataManager."""
+
+    def __init__(self, data_manager, api_key=None, llm=None, router=None, concurrency=BATCH_CONCURRENCY):
+        self.data_manager = data_manager
+        self.api_key = api_key
+        self.llm = llm or (get_shared_llm(api_key) if api_key else None)
+        self.router = router or IntentRouter()
+        self.concurrency = concurrency
+
+    def _answer_locally(self, intent, question, groups):
+        """Answer one routed question for every scope group from a single query and partition split."""
+        prepared = intent_query(self.data_manager, _ALL_SCOPES, intent, question)
+        if prepared is None:
+            return None
+        df, params = prepared
+        with span('batch.split', intent=intent, rows_scanned=len(df)):
+            partitions = build_partition_index(df)
+            answers = {}
+            for key, admins in groups.items():
+                policy = admins[0].get_policy()
+                matching = [rows for partition, rows in partitions.items() if policy.matches(partition)]
+                rows = np.sort(np.concatenate(matching)) if matching else np.empty(0, dtype=np.intp)
+                scoped = df.take(rows).reset_index(drop=True)
+                answers[key] = render_local_answer(intent, scoped, admins[0].get_scope_description(), **params)
+        return answers
+
+    async def _answer_with_llm(self, pairs, groups):
+        """Run (scope key, question) pairs through fresh QueryAgents, at most `concurrency` at a time."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def answer(key, question):
+            async with semaphore:
+                # A fresh agent per pair keeps questions independent of each other's chat history
+                agent = QueryAgent(self.data_manager, groups[key][0], self.api_key or 'batch', llm=self.llm)
+                return await agent.aquery(question)
+
+        results = await asyncio.gather(*(answer(key, question) for key, question in pairs))
+        return dict(zip(pairs, results))
+
+    def run(self, admins, questions):
+        """Answer every question for every admin; returns one result dict per (admin, question)."""
+        groups = group_admins(admins)
+        questions = list(dict.fromkeys(_normalize(q) for q in questions if q.strip()))
+        logger.info(f"Batch: {len(admins)} admins in {len(groups)} scopes, {len(questions)} questions")
+
+        answers, sources, llm_pairs = {}, {}, []
+        for question in questions:
+            intent = self.router.route(question)
+            local = self._answer_locally(intent, question, groups) if intent else None
+            if local is not None:
+                for key, answer in local.items():
+                    answers[(key, question)] = answer
+                    sources[(key, question)] = 'local'
+            else:
+                llm_pairs += [(key, question) for key in groups]
+
+        if llm_pairs and self.llm is None:
+            logger.warning(f"Skipping {len(llm_pairs)} LLM questions: no API key")
+            for pair in llm_pairs:
+                answers[pair], sources[pair] = SKIPPED_MESSAGE, 'skipped'
+        elif llm_pairs:
+            for pair, answer in run_coroutine(self._answer_with_llm(llm_pairs, groups)).items():
+                answers[pair], sources[pair] = answer, 'llm'
+
+        data_version = self.data_manager.data_version
+        results = []
+        for admin in admins:
+            key = admin.get_policy().key
+            for question in questions:
+                results.append({
+                    'admin_id': admin.admin_id,
+                    'admin_name': admin.name,
+                    'scope': admin.get_scope_description(),
+                    'question': question,
+                    'answer': answers[(key, question)],
+                    'source': sources[(key, question)],
+                    'data_version': data_version,
+                })
+        return results
+
+
+def write_jsonl(results, f):
+    """Write result dicts to an open text file, one JSON object per line."""
+    for result in results:
+        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+def run_batch(questions, admins=None, data_file=DATA_FILE, api_key=None, concurrency=BATCH_CONCURRENCY, output=None):
+    """Load the data once, answer `questions` for `admins` (default: DEMO_ADMINS) and optionally write JSON lines."""
+    admins = list(admins if admins is not None else DEMO_ADMINS.values())
+    runner = BatchRunner(open_data_manager(data_file), api_key=api_key, concurrency=concurrency)
+    results = runner.run(admins, questions)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            write_jsonl(results, f)
+        logger.info(f"Wrote {len(results)} batch results to {output}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a set of questions for many admins in one pass.")
+    parser.add_argument("--questions", help="Text file with one question per line")
+    parser.add_argument("--question", action="append", default=[], help="A question (repeatable)")
+    parser.add_argument("--admins", help="Comma-separated admin ids from DEMO_ADMINS (default: all)")
+    parser.add_argument("--data-file", default=DATA_FILE)
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Concurrent LLM questions")
+    parser.add_argument("--output", help="JSON-lines output file (default: stdout)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    questions = list(args.question)
+    if args.questions:
+        with open(args.questions, 'r', encoding='utf-8') as f:
+            questions += [line for line in f if line.strip()]
+    if not questions:
+        parser.error("provide --questions or --question")
+    admins = [DEMO_ADMINS[a.strip()] for a in args.admins.split(',')] if args.admins else None
+
+    results = run_batch(questions, admins, args.data_file, os.getenv('OPENAI_API_KEY'), args.concurrency, args.output)
+    if not args.output:
+        write_jsonl(results, sys.stdout)
@@ -0,0 +1,406 @@
+"""End-to-end benchmark: synthetic datasets, DataManager/RBAC timings and agent replay on the stub LLM.
+
+Example:
+    python benchmark.py --students 1000000 --format columnar --save-baseline baseline.json
+    python benchmark.py --students 1000000 --format columnar --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from access_control import AdminRole
+from analytics import Analytics
+from data_manager import open_data_manager
+from llm_client import get_shared_llm, run_coroutine
+from process_pool import serve_in_processes
+from query_agent import QueryAgent
+from records import dict_records_nbytes
+from sql_backend import convert_json_to_sqlite
+from storage import convert_json_to_columnar
+from stub_llm_server import start_stub_server
+
+logger = logging.getLogger(__name__)
+
+GRADES = list(range(1, 13))
+CLASSES = list('ABCDEFGH')
+REGIONS = ['North', 'South', 'East', 'West', 'Central', 'Coastal', 'Highland', 'Valley']
+QUIZ_SUBJECTS = ['Math', 'Science', 'English', 'History', 'Geography', 'Art']
+
+QUESTIONS = [
+    "Which students haven't submitted their homework yet?",
+    "Show me performance data for Grade {grade} from last week",
+    "List all upcoming quizzes scheduled for next week",
+    "Who are my students?",
+    "What is the average quiz score by class?",
+    "Show the bottom 10 performers",
+    "Which students haven't submitted homework, and what quizzes are coming up?",
+    "Summarize how my students are doing this term",
+]
+
+# Regressions smaller than this are timer noise, whatever their relative size
+MIN_REGRESSION_MS = 0.05
+
+# Rows sampled per table when estimating the size of the record-dict representation
+DICT_SIZE_SAMPLE = 2000
+
+
+def generate_dataset(n_students, n_quizzes=None, seed=0):
+    """Synthetic students and quizzes DataFrames spread evenly over every grade, class and region.
+
+    Dates are relative to today so the "last week" and "next week" windows return rows.
+    """
+    rng = np.random.default_rng(seed)
+    n_quizzes = n_quizzes if n_quizzes is not None else max(n_students // 10, 1)
+    today = np.datetime64(datetime.now().date(), 'D')
+
+    def scope_columns(n):
+        return {
+            'grade': rng.choice(GRADES, n),
+            'class': rng.choice(CLASSES, n),
+            'region': rng.choice(REGIONS, n),
+        }
+
+    def dates(n, low, high):
+        return np.datetime_as_string(today + rng.integers(low, high, n).astype('timedelta64[D]'), unit='D')
+
+    ids = np.arange(1, n_students + 1).astype(str)
+    students = pd.DataFrame({
+        'student_id': np.char.add('S', np.char.zfill(ids, 8)),
+        'name': np.char.add('Student ', ids),
+        **scope_columns(n_students),
+        'homework_submitted': rng.random(n_students) < 0.8,
+        'homework_date': dates(n_students, -14, 1),
+        'quiz_score': rng.integers(30, 101, n_students),
+        'quiz_date': dates(n_students, -30, 1),
+    })
+    quiz_ids = np.arange(1, n_quizzes + 1).astype(str)
+    quizzes = pd.DataFrame({
+        'quiz_id': np.char.add('Q', np.char.zfill(quiz_ids, 8)),
+        'title': np.char.add(np.char.add(rng.choice(QUIZ_SUBJECTS, n_quizzes), ' Quiz '), quiz_ids),
+        **scope_columns(n_quizzes),
+        'scheduled_date': dates(n_quizzes, -14, 15),
+        'status': 'upcoming',
+    })
+    quizzes.loc[quizzes['scheduled_date'] < str(today), 'status'] = 'completed'
+    return students, quizzes
+
+
+def write_dataset(students, quizzes, directory, fmt='json'):
+    """Write a generated dataset as JSON, JSON lines, a columnar store or SQLite and return the DATA_FILE path."""
+    if fmt == 'jsonl':
+        jsonl_path = os.path.join(directory, 'data.jsonl')
+        with open(jsonl_path, 'w', encoding='utf-8') as f:
+            for table, df in (('students', students), ('quizzes', quizzes)):
+                for line in df.to_json(orient='records', lines=True).splitlines():
+                    f.write(f'{{"table": "{table}", "record": {line}}}\n')
+        return jsonl_path
+    json_path = os.path.join(directory, 'data.json')
+    with open(json_path, 'w', encoding='utf-8') as f:
+        f.write('{"students": ')
+        f.write(students.to_json(orient='records'))
+        f.write(', "quizzes": ')
+        f.write(quizzes.to_json(orient='records'))
+        f.write('}')
+    if fmt == 'json':
+        return json_path
+    if fmt == 'columnar':
+        store_path = os.path.join(directory, 'data_store')
+        convert_json_to_columnar(json_path, store_path)
+        return store_path
+    if fmt == 'sqlite':
+        db_path = os.path.join(directory, 'data.db')
+        convert_json_to_sqlite(json_path, db_path)
+        return db_path
+    raise ValueError(f"Unknown dataset format: {fmt}")
+
+
+def synthetic_admins():
+    """Admins covering the scope shapes seen in practice, from one class to the whole platform."""
+    return [
+        AdminRole("bench_grade_region", "Grade + region", grade=8, region="North"),
+        AdminRole("bench_class", "Single class", grade=9, class_section="B", region="South"),
+        AdminRole("bench_grade", "Whole grade", grade=10),
+        AdminRole("bench_region", "Whole region", region="East"),
+        AdminRole("bench_multi", "Several grades", grade=[6, 7, 8], region=["West", "Central"]),
+        AdminRole("bench_all", "Platform", grade=None),
+    ]
+
+
+def summarize_latencies(samples, wall_seconds=None):
+    """Latency percentiles in milliseconds plus throughput (calls per second)."""
+    samples_ms = np.asarray(samples, dtype=float) * 1000
+    wall_seconds = wall_seconds if wall_seconds is not None else samples_ms.sum() / 1000
+    return {
+        'count': int(len(samples_ms)),
+        'mean_ms': round(float(samples_ms.mean()), 4),
+        'p50_ms': round(float(np.percentile(samples_ms, 50)), 4),
+        'p95_ms': round(float(np.percentile(samples_ms, 95)), 4),
+        'p99_ms': round(float(np.percentile(samples_ms, 99)), 4),
+        'throughput_per_s': round(len(samples_ms) / wall_seconds, 2) if wall_seconds else None,
+    }
+
+
+def _time_calls(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _peak_memory(fn):
+    """Run fn under tracemalloc and return (result, peak traced bytes)."""
+    tracemalloc.start()
+    try:
+        result = fn()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def estimate_dict_bytes(df, sample=DICT_SIZE_SAMPLE):
+    """Extrapolated size of df held as a list of record dicts, the layout the compact tables replace."""
+    if df.empty:
+        return 0
+    head = df.head(sample)
+    records = head.to_dict(orient='records')
+    return int(dict_records_nbytes(records) * len(df) / len(head))
+
+
+def _first_grade(admin):
+    grades = admin.get_policy().grades
+    return grades[0] if grades else 8
+
+
+def benchmark_queries(dm, admins, repeat):
+    """Time each query method, RBAC filtering and aggregates over every admin."""
+    analytics = Analytics(dm)
+    students_df = getattr(dm, 'students_df', None)
+    cases = {
+        'get_filtered_students': lambda admin: dm.get_filtered_students(admin),
+        'get_filtered_quizzes': lambda admin: dm.get_filtered_quizzes(admin),
+        'query_students_no_homework': lambda admin: dm.query_students_no_homework(admin),
+        'query_performance_by_grade': lambda admin: dm.query_performance_by_grade(admin, _first_grade(admin)),
+        'query_upcoming_quizzes': lambda admin: dm.query_upcoming_quizzes(admin),
+        'analytics_score_stats': lambda admin: analytics.score_stats(admin, 'class'),
+        'analytics_top_k': lambda admin: analytics.top_k(admin, 10, ascending=True),
+    }
+    if students_df is not None:
+        # Full-table vectorized mask, i.e. RBAC without the cached scope index
+        cases['rbac_mask_scan'] = lambda admin: admin.get_policy().row_index(students_df)
+
+    stages = {}
+    for name, case in cases.items():
+        samples = []
+        for admin in admins:
+            samples += _time_calls(lambda: case(admin), repeat)
+        stages[name] = summarize_latencies(samples)
+    return stages
+
+
+def benchmark_parallel_queries(dm, admins, repeat, concurrency):
+    """Issue the scoped queries from `concurrency` threads at once, as concurrent sessions would."""
+    calls = [
+        call
+        for admin in admins
+        for call in (
+            lambda admin=admin: dm.get_filtered_students(admin),
+            lambda admin=admin: dm.query_performance_by_grade(admin, _first_grade(admin)),
+        )
+    ] * repeat
+
+    def timed(call):
+        start = time.perf_counter()
+        call()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(timed, calls))
+    return summarize_latencies(samples, wall_seconds=time.perf_counter() - start)
+
+
+def benchmark_agent(dm, admins, rounds, concurrency, llm_latency, local_answers):
+    """Replay QUESTIONS through QueryAgent.aquery against the stub LLM with `concurrency` agents."""
+    server, base_url = start_stub_server(latency=llm_latency)
+    try:
+        llm = get_shared_llm('sk-benchmark', base_url=base_url)
+        agents = []
+        for i in range(concurrency):
+            agent = QueryAgent(dm, admins[i % len(admins)], 'sk-benchmark', llm=llm)
+            agent.agent_executor.verbose = False
+            if not local_answers:
+                agent.router = None
+                agent.cache = None
+            agents.append(agent)
+
+        async def run_agent(agent):
+            samples = []
+            for _ in range(rounds):
+                for question in QUESTIONS:
+                    start = time.perf_counter()
+                    await agent.aquery(question.format(grade=_first_grade(agent.admin_role)))
+                    samples.append(time.perf_counter() - start)
+            return samples
+
+        async def run_all():
+            return await asyncio.gather(*(run_agent(agent) for agent in agents))
+
+        start = time.perf_counter()
+        results = run_coroutine(run_all())
+        wall = time.perf_counter() - start
+        return summarize_latencies([s for samples in results for s in samples], wall_seconds=wall)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def run_benchmark(students=10000, quizzes=None, fmt='json', repeat=5, agent_rounds=1, concurrency=4,
+                  llm_latency=0.0, local_answers=True, seed=0, directory=None, workers=0):
+    """Generate a dataset, run every benchmark stage and return a JSON-serializable report.
+
+    With workers > 0 the queries run through a ProcessDataManager pool of that many processes.
+    """
+    admins = synthetic_admins()
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        start = time.perf_counter()
+        students_df, quizzes_df = generate_dataset(students, quizzes, seed=seed)
+        data_file = write_dataset(students_df, quizzes_df, tmp, fmt)
+        generate_seconds = time.perf_counter() - start
+        n_quizzes = len(quizzes_df)
+        record_dicts_bytes = estimate_dict_bytes(students_df) + estimate_dict_bytes(quizzes_df)
+        del students_df, quizzes_df
+
+        # Time the load untraced; tracemalloc slows allocation-heavy code, so the peak memory
+        # comes from a second, separate load
+        start = time.perf_counter()
+        dm = open_data_manager(data_file)
+        load_seconds = time.perf_counter() - start
+        traced_dm, load_peak = _peak_memory(lambda: open_data_manager(data_file))
+        if hasattr(traced_dm, 'pool'):
+            traced_dm.pool.close()
+        del traced_dm
+        dm = serve_in_processes(dm, workers)
+
+        stages = {'load': summarize_latencies([load_seconds])}
+        stages.update(benchmark_queries(dm, admins, repeat))
+        stages['parallel_queries'] = benchmark_parallel_queries(dm, admins, repeat, max(workers, concurrency))
+        if agent_rounds:
+            stages['agent_replay'] = benchmark_agent(dm, admins, agent_rounds, concurrency, llm_latency, local_answers)
+        memory = {
+            'load_peak_traced_bytes': load_peak,
+            'record_dicts_bytes': record_dicts_bytes,
+            'data_memory_bytes': dm.memory_usage_bytes(),
+            'max_rss_bytes': _max_rss_bytes(),
+        }
+        if workers:
+            memory['shared_memory_bytes'] = dm.get_metrics()['shared_memory_bytes']
+            dm.close()
+        if hasattr(dm, 'pool'):
+            dm.pool.close()
+
+    return {
+        'config': {
+            'students': students, 'quizzes': n_quizzes, 'format': fmt, 'repeat': repeat,
+            'agent_rounds': agent_rounds, 'concurrency': concurrency, 'llm_latency': llm_latency,
+            'local_answers': local_answers, 'seed': seed, 'workers': workers,
+        },
+        'environment': {
+            'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'machine': platform.machine(), 'generated_at': datetime.now().isoformat(timespec='seconds'),
+        },
+        'generate_seconds': round(generate_seconds, 3),
+        'stages': stages,
+        'memory': memory,
+    }
+
+
+def _max_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def compare_to_baseline(report, baseline, tolerance=0.2):
+    """Return a message for each stage whose p50 or p95 latency regressed beyond tolerance."""
+    if report['config'] != baseline.get('config'):
+        logger.warning("Baseline was recorded with a different configuration; comparison may be misleading")
+    regressions = []
+    for name, stats in report['stages'].items():
+        base = baseline.get('stages', {}).get(name)
+        if not base:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            now, before = stats[metric], base[metric]
+            if now > before * (1 + tolerance) and now - before > MIN_REGRESSION_MS:
+                regressions.append(f"{name} {metric}: {before:.3f} -> {now:.3f} ({now / before - 1:+.0%})")
+    return regressions
+
+
+def format_report(report):
+    """Plain-text table of the stage statistics and memory figures."""
+    lines = [f"{'stage':<28}{'count':>7}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'ops/s':>11}"]
+    for name, stats in report['stages'].items():
+        lines.append(
+            f"{name:<28}{stats['count']:>7}{stats['p50_ms']:>11.3f}{stats['p95_ms']:>11.3f}"
+            f"{stats['p99_ms']:>11.3f}{stats['throughput_per_s'] or 0:>11.1f}"
+        )
+    memory = report['memory']
+    lines.append(
+        f"memory: load peak {memory['load_peak_traced_bytes'] / 2**20:.1f} MB, "
+        f"data {memory['data_memory_bytes'] / 2**20:.1f} MB "
+        f"(vs {memory.get('record_dicts_bytes', 0) / 2**20:.1f} MB as record dicts), "
+        f"max RSS {memory['max_rss_bytes'] / 2**20:.1f} MB"
+    )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark data loading, queries, RBAC and the agent.")
+    parser.add_argument("--students", type=int, default=10000, help="Synthetic students (10k to 10M)")
+    parser.add_argument("--quizzes", type=int, default=None, help="Synthetic quizzes (default students/10)")
+    parser.add_argument("--format", choices=['json', 'jsonl', 'columnar', 'sqlite'], default='json')
+    parser.add_argument("--repeat", type=int, default=5, help="Calls per query method and admin")
+    parser.add_argument("--agent-rounds", type=int, default=1, help="Replays of the question set per agent (0 skips)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Agents replaying questions concurrently")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Artificial stub LLM delay per call")
+    parser.add_argument("--no-local-answers", action="store_true", help="Disable the intent router and response cache")
+    parser.add_argument("--workers", type=int, default=0, help="Query worker processes (0 runs queries in-process)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="Where to write the temporary dataset")
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--save-baseline", help="Write the report as the new baseline")
+    parser.add_argument("--compare", help="Compare against a saved baseline; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown vs the baseline")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    report = run_benchmark(
+        students=args.students, quizzes=args.quizzes, fmt=args.format, repeat=args.repeat,
+        agent_rounds=args.agent_rounds, concurrency=args.concurrency, llm_latency=args.llm_latency_ms / 1000,
+        local_answers=not args.no_local_answers, seed=args.seed, directory=args.workdir, workers=args.workers,
+    )
+    print(format_report(report))
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {path}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        print(f"{len(regressions)} regressions vs {args.compare}")
+        sys.exit(1 if regressions else 0)
@@ -9,9 +9,15 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
 OPENAI_TEMPERATURE = float(os.getenv('OPENAI_TEMPERATURE', '0'))
 OPENAI_TIMEOUT = int(os.getenv('OPENAI_TIMEOUT', '30'))
+# Point at a local stub server (see stub_llm_server.py) for offline benchmarks
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '20'))
 
 # Data Configuration
 DATA_FILE = os.getenv('DATA_FILE', 'data.json')
+# Records validated and encoded per chunk while loading, and JSON-lines load processes (0 = auto)
+LOAD_CHUNK_SIZE = int(os.getenv('LOAD_CHUNK_SIZE', '50000'))
+LOAD_WORKERS = int(os.getenv('LOAD_WORKERS', '0'))
 
 # Application Configuration
 APP_TITLE = "Dumroo Admin Panel - AI Query System"
@@ -22,3 +28,45 @@ LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 MAX_QUERY_LENGTH = int(os.getenv('MAX_QUERY_LENGTH', '500'))
 DAYS_BACK_DEFAULT = int(os.getenv('DAYS_BACK_DEFAULT', '7'))
 DAYS_AHEAD_DEFAULT = int(os.getenv('DAYS_AHEAD_DEFAULT', '7'))
+
+# Conversation memory: recent exchanges kept verbatim, older ones summarized
+MEMORY_RECENT_EXCHANGES = int(os.getenv('MEMORY_RECENT_EXCHANGES', '4'))
+MEMORY_MAX_TOKENS = int(os.getenv('MEMORY_MAX_TOKENS', '1500'))
+
+# Tool output size limits for the LLM context
+TOOL_OUTPUT_TOKEN_BUDGET = int(os.getenv('TOOL_OUTPUT_TOKEN_BUDGET', '800'))
+TOOL_OUTPUT_PAGE_SIZE = int(os.getenv('TOOL_OUTPUT_PAGE_SIZE', '25'))
+# Rows shown in answers given locally, without the LLM
+LOCAL_ANSWER_MAX_ROWS = int(os.getenv('LOCAL_ANSWER_MAX_ROWS', '50'))
+
+# Answer common questions locally without calling the LLM
+INTENT_ROUTER_ENABLED = os.getenv('INTENT_ROUTER_ENABLED', 'true').lower() == 'true'
+
+# Response cache for repeated questions
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1024'))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '900'))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv('RESPONSE_CACHE_SIMILARITY', '0.85'))
+
+# SQLite backend (used when DATA_FILE ends in .db/.sqlite/.sqlite3)
+SQL_POOL_SIZE = int(os.getenv('SQL_POOL_SIZE', '8'))
+SQL_CACHE_KB = int(os.getenv('SQL_CACHE_KB', '16384'))
+
+# Tracing and metrics export (see tracing.py)
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'true').lower() == 'true'
+TRACE_LOG_FILE = os.getenv('TRACE_LOG_FILE') or None
+TRACE_HISTORY = int(os.getenv('TRACE_HISTORY', '50'))
+# Print AgentExecutor chain steps to stdout; tracing replaces this for timing questions
+AGENT_VERBOSE = os.getenv('AGENT_VERBOSE', 'false').lower() == 'true'
+# Show the Streamlit debug panel (per-stage timings, tokens, metrics export) by default
+DEBUG_PANEL_DEFAULT = os.getenv('DEBUG_PANEL', 'false').lower() == 'true'
+
+# Batch reports: concurrent LLM questions
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '8'))
+
+# Multi-process query serving (process_pool.py); 0 runs queries in the app process
+SERVING_WORKERS = int(os.getenv('SERVING_WORKERS', '0'))
+
+# Headless API (api.py)
+API_WARMUP = os.getenv('API_WARMUP', 'true').lower() == 'true'
+API_MAX_SESSIONS = int(os.getenv('API_MAX_SESSIONS', '256'))
@@ -0,0 +1,109 @@
+"""Bounded conversation memory: recent exchanges verbatim, older turns in a rolling summary."""
+import re
+import logging
+from typing import Any, Dict
+from langchain.chains import LLMChain
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.messages import get_buffer_string
+
+logger = logging.getLogger(__name__)
+
+_tokenizer_available = True
+
+_CODE_BLOCK = re.compile(r"```.*?```", re.DOTALL)
+_MARKDOWN_TABLE = re.compile(r"(?:^[ \t]*\|.*\|[ \t]*(?:\n|$)){3,}", re.MULTILINE)
+
+
+def count_tokens(llm, messages=None, text=None):
+    """Token count from the model's tokenizer, or a ~4 characters/token estimate when it is unavailable.
+    
+    tiktoken downloads its encodings on first use, so offline deployments fall back to the estimate.
+    """
+    global _tokenizer_available
+    if _tokenizer_available:
+        try:
+            return llm.get_num_tokens_from_messages(messages) if messages is not None else llm.get_num_tokens(text)
+        except Exception as e:
+            logger.warning(f"Tokenizer unavailable, estimating token counts: {str(e)}")
+            _tokenizer_available = False
+    if messages is not None:
+        return sum(len(str(m.content)) // 4 + 4 for m in messages)
+    return len(text) // 4
+
+
+def _table_reference(block):
+    rows = max(len([line for line in block.strip('`').strip().splitlines() if line.strip()]) - 1, 0)
+    return f"[table with {rows} rows omitted from history; re-run the lookup to see it]"
+
+
+def compact_message(text):
+    """Replace code-fenced and markdown tables with a short reference to keep history small."""
+    if not isinstance(text, str):
+        return text
+    text = _CODE_BLOCK.sub(lambda m: _table_reference(m.group(0)), text)
+    return _MARKDOWN_TABLE.sub(lambda m: _table_reference(m.group(0)) + "\n", text)
+
+
+class BoundedSummaryMemory(ConversationSummaryBufferMemory):
+    """Keeps the last `k` exchanges verbatim within `max_token_limit`, summarizing older turns.
+
+    Pruning is deferred until history is loaded for an LLM call, so answers served from the
+    cache or the intent router never trigger a summarization round-trip.
+    """
+
+    k: int = 4
+    last_history_tokens: int = 0
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        """Save the exchange with large tables replaced by compact references."""
+        outputs = {key: compact_message(value) for key, value in outputs.items()}
+        # Skip ConversationSummaryBufferMemory.save_context, which prunes (and may call the LLM) eagerly
+        super(ConversationSummaryBufferMemory, self).save_context(inputs, outputs)
+
+    async def asave_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        """Async save_context: same compaction, pruning still deferred to the next history load."""
+        self.save_context(inputs, outputs)
+
+    def _history_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        variables = super().load_memory_variables(inputs)
+        history = variables[self.memory_key]
+        self.last_history_tokens = (
+            count_tokens(self.llm, messages=history) if self.return_messages else count_tokens(self.llm, text=history)
+        )
+        return variables
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        self.prune()
+        return self._history_variables(inputs)
+
+    async def aload_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        await self.aprune()
+        return self._history_variables(inputs)
+
+    def _pop_excess(self):
+        """Remove and return whole exchanges beyond `k` or over the token budget, oldest first."""
+        buffer = self.chat_memory.messages
+        pruned = []
+        while buffer and (
+            len(buffer) > 2 * self.k
+            or count_tokens(self.llm, messages=buffer) > self.max_token_limit
+        ):
+            pruned.extend(buffer[:2])
+            del buffer[:2]
+        return pruned
+
+    def prune(self) -> None:
+        """Move whole exchanges beyond `k` or over the token budget into the rolling summary."""
+        pruned = self._pop_excess()
+        if pruned:
+            self.moving_summary_buffer = self.predict_new_summary(pruned, self.moving_summary_buffer)
+            logger.info(f"Summarized {len(pruned)} older messages into conversation summary")
+
+    async def aprune(self) -> None:
+        """Async prune: the same exchanges are summarized without blocking the event loop."""
+        pruned = self._pop_excess()
+        if pruned:
+            new_lines = get_buffer_string(pruned, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+            chain = LLMChain(llm=self.llm, prompt=self.prompt)
+            self.moving_summary_buffer = await chain.apredict(summary=self.moving_summary_buffer, new_lines=new_lines)
+            logger.info(f"Summarized {len(pruned)} older messages into conversation summary")
@@ -1,100 +1,419 @@
 """Data management with role-based filtering."""
-import json
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 import logging
 import os
+import threading
+import time
+from access_control import SCOPE_COLUMNS, AccessPolicy
+from records import ColumnTable
+from sql_backend import SQL_SUFFIXES, SqlDataManager
+from storage import KEY_COLUMNS, MANIFEST_FILE, TABLES, normalize_table, open_backend, read_change_feed
+from tracing import annotate, traced
 
 logger = logging.getLogger(__name__)
 
 
+def build_partition_index(df):
+    """Map each (grade, class, region) partition to its row positions in df."""
+    if df.empty or any(col not in df.columns for col in SCOPE_COLUMNS):
+        return {}
+    return df.groupby(SCOPE_COLUMNS, sort=False, dropna=False, observed=True).indices
+
+
+def data_signature(data_file):
+    """Cheap change stamp for a data file or columnar store: (mtime_ns, size) of its entry point."""
+    path = data_file
+    if os.path.isdir(data_file):
+        path = os.path.join(data_file, MANIFEST_FILE)
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def open_data_manager(data_file):
+    """Pick the DataManager implementation for a data path: SQLite by suffix, otherwise in-memory."""
+    if data_file.lower().endswith(SQL_SUFFIXES):
+        return SqlDataManager(data_file)
+    return DataManager(data_file)
+
+
+def _partition_keys(df, rows):
+    """(grade, class, region) partition key of each row position."""
+    columns = [df[col].to_numpy()[rows] for col in SCOPE_COLUMNS]
+    return list(zip(*columns))
+
+
+def _merged_column(column, rows, updates, appended):
+    """New column with `updates` written at row positions `rows` and `appended` added at the end.
+    
+    `column` itself is never modified, since older snapshots may still be reading it. A column
+    whose updated values are unchanged and that gains no rows is returned as is, so it keeps
+    sharing its array (or memory-mapped file) with the previous snapshot.
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        incoming = pd.Index(np.concatenate([updates.to_numpy(dtype=object), appended.to_numpy(dtype=object)]))
+        added = incoming.dropna().unique().difference(column.cat.categories)
+        dtype = pd.CategoricalDtype(column.cat.categories.append(added)) if len(added) else column.dtype
+        old_codes = column.cat.codes.to_numpy()
+        update_codes = pd.Categorical(updates, dtype=dtype).codes
+        if not len(appended) and np.array_equal(old_codes[rows], update_codes):
+            return column
+        codes = np.concatenate([old_codes, pd.Categorical(appended, dtype=dtype).codes],
+                               dtype=np.result_type(old_codes, update_codes))
+        codes[rows] = update_codes
+        return pd.Series(pd.Categorical.from_codes(codes, dtype=dtype), name=column.name)
+    
+    if not len(appended) and pd.Series(column.to_numpy()[rows]).equals(pd.Series(updates.to_numpy())):
+        return column
+    if len(appended):
+        merged = pd.concat([column, appended], ignore_index=True)
+    else:
+        merged = column.reset_index(drop=True).copy()
+    merged.iloc[rows] = updates.to_numpy()
+    return merged
+
+
+class _Snapshot:
+    """Immutable tables plus their indexes and caches; replaced wholesale on ingestion."""
+    
+    def __init__(self, tables, partitions, revision=0, partition_revisions=None):
+        self.tables = tables
+        self.partitions = partitions
+        self.revision = revision
+        self.partition_revisions = partition_revisions or {}
+        self.scope_rows = {}
+        self.date_indexes = {}
+        self.scope_versions = {}
+        self.materialized = {}
+        self.key_indexes = {}
+
+
 class DataManager:
-    """Manages data access with role-based filtering."""
+    """Manages data access with role-based filtering.
     
-    def __init__(self, data_file="data.json"):
-        if not os.path.exists(data_file):
-            raise FileNotFoundError(f"Data file not found: {data_file}")
-        
+    Tables and indexes live in an immutable snapshot. Readers use whichever snapshot is current
+    when a query starts, and ingest() swaps in a new one, so one instance can be shared by every
+    session in the process and updated without pausing queries.
+    """
+    
+    def __init__(self, data_file="data.json", backend=None):
+        start = time.perf_counter()
         try:
-            with open(data_file, 'r', encoding='utf-8') as f:
-                self.data = json.load(f)
-            
-            if 'students' not in self.data or 'quizzes' not in self.data:
-                raise ValueError("Invalid data format: missing 'students' or 'quizzes' key")
-            
-            self.students_df = pd.DataFrame(self.data['students'])
-            self.quizzes_df = pd.DataFrame(self.data['quizzes'])
+            self.data_file = data_file
+            self.signature = data_signature(data_file) if os.path.exists(data_file) else None
+            self.backend = backend or open_backend(data_file)
+            tables = self.backend.load()
+            self._snapshot = _Snapshot(
+                tables,
+                {table: build_partition_index(df) for table, df in tables.items()},
+            )
+            self._ingest_lock = threading.Lock()
+            self.load_seconds = time.perf_counter() - start
             logger.info(f"DataManager initialized with {len(self.students_df)} students and {len(self.quizzes_df)} quizzes")
-        except json.JSONDecodeError as e:
-            logger.error(f"Invalid JSON in data file: {str(e)}")
+        except FileNotFoundError:
             raise
         except Exception as e:
             logger.error(f"Error loading data: {str(e)}")
             raise
     
+    @property
+    def students_df(self):
+        return self._snapshot.tables['students']
+    
+    @property
+    def quizzes_df(self):
+        return self._snapshot.tables['quizzes']
+    
+    @property
+    def data_version(self):
+        """Stamp identifying the loaded data; changes when the source file changes or records are ingested."""
+        base = f"{self.signature[0]}-{self.signature[1]}" if self.signature else "unversioned"
+        revision = self._snapshot.revision
+        return f"{base}.{revision}" if revision else base
+    
+    def scope_version(self, admin_role):
+        """Data version as seen by one scope; only changes when ingestion touches that scope's partitions."""
+        snap = self._snapshot
+        policy = admin_role.get_policy()
+        version = snap.scope_versions.get(policy.key)
+        if version is None:
+            revision = max(
+                (rev for (table, partition), rev in snap.partition_revisions.items() if policy.matches(partition)),
+                default=0,
+            )
+            base = f"{self.signature[0]}-{self.signature[1]}" if self.signature else "unversioned"
+            version = f"{base}.{revision}" if revision else base
+            snap.scope_versions[policy.key] = version
+        return version
+    
+    def memory_usage_bytes(self):
+        """Approximate in-memory size of the loaded tables."""
+        return int(self.students_df.memory_usage(deep=True).sum() + self.quizzes_df.memory_usage(deep=True).sum())
+    
+    def get_metrics(self):
+        """Load-time and memory metrics for monitoring."""
+        return {
+            'data_version': self.data_version,
+            'students': len(self.students_df),
+            'quizzes': len(self.quizzes_df),
+            'load_seconds': round(self.load_seconds, 4),
+            'memory_bytes': self.memory_usage_bytes(),
+            'cached_scopes': len(self._snapshot.scope_rows),
+            'rejected_records': sum(getattr(self.backend, 'rejected', {}).values()),
+        }
+    
+    def materialized(self, name, build):
+        """Return build(tables) cached on the current snapshot, so derived tables refresh whenever data changes."""
+        snap = self._snapshot
+        value = snap.materialized.get(name)
+        if value is None:
+            value = build(snap.tables)
+            snap.materialized[name] = value
+            logger.debug(f"Materialized {name} at revision {snap.revision}")
+        return value
+    
+    def _resolve_scope(self, snap, table, admin_role):
+        """Return sorted row positions of `table` visible to this admin, cached per scope."""
+        policy = admin_role.get_policy()
+        key = (table, policy.key)
+        rows = snap.scope_rows.get(key)
+        if rows is None:
+            partitions = snap.partitions[table]
+            if partitions:
+                matching = [positions for partition, positions in partitions.items() if policy.matches(partition)]
+                rows = np.sort(np.concatenate(matching)) if matching else np.empty(0, dtype=np.intp)
+            else:
+                rows = policy.row_index(snap.tables[table])
+            snap.scope_rows[key] = rows
+        return rows
+    
+    def _date_index(self, snap, table, admin_role, column):
+        """Return (row positions, dates) of the admin's scope sorted by `column`, cached per scope.
+        
+        NaT dates sort last and are counted separately so windows never include them.
+        """
+        key = (table, admin_role.get_policy().key, column)
+        index = snap.date_indexes.get(key)
+        if index is None:
+            rows = self._resolve_scope(snap, table, admin_role)
+            dates = snap.tables[table][column].to_numpy(dtype='datetime64[ns]')[rows]
+            order = np.argsort(dates, kind='stable')
+            valid = int(np.count_nonzero(~np.isnat(dates)))
+            index = (rows[order], dates[order], valid)
+            snap.date_indexes[key] = index
+        return index
+    
+    def _rows_in_window(self, snap, table, admin_role, column, start=None, end=None):
+        """Positions (in original order) of scoped rows with start <= column <= end, via binary search."""
+        positions, dates, valid = self._date_index(snap, table, admin_role, column)
+        lo = 0 if start is None else np.searchsorted(dates[:valid], np.datetime64(start, 'ns'), side='left')
+        hi = valid if end is None else np.searchsorted(dates[:valid], np.datetime64(end, 'ns'), side='right')
+        return np.sort(positions[lo:hi])
+    
+    def _take(self, df, rows):
+        if len(rows) == 0:
+            return pd.DataFrame()
+        return df.take(rows).reset_index(drop=True)
+    
+    def _filtered(self, table, admin_role):
+        snap = self._snapshot
+        rows = self._resolve_scope(snap, table, admin_role)
+        annotate(rows_scanned=len(rows))
+        return self._take(snap.tables[table], rows)
+    
+    @traced('data.get_filtered_students')
     def get_filtered_students(self, admin_role):
         """Get students accessible to this admin."""
         try:
-            filtered = [s for s in self.data['students'] if admin_role.can_access_student(s)]
+            filtered = self._filtered('students', admin_role)
             logger.debug(f"Filtered {len(filtered)} students for admin {admin_role.admin_id}")
-            return pd.DataFrame(filtered) if filtered else pd.DataFrame()
+            return filtered
         except Exception as e:
             logger.error(f"Error filtering students: {str(e)}")
             return pd.DataFrame()
     
+    @traced('data.get_filtered_quizzes')
     def get_filtered_quizzes(self, admin_role):
         """Get quizzes accessible to this admin."""
         try:
-            filtered = [q for q in self.data['quizzes'] if admin_role.can_access_quiz(q)]
+            filtered = self._filtered('quizzes', admin_role)
             logger.debug(f"Filtered {len(filtered)} quizzes for admin {admin_role.admin_id}")
-            return pd.DataFrame(filtered) if filtered else pd.DataFrame()
+            return filtered
         except Exception as e:
             logger.error(f"Error filtering quizzes: {str(e)}")
             return pd.DataFrame()
     
+    def iter_records(self, table, admin_role):
+        """Yield the admin's rows of `table` as slotted StudentRecord/QuizRecord objects, in row order.
+        
+        Records are built one at a time from the column arrays, so no per-row dicts are kept.
+        """
+        snap = self._snapshot
+        rows = self._resolve_scope(snap, table, admin_role)
+        return ColumnTable.from_frame(snap.tables[table], table).records(rows)
+    
+    @traced('data.query_students_no_homework')
     def query_students_no_homework(self, admin_role):
         """Find students who haven't submitted homework."""
         df = self.get_filtered_students(admin_role)
+        annotate(rows_scanned=len(df))
         if df.empty:
             return df
         return df[df['homework_submitted'] == False]
     
+    @traced('data.query_performance_by_grade')
     def query_performance_by_grade(self, admin_role, grade, days_back=7):
         """Get performance data for a specific grade from recent days."""
         try:
-            df = self.get_filtered_students(admin_role)
-            if df.empty:
-                return df
-            
+            snap = self._snapshot
+            df = snap.tables['students']
             cutoff_date = datetime.now() - timedelta(days=days_back)
-            df['quiz_date'] = pd.to_datetime(df['quiz_date'], errors='coerce')
-            
-            result = df[
-                (df['grade'] == grade) & 
-                (df['quiz_date'] >= cutoff_date)
-            ]
-            return result
+            rows = self._rows_in_window(snap, 'students', admin_role, 'quiz_date', start=cutoff_date)
+            annotate(rows_scanned=len(rows))
+            rows = rows[(df['grade'].to_numpy()[rows] == grade)]
+            return self._take(df, rows)
         except Exception as e:
             logger.error(f"Error querying performance data: {str(e)}")
             return pd.DataFrame()
     
+    @traced('data.query_upcoming_quizzes')
     def query_upcoming_quizzes(self, admin_role, days_ahead=7):
         """Get upcoming quizzes scheduled within next N days."""
         try:
-            df = self.get_filtered_quizzes(admin_role)
-            if df.empty:
-                return df
-            
+            snap = self._snapshot
+            df = snap.tables['quizzes']
             today = datetime.now()
             future_date = today + timedelta(days=days_ahead)
-            df['scheduled_date'] = pd.to_datetime(df['scheduled_date'], errors='coerce')
-            
-            result = df[
-                (df['scheduled_date'] >= today) & 
-                (df['scheduled_date'] <= future_date) &
-                (df['status'] == 'upcoming')
-            ]
-            return result
+            rows = self._rows_in_window(snap, 'quizzes', admin_role, 'scheduled_date', start=today, end=future_date)
+            annotate(rows_scanned=len(rows))
+            rows = rows[(df['status'].to_numpy()[rows] == 'upcoming')]
+            return self._take(df, rows)
         except Exception as e:
             logger.error(f"Error querying upcoming quizzes: {str(e)}")
             return pd.DataFrame()
+    
+    def _upsert_table(self, snap, table, records):
+        """Return (new frame, new partition index, touched partition keys) with records upserted by id.
+        
+        Existing rows keep their positions and new rows are appended, so only the partitions that
+        gained, lost or changed rows need their position arrays rebuilt. Only the incoming records
+        are normalized, and columns the records leave unchanged are shared with the old snapshot.
+        A field a record leaves out keeps the row's current value, whatever other records in the
+        batch contain; several records for one id are applied in order.
+        """
+        key_col = KEY_COLUMNS[table]
+        df = snap.tables[table]
+        combined = {}
+        for record in records:
+            combined.setdefault(record.get(key_col), {}).update(record)
+        records = list(combined.values())
+        incoming = normalize_table(pd.DataFrame(records), table)
+        keys = snap.key_indexes.get(table)
+        if keys is None:
+            keys = snap.key_indexes[table] = pd.Index(df[key_col])
+        positions = keys.get_indexer(incoming[key_col]) if len(df) else np.full(len(incoming), -1)
+        is_new = positions < 0
+        updated_rows = positions[~is_new]
+        
+        incoming = incoming.reindex(columns=df.columns.append(incoming.columns.difference(df.columns)))
+        updates, appended = incoming[~is_new], incoming[is_new]
+        columns = {}
+        for col in incoming.columns:
+            if col in df.columns:
+                column = df[col]
+            else:
+                # A field the table has not seen yet: existing rows get missing values
+                column = appended[col].iloc[:0].reindex(range(len(df)))
+            # Existing rows whose record leaves this field out keep their old value
+            given = np.fromiter((col in record for record in records), dtype=bool, count=len(records))
+            update_given = given[~is_new]
+            update_rows, update_values = updated_rows[update_given], updates[col]
+            if not update_given.any():
+                update_values = column.iloc[:0]
+            elif not update_given.all():
+                # Rebuilt from the records that have the field, so other records' gaps don't change its type
+                picked = [records[i][col] for i in np.flatnonzero(given & ~is_new)]
+                update_values = normalize_table(pd.DataFrame({col: picked}), table)[col]
+            if given.any():
+                new_values = appended[col]
+            else:
+                # No record has this field: keep the column's type for the missing values of new rows
+                new_values = column.iloc[:0].reindex(range(len(appended)))
+            columns[col] = _merged_column(column, update_rows, update_values, new_values)
+        merged = pd.DataFrame(
+            {col: values.array if isinstance(values.dtype, pd.CategoricalDtype) else values.to_numpy()
+             for col, values in columns.items()},
+            index=pd.RangeIndex(len(df) + len(appended)), copy=False,
+        )
+        
+        appended_rows = np.arange(len(df), len(merged))
+        old_keys = _partition_keys(df, updated_rows) if len(updated_rows) else []
+        new_keys = _partition_keys(merged, np.concatenate([updated_rows, appended_rows]).astype(np.intp))
+        removals, additions = {}, {}
+        for row, old_key, new_key in zip(updated_rows, old_keys, new_keys):
+            if old_key != new_key:
+                removals.setdefault(old_key, []).append(row)
+                additions.setdefault(new_key, []).append(row)
+        for row, new_key in zip(appended_rows, new_keys[len(updated_rows):]):
+            additions.setdefault(new_key, []).append(row)
+        
+        partitions = dict(snap.partitions[table])
+        touched = set(old_keys) | set(new_keys)
+        for partition in set(removals) | set(additions):
+            current = partitions.get(partition, np.empty(0, dtype=np.intp))
+            current = np.setdiff1d(current, removals.get(partition, []), assume_unique=True)
+            current = np.union1d(current, np.asarray(additions.get(partition, []), dtype=np.intp))
+            if len(current):
+                partitions[partition] = current
+            else:
+                partitions.pop(partition, None)
+        return merged, partitions, touched
+    
+    def ingest(self, students=None, quizzes=None):
+        """Upsert student and/or quiz records (matched on student_id / quiz_id).
+        
+        A record may carry only some fields; the others keep their current values.
+        
+        Builds a new snapshot off to the side and swaps it in, carrying over every cached scope
+        whose partitions were not touched. Returns the number of records applied per table.
+        """
+        changes = {'students': students or [], 'quizzes': quizzes or []}
+        with self._ingest_lock:
+            snap = self._snapshot
+            revision = snap.revision + 1
+            tables = dict(snap.tables)
+            partitions = dict(snap.partitions)
+            partition_revisions = dict(snap.partition_revisions)
+            touched = set()
+            for table in TABLES:
+                if not changes[table]:
+                    continue
+                tables[table], partitions[table], table_touched = self._upsert_table(snap, table, changes[table])
+                touched |= table_touched
+                for partition in table_touched:
+                    partition_revisions[(table, partition)] = revision
+            if not touched:
+                return {table: 0 for table in TABLES}
+            
+            new_snap = _Snapshot(tables, partitions, revision, partition_revisions)
+            affected = lambda scope: any(AccessPolicy(*scope).matches(partition) for partition in touched)
+            new_snap.scope_rows = {k: v for k, v in snap.scope_rows.items() if not affected(k[1])}
+            new_snap.date_indexes = {k: v for k, v in snap.date_indexes.items() if not affected(k[1])}
+            new_snap.scope_versions = {k: v for k, v in snap.scope_versions.items() if not affected(k)}
+            # Updates keep every key at its row, so the key index stays valid until rows are appended
+            new_snap.key_indexes = {k: v for k, v in snap.key_indexes.items() if len(tables[k]) == len(snap.tables[k])}
+            self._snapshot = new_snap
+        
+        applied = {table: len(changes[table]) for table in TABLES}
+        logger.info(f"Ingested {applied} at revision {revision}, touching {len(touched)} partitions")
+        return applied
+    
+    def ingest_change_feed(self, path):
+        """Apply a JSON-lines change feed of {"table": "students"|"quizzes", "record": {...}} entries.
+        
+        Malformed lines are logged and skipped. Returns counts of applied and skipped lines.
+        """
+        changes, skipped = read_change_feed(path)
+        applied = self.ingest(**changes)
+        return {'applied': sum(applied.values()), 'skipped': skipped}
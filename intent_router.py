@@ -0,0 +1,107 @@
+"""Deterministic intent routing for common questions, answered without an LLM round-trip."""
+import re
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+RoutedIntent = namedtuple('RoutedIntent', ['name', 'confidence'])
+
+# Intent names match the QueryAgent tool names they are answered by
+INTENT_PATTERNS = {
+    'students_no_homework': [
+        r"\b(haven'?t|have not|hasn'?t|has not|didn'?t|did not|not|never|without|missing|missed|no)\b.*\bhomework\b",
+        r"\bhomework\b.*\b(missing|pending|outstanding|not (been )?submitted|unsubmitted)\b",
+    ],
+    'performance_data': [
+        r"\b(performance|scores?|results?|marks?)\b.*\bgrade\s*\d+\b",
+        r"\bgrade\s*\d+\b.*\b(performance|scores?|results?|marks?)\b",
+    ],
+    'upcoming_quizzes': [
+        r"\b(upcoming|next|scheduled|coming|future)\b.*\b(quiz|quizzes|tests?|exams?)\b",
+        r"\b(quiz|quizzes|tests?|exams?)\b.*\b(upcoming|scheduled|next week|coming up)\b",
+    ],
+    'all_students': [
+        r"\bwho are my students\b",
+        r"^\s*(please\s+)?(list|show)( me)?( all)?( of)?( my)? students\s*[?.!]?\s*$",
+        r"^\s*(all|my) students\s*[?.!]?\s*$",
+    ],
+}
+
+# Wording that signals the question needs reasoning beyond a single canned lookup
+AMBIGUITY_PATTERNS = [
+    r"\b(why|how many|compare|comparison|versus|vs\.?|average|trend|improv\w*|recommend|should|explain|except|but)\b",
+    r"\b(and|or) (also )?(show|list|tell|which|who|what)\b",
+]
+
+# Extra filters the routed lookups cannot apply; answering anyway would silently drop them
+FILTER_PATTERNS = [
+    r"\b(class(es)?|sections?|regions?)\b",
+    r"\b\d+\s*(days?|weeks?|months?|years?)\b",
+    r"\b(last|past|previous|next|this|coming)\s+(few|couple|\d+|month|year|term|semester|quarter|fortnight|days|weeks)\b",
+    r"\b(today|tomorrow|yesterday|since|until|before|after|between)\b",
+    r"\b(above|below|over|under|at least|at most|more than|less than|greater than|fewer than)\b",
+    r"\b(top|bottom|highest|lowest|best|worst|first|latest)\b",
+    r"\bgrades?\s*\d+\s*(,|and|or|to|-)\s*(grade\s*)?\d+\b",
+]
+# Capitalized word after a preposition ("for Alice", "in North"), i.e. a student name or region
+NAME_PATTERN = r"\b(for|named|called|about|in|from|of|by|with)\s+(?!(Grade|Class|Region|Quiz|Quizzes|Homework|Students?|Week|Next|Last|This|My|The|All)\b)[A-Z][a-z]+"
+# Intents whose lookup takes a grade; any other intent would ignore one
+GRADE_PATTERN = r"\bgrade\s*\d+\b"
+GRADE_INTENTS = {'performance_data'}
+
+INTENT_HEADINGS = {
+    'students_no_homework': "Students who haven't submitted their homework",
+    'performance_data': "Quiz performance data",
+    'upcoming_quizzes': "Upcoming quizzes for the next week",
+    'all_students': "Your students",
+}
+
+
+class IntentRouter:
+    """Rule-based classifier that maps common questions onto a single data lookup."""
+
+    def __init__(self, patterns=None, ambiguity_patterns=None, filter_patterns=None):
+        patterns = patterns or INTENT_PATTERNS
+        self.patterns = {
+            name: [re.compile(p, re.IGNORECASE) for p in rules]
+            for name, rules in patterns.items()
+        }
+        self.ambiguity = [re.compile(p, re.IGNORECASE) for p in (ambiguity_patterns or AMBIGUITY_PATTERNS)]
+        self.filters = [re.compile(p, re.IGNORECASE) for p in (filter_patterns or FILTER_PATTERNS)]
+        # Case-sensitive: only capitalized words look like names
+        self.filters.append(re.compile(NAME_PATTERN))
+        self.grade = re.compile(GRADE_PATTERN, re.IGNORECASE)
+
+    def _has_extra_filter(self, intent, text):
+        """Whether the question narrows the lookup in a way the intent's tool cannot apply."""
+        if any(r.search(text) for r in self.filters):
+            return True
+        grades = len(self.grade.findall(text))
+        return grades > (1 if intent in GRADE_INTENTS else 0)
+
+    def classify(self, question):
+        """Return a RoutedIntent for the question, with confidence 0 when it is not a single intent.
+
+        Questions that need reasoning or add a filter the lookup would drop get confidence 0.5.
+        """
+        text = ' '.join(question.split())
+        matched = [name for name, rules in self.patterns.items() if any(r.search(text) for r in rules)]
+        if len(matched) != 1:
+            return RoutedIntent(None, 0.0)
+        if any(r.search(text) for r in self.ambiguity) or self._has_extra_filter(matched[0], text):
+            return RoutedIntent(matched[0], 0.5)
+        return RoutedIntent(matched[0], 1.0)
+
+    def route(self, question, min_confidence=1.0):
+        """Return the intent name when the question can be answered without the LLM, else None."""
+        intent = self.classify(question)
+        if intent.name and intent.confidence >= min_confidence:
+            logger.debug(f"Routed query to intent '{intent.name}'")
+            return intent.name
+        return None
+
+
+def format_local_answer(intent, table, scope_description):
+    """Format a rendered result table as a chat answer for a routed intent."""
+    return f"**{INTENT_HEADINGS[intent]}** ({scope_description}):\n\n{table}"
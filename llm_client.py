@@ -0,0 +1,75 @@
+"""Process-wide chat model with pooled HTTP connections and a shared async event loop."""
+import asyncio
+import logging
+import threading
+import httpx
+import openai
+from langchain_openai import ChatOpenAI
+from config import (
+    OPENAI_BASE_URL,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MODEL,
+    OPENAI_TEMPERATURE,
+    OPENAI_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+_llms = {}
+_llms_lock = threading.Lock()
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_shared_llm(api_key, model=OPENAI_MODEL, base_url=OPENAI_BASE_URL):
+    """Return the ChatOpenAI instance shared by every agent using this key, model and endpoint.
+
+    The sync and async OpenAI clients each keep one pooled httpx connection pool, so
+    switching admins or opening new sessions reuses warm connections.
+    """
+    key = (api_key, model, base_url)
+    with _llms_lock:
+        llm = _llms.get(key)
+        if llm is None:
+            limits = httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+            )
+            client_params = {
+                "api_key": api_key,
+                "base_url": base_url,
+                "timeout": OPENAI_TIMEOUT,
+            }
+            llm = ChatOpenAI(
+                model=model,
+                temperature=OPENAI_TEMPERATURE,
+                api_key=api_key,
+                base_url=base_url,
+                request_timeout=OPENAI_TIMEOUT,
+                client=openai.OpenAI(http_client=httpx.Client(limits=limits), **client_params).chat.completions,
+                async_client=openai.AsyncOpenAI(
+                    http_client=httpx.AsyncClient(limits=limits), **client_params
+                ).chat.completions,
+            )
+            _llms[key] = llm
+            logger.info(f"Created shared LLM client for model {model} at {base_url or 'default endpoint'}")
+        return llm
+
+
+def get_event_loop():
+    """Background event loop that owns the shared async HTTP connections."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True).start()
+        return _loop
+
+
+def run_coroutine(coro, timeout=None):
+    """Run a coroutine on the shared event loop from synchronous code and wait for its result.
+
+    Async agent calls must run on this loop because pooled async connections are bound
+    to the loop that opened them.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result(timeout)
@@ -0,0 +1,451 @@
+"""Multi-process query serving: DataManager queries run in worker processes over shared column arrays.
+
+The parent publishes each table's columns into `multiprocessing.shared_memory` blocks
+(or, for an unmodified columnar store or a SQLite file, just hands workers the path to open).
+Workers attach to those blocks and build their DataFrames as views over them, so adding a
+worker adds its own indexes but no copy of the column arrays. String columns are
+dictionary-encoded as in the columnar store; only their category lists are sent to each
+worker. After an ingest only the changed columns are published again, and each task names
+the publication it was submitted against, so the running workers pick up new data on their
+next query instead of being restarted. ProcessDataManager keeps the DataManager interface, so QueryAgent, Analytics and
+app.py use it unchanged.
+"""
+import logging
+import multiprocessing
+import pickle
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from config import SERVING_WORKERS
+from storage import TABLES, ColumnarBackend
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+def _attach(name):
+    """Attach to an existing block without taking over its cleanup; workers only ever close() it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the block with the resource tracker. Spawned
+        # workers share the parent's tracker, so that registration is the parent's own and must
+        # not be unregistered here; the parent unlinks the block (and unregisters it) on close.
+        return shared_memory.SharedMemory(name=name)
+
+
+def _column_parts(series):
+    """(array, categories, encoded) for one column.
+
+    Strings are dictionary-encoded as in the columnar store; `encoded` marks columns that were
+    plain text in the parent, which workers decode again in the rows they return.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), series.cat.categories.tolist(), False
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.to_numpy(dtype='datetime64[ns]'), None, False
+    if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+        return series.to_numpy(), None, False
+    categorical = pd.Categorical(series)
+    return categorical.codes, categorical.categories.tolist(), True
+
+
+class _BlockRefs:
+    """Reference counts for blocks shared by successive publications; the last release unlinks."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def acquire(self, block):
+        with self._lock:
+            self._counts[block.name] = self._counts.get(block.name, 0) + 1
+
+    def release(self, block):
+        with self._lock:
+            self._counts[block.name] -= 1
+            if self._counts[block.name]:
+                return
+            del self._counts[block.name]
+        block.close()
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _pickled_block(obj):
+    """(block, size) holding obj pickled into a new shared memory block."""
+    payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    block = shared_memory.SharedMemory(create=True, size=max(len(payload), 1))
+    block.buf[:len(payload)] = payload
+    return block, len(payload)
+
+
+def _unpickle_block(name, size):
+    block = _attach(name)
+    try:
+        return pickle.loads(bytes(block.buf[:size]))
+    finally:
+        block.close()
+
+
+def _column_source(series):
+    """The parent array a published column was copied from."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.array.codes
+    return series.to_numpy()
+
+
+def _same_array(a, b):
+    return (a.__array_interface__['data'][0] == b.__array_interface__['data'][0]
+            and a.shape == b.shape and a.strides == b.strides and a.dtype == b.dtype)
+
+
+class SharedTables:
+    """Tables copied into shared memory blocks owned by the publishing process.
+
+    Publishing with a `previous` publication copies only the columns that changed since: a
+    column still backed by the same parent array reuses the previous blocks. Blocks are
+    reference counted across publications and unlinked once no publication uses them.
+    Category lists get blocks of their own, so `spec`, which describes the blocks and is
+    itself published in `spec_block`, stays small; a task only has to carry that block's
+    name to point a worker at new data.
+    """
+
+    def __init__(self, tables, version=0, previous=None):
+        self.version = version
+        self._refs = previous._refs if previous is not None else _BlockRefs()
+        reusable = previous.columns if previous is not None else {}
+        self.blocks = []
+        # (table, column) -> (dtype, source array, blocks, column spec); holding the source
+        # keeps its address from being reused while a later publication compares against it
+        self.columns = {}
+        self.spec = {}
+        self.spec_block = None
+        try:
+            for table in TABLES:
+                df = tables[table]
+                columns = []
+                for name in df.columns:
+                    series = df[name]
+                    source = _column_source(series)
+                    prior = reusable.get((table, name))
+                    if prior is not None and prior[0] == series.dtype and _same_array(prior[1], source):
+                        blocks, col = prior[2], prior[3]
+                        for block in blocks:
+                            self._own(block)
+                    else:
+                        blocks, col = self._publish_column(name, series)
+                    self.columns[(table, name)] = (series.dtype, source, blocks, col)
+                    columns.append(col)
+                self.spec[table] = {'rows': len(df), 'columns': columns}
+            self.spec_block, self.spec_size = _pickled_block(self.spec)
+            self._refs.acquire(self.spec_block)
+        except Exception:
+            self.close()
+            raise
+
+    def _own(self, block):
+        self._refs.acquire(block)
+        self.blocks.append(block)
+        return block
+
+    def _publish_column(self, name, series):
+        values, categories, encoded = _column_parts(series)
+        blocks = [self._own(shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1)))]
+        np.ndarray(values.shape, dtype=values.dtype, buffer=blocks[0].buf)[:] = values
+        if categories is not None:
+            block, size = _pickled_block(categories)
+            blocks.append(self._own(block))
+            categories = (block.name, size)
+        col = {
+            'name': name,
+            'block': blocks[0].name,
+            'dtype': values.dtype.str,
+            'rows': len(values),
+            'categories': categories,
+            'encoded': encoded,
+        }
+        return tuple(blocks), col
+
+    @property
+    def nbytes(self):
+        return sum(block.size for block in self.blocks)
+
+    @property
+    def ticket(self):
+        """What a task carries to tell a worker which data to use."""
+        return (self.version, self.spec_block.name, self.spec_size)
+
+    def close(self):
+        """Release this publication's blocks, unlinking those no newer publication reuses."""
+        blocks = self.blocks + ([self.spec_block] if self.spec_block is not None else [])
+        self.blocks, self.spec_block, self.columns = [], None, {}
+        for block in blocks:
+            self._refs.release(block)
+
+
+class SharedMemoryBackend:
+    """Serves tables published by SharedTables as DataFrames backed by the shared blocks.
+
+    Columns whose block `previous` (a backend over earlier data) already opened are reused
+    as they are, so moving to a new publication only attaches the changed columns.
+    """
+
+    def __init__(self, spec, previous=None):
+        self.spec = spec
+        self.previous = previous
+        # Keep the attached blocks alive for as long as the DataFrames view them
+        self.blocks = {}
+        self.values = {}
+
+    def _column(self, col):
+        name = col['block']
+        if self.previous is not None and name in self.previous.values:
+            self.blocks[name] = self.previous.blocks[name]
+            return self.previous.values[name]
+        block = _attach(name)
+        self.blocks[name] = block
+        values = np.ndarray((col['rows'],), dtype=np.dtype(col['dtype']), buffer=block.buf)
+        if col['categories'] is not None:
+            values = pd.Categorical.from_codes(values, categories=_unpickle_block(*col['categories']))
+        return values
+
+    def _load_table(self, table):
+        spec = self.spec[table]
+        columns = {}
+        for col in spec['columns']:
+            columns[col['name']] = self.values[col['block']] = self._column(col)
+        # copy=False keeps each column backed by its shared block instead of consolidating blocks
+        return pd.DataFrame(columns, index=pd.RangeIndex(spec['rows']), copy=False)
+
+    def load(self):
+        """Return {'students': DataFrame, 'quizzes': DataFrame} backed by shared memory."""
+        return {table: self._load_table(table) for table in TABLES}
+
+    @property
+    def encoded_columns(self):
+        """Names of the text columns that were dictionary-encoded only for sharing."""
+        return {col['name'] for spec in self.spec.values() for col in spec['columns'] if col['encoded']}
+
+
+_worker_data_file = None
+_worker_version = None
+_worker_data_manager = None
+# Backend over the shared blocks the worker's current DataManager views
+_worker_backend = None
+# Blocks of earlier data that could not be closed yet because a view of them was still alive
+_worker_stale_blocks = []
+# Columns a worker returns as plain text, so results do not pickle the whole category list
+_worker_text_columns = set()
+
+
+def _init_worker(data_file):
+    global _worker_data_file
+    _worker_data_file = data_file
+
+
+def _use_publication(version, spec_block, spec_size):
+    """Move this worker to a newer publication; a task carrying an older one runs on newer data."""
+    global _worker_version, _worker_data_manager, _worker_backend, _worker_text_columns
+    if _worker_version is not None and version <= _worker_version:
+        return
+    from data_manager import DataManager, open_data_manager
+    previous = _worker_backend
+    if spec_block is None:
+        # The workers open the data file themselves; SQLite reads it live, so keep it open
+        data_manager, backend, text_columns = _worker_data_manager, None, set()
+        if data_manager is None or previous is not None:
+            data_manager = open_data_manager(_worker_data_file)
+    else:
+        backend = SharedMemoryBackend(_unpickle_block(spec_block, spec_size), previous)
+        data_manager = DataManager(_worker_data_file, backend=backend)
+        backend.previous, text_columns = None, backend.encoded_columns
+    if previous is not None:
+        kept = backend.blocks if backend is not None else {}
+        _worker_stale_blocks.extend(block for name, block in previous.blocks.items() if name not in kept)
+    _worker_data_manager, _worker_backend, _worker_text_columns = data_manager, backend, text_columns
+    _worker_version = version
+    del previous
+    for block in list(_worker_stale_blocks):
+        try:
+            block.close()
+            _worker_stale_blocks.remove(block)
+        except BufferError:
+            # A view of the earlier data is still alive; retried on the next switch
+            pass
+
+
+def _run_in_worker(ticket, method, args, kwargs):
+    _use_publication(*ticket)
+    result = getattr(_worker_data_manager, method)(*args, **kwargs)
+    if isinstance(result, pd.DataFrame):
+        for col in _worker_text_columns.intersection(result.columns):
+            if isinstance(result[col].dtype, pd.CategoricalDtype):
+                result[col] = result[col].astype(result[col].cat.categories.dtype)
+    return result
+
+
+def _shutdown(executor, published):
+    # Let in-flight queries finish before their shared blocks are released
+    executor.shutdown(wait=True)
+    for shared in list(published):
+        shared.close()
+    published.clear()
+
+
+class ProcessDataManager:
+    """DataManager facade that runs query methods in a pool of worker processes.
+
+    Pandas filtering holds the GIL, so queries from different sessions only run in parallel
+    when they run in different processes. Workers read one shared copy of the parent's tables
+    (or the same memory-mapped store / database file), so adding workers adds their indexes
+    but no copy of the column arrays. The parent keeps its own tables as well, so with shared
+    memory the serving data takes about twice the in-process footprint however many workers
+    run. Metrics, versions, materialized rollups and ingestion stay in the parent; after
+    ingestion only the changed columns are republished, and the running workers switch to
+    them on their next query.
+    """
+
+    def __init__(self, data_manager, workers=SERVING_WORKERS):
+        self.data_manager = data_manager
+        self.workers = max(int(workers), 1)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker, initargs=(data_manager.data_file,),
+        )
+        # Publications not yet released: the current one and any still serving queued queries
+        self._published = []
+        self._finalizer = weakref.finalize(self, _shutdown, self._executor, self._published)
+        self._version = 0
+        try:
+            self._shared = self._publish(None, self._version)
+        except Exception:
+            self._finalizer()
+            raise
+        self._ticket = self._shared.ticket if self._shared is not None else (self._version, None, 0)
+        self._pending = set()
+        shared_mb = self._shared.nbytes / 2**20 if self._shared is not None else 0
+        logger.info(f"Started {self.workers} query workers ({shared_mb:.1f} MB shared memory)")
+
+    def _publish(self, previous, version):
+        """Shared tables for the workers, or None when they can open the data file themselves.
+
+        SQLite databases and unmodified columnar stores are opened by path, since the OS
+        already shares their pages; anything else is copied into shared memory, reusing the
+        blocks of `previous` for unchanged columns.
+        """
+        dm = self.data_manager
+        snap = getattr(dm, '_snapshot', None)
+        if snap is None or (isinstance(dm.backend, ColumnarBackend) and snap.revision == 0):
+            return None
+        shared = SharedTables(snap.tables, version, previous)
+        self._published.append(shared)
+        return shared
+
+    def refresh(self):
+        """Publish the parent's current data to the workers, copying only the columns that changed.
+
+        Queries submitted before the switch may still need the previous publication, so it is
+        released once they finish; that wait happens outside the dispatch lock.
+        """
+        with self._refresh_lock:
+            version = self._version + 1
+            shared = self._publish(self._shared, version)
+            with self._lock:
+                previous, pending = self._shared, self._pending
+                self._version, self._shared, self._pending = version, shared, set()
+                self._ticket = shared.ticket if shared is not None else (version, None, 0)
+        wait(list(pending))
+        if previous is not None:
+            previous.close()
+            self._published.remove(previous)
+
+    def close(self):
+        """Stop the workers and release the shared memory."""
+        self._finalizer()
+
+    def _dispatch(self, method, *args, **kwargs):
+        """Run a query method in a worker, falling back to the parent if the pool cannot take it.
+
+        Only failures of the pool itself fall back; an exception raised by the query is re-raised.
+        """
+        with span('pool.dispatch', method=method, workers=self.workers):
+            try:
+                with self._lock:
+                    pending = self._pending
+                    future = self._executor.submit(_run_in_worker, self._ticket, method, args, kwargs)
+                    pending.add(future)
+                future.add_done_callback(pending.discard)
+            except (BrokenProcessPool, RuntimeError) as e:
+                # RuntimeError: the pool was shut down by close()
+                return self._in_process(method, e, *args, **kwargs)
+            try:
+                return future.result()
+            except BrokenProcessPool as e:
+                return self._in_process(method, e, *args, **kwargs)
+
+    def _in_process(self, method, error, *args, **kwargs):
+        logger.error(f"Query worker pool unavailable, answering {method} in-process: {str(error)}")
+        return getattr(self.data_manager, method)(*args, **kwargs)
+
+    def get_filtered_students(self, admin_role):
+        """Get students accessible to this admin."""
+        return self._dispatch('get_filtered_students', admin_role)
+
+    def get_filtered_quizzes(self, admin_role):
+        """Get quizzes accessible to this admin."""
+        return self._dispatch('get_filtered_quizzes', admin_role)
+
+    def query_students_no_homework(self, admin_role):
+        """Find students who haven't submitted homework."""
+        return self._dispatch('query_students_no_homework', admin_role)
+
+    def query_performance_by_grade(self, admin_role, grade, days_back=7):
+        """Get performance data for a specific grade from recent days."""
+        return self._dispatch('query_performance_by_grade', admin_role, grade, days_back)
+
+    def query_upcoming_quizzes(self, admin_role, days_ahead=7):
+        """Get upcoming quizzes scheduled within next N days."""
+        return self._dispatch('query_upcoming_quizzes', admin_role, days_ahead)
+
+    def ingest(self, students=None, quizzes=None):
+        """Upsert records in the parent, then republish so the workers see them."""
+        applied = self.data_manager.ingest(students=students, quizzes=quizzes)
+        if any(applied.values()):
+            self.refresh()
+        return applied
+
+    def ingest_change_feed(self, path):
+        """Apply a JSON-lines change feed in the parent, then republish."""
+        result = self.data_manager.ingest_change_feed(path)
+        if result['applied']:
+            self.refresh()
+        return result
+
+    def get_metrics(self):
+        """The parent's metrics plus the worker count and shared memory size."""
+        metrics = self.data_manager.get_metrics()
+        metrics['workers'] = self.workers
+        metrics['shared_memory_bytes'] = self._shared.nbytes if self._shared is not None else 0
+        return metrics
+
+    def __getattr__(self, name):
+        # Versions, materialized() and the tables themselves come from the parent
+        if name == 'data_manager':
+            raise AttributeError(name)
+        return getattr(self.data_manager, name)
+
+
+def serve_in_processes(data_manager, workers=SERVING_WORKERS):
+    """Wrap a loaded data manager in a ProcessDataManager when workers > 0, else return it unchanged."""
+    if workers and workers > 0:
+        return ProcessDataManager(data_manager, workers)
+    return data_manager
@@ -1,80 +1,289 @@
 """AI agent for natural language query processing."""
-from langchain_openai import ChatOpenAI
-from langchain.agents import AgentExecutor, create_openai_functions_agent
+from langchain.agents import AgentExecutor, create_openai_tools_agent
 from langchain.tools import Tool
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.memory import ConversationBufferMemory
+from langchain_core.callbacks import BaseCallbackHandler
+from analytics import GROUP_BY_COLUMNS, Analytics
 from data_manager import DataManager
+from llm_client import get_shared_llm
+from conversation_memory import BoundedSummaryMemory, count_tokens
+from intent_router import IntentRouter, format_local_answer
+from result_format import format_table, serialize_result
+from response_cache import get_shared_cache
+from tracing import Span, record_span, span, start_trace
+from config import (
+    AGENT_VERBOSE,
+    INTENT_ROUTER_ENABLED,
+    MEMORY_MAX_TOKENS,
+    MEMORY_RECENT_EXCHANGES,
+    RESPONSE_CACHE_ENABLED,
+)
+import asyncio
+import contextvars
 import logging
+import queue
+import re
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+ERROR_MESSAGE = "I encountered an error while processing your query. Please try rephrasing or contact support if the issue persists."
+
+# Columns, title and empty-result message of each row-listing tool; texts may use {grade}
+TOOL_RESULTS = {
+    'students_no_homework': (['name', 'grade', 'class', 'homework_date'], "Students without homework",
+                             "No students found or no access to data."),
+    'performance_data': (['name', 'grade', 'class', 'quiz_score', 'quiz_date'], "Grade {grade} quiz performance",
+                         "No performance data found for Grade {grade} or no access."),
+    'upcoming_quizzes': (['title', 'grade', 'class', 'scheduled_date'], "Upcoming quizzes",
+                         "No upcoming quizzes found or no access to data."),
+    'all_students': (['name', 'grade', 'class', 'region'], "Students", "No students accessible."),
+}
+
+
+def parse_grade(query):
+    """Grade number mentioned in a question ("Grade 8"), or None."""
+    grade_match = re.search(r'grade\s*(\d+)', query.lower())
+    return int(grade_match.group(1)) if grade_match else None
+
+
+def parse_group_by(query, default='class'):
+    """Grouping dimension of a tool input: "by <dimension>" wins over a dimension used as a filter.
+    
+    "by class for grade 8" groups by class. Without a "by/per/each <dimension>" phrase, a dimension
+    name that is not followed by a value ("region", but not "grade 8") is used, else `default`.
+    """
+    dimensions = '|'.join(GROUP_BY_COLUMNS)
+    match = re.search(rf'\b(?:by|per|each|across)\s+({dimensions})', query, re.IGNORECASE)
+    if match is None:
+        match = re.search(rf'\b({dimensions})(?:e?s)?\b(?!\s*(?:\d|[A-Z]\b))', query, re.IGNORECASE)
+    return match.group(1).lower() if match else default
+
+
+def parse_count(query, default=10):
+    """Row count of a ranking tool input: "top 5" / "5 students" / "5", ignoring numbers like "grade 8"."""
+    match = (re.search(r'\b(?:top|bottom|first|highest|lowest|best|worst)\s+(\d+)', query, re.IGNORECASE)
+             or re.search(r'\b(\d+)\s+(?:students|performers|scores|results)\b', query, re.IGNORECASE)
+             or re.fullmatch(r'\s*(\d+)\s*', query))
+    return int(match.group(1)) if match else default
+
+
+def _in_thread(func):
+    """Coroutine function running a blocking func in a worker thread, off the event loop."""
+    async def run(*args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return run
+
+
+def render_listing(name, df, result_name=None, **params):
+    """Render a row-listing tool result, or its empty-result message."""
+    columns, title, empty_message = TOOL_RESULTS[name]
+    if df.empty:
+        return empty_message.format(**params)
+    with span('format', rows_returned=len(df)):
+        return serialize_result(df, columns, title.format(**params), result_name=result_name)
+
+
+def intent_query(data_manager, admin_role, intent, question):
+    """(DataFrame, format params) for a routed question, or None when it cannot be answered locally."""
+    if intent == 'students_no_homework':
+        return data_manager.query_students_no_homework(admin_role), {}
+    if intent == 'upcoming_quizzes':
+        return data_manager.query_upcoming_quizzes(admin_role), {}
+    if intent == 'all_students':
+        return data_manager.get_filtered_students(admin_role), {}
+    if intent == 'performance_data':
+        grade = parse_grade(question)
+        if grade is None:
+            return None
+        return data_manager.query_performance_by_grade(admin_role, grade), {'grade': grade}
+    return None
+
+
+def render_local_answer(name, df, scope_description, **params):
+    """Render a routed question's result for the user: a table under a heading, or the empty message."""
+    columns, _, empty_message = TOOL_RESULTS[name]
+    if df.empty:
+        return empty_message.format(**params)
+    with span('format', rows_returned=len(df)):
+        return format_local_answer(name, format_table(df, columns), scope_description)
+
+
+class _StreamingHandler(BaseCallbackHandler):
+    """Forwards tool starts and LLM tokens from an agent run onto a queue."""
+    
+    def __init__(self, events):
+        self.events = events
+    
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self.events.put(('tool', serialized.get('name', 'tool')))
+    
+    def on_llm_new_token(self, token, **kwargs):
+        if token:
+            self.events.put(('token', token))
+
+
+class _TokenUsageHandler(BaseCallbackHandler):
+    """Counts prompt and completion tokens for every LLM call in one agent run.
+    
+    Each call is also recorded as an `llm_call` span on `trace`.
+    """
+    
+    def __init__(self, llm, trace=None):
+        self.llm = llm
+        self.trace = trace
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_calls = 0
+        self._calls = {}
+    
+    def on_chat_model_start(self, serialized, messages, run_id=None, **kwargs):
+        self.llm_calls += 1
+        prompt_tokens = sum(count_tokens(self.llm, messages=batch) for batch in messages)
+        self.prompt_tokens += prompt_tokens
+        self._calls[run_id] = (time.perf_counter(), prompt_tokens)
+    
+    def on_llm_end(self, response, run_id=None, **kwargs):
+        completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, 'message', None)
+                tool_calls = message.additional_kwargs.get('tool_calls') if message is not None else None
+                completion_tokens += count_tokens(self.llm, text=generation.text + (str(tool_calls) if tool_calls else ''))
+        self.completion_tokens += completion_tokens
+        start, prompt_tokens = self._calls.pop(run_id, (None, 0))
+        if start is not None:
+            call = Span('llm_call', prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            call.seconds = time.perf_counter() - start
+            record_span(call, start, trace=self.trace)
+
 
 class QueryAgent:
     """Agent that processes natural language queries about student data."""
     
-    def __init__(self, data_manager, admin_role, api_key):
+    def __init__(self, data_manager, admin_role, api_key, router=None, cache=None, llm=None):
         self.data_manager = data_manager
         self.admin_role = admin_role
+        self.analytics = Analytics(data_manager)
+        self.router = router or (IntentRouter() if INTENT_ROUTER_ENABLED else None)
+        self.cache = cache or (get_shared_cache() if RESPONSE_CACHE_ENABLED else None)
         
         if not api_key:
             raise ValueError("API key is required")
         
         try:
-            self.llm = ChatOpenAI(
-                model="gpt-3.5-turbo",
-                temperature=0,
-                api_key=api_key,
-                request_timeout=30
-            )
-            self.memory = ConversationBufferMemory(
+            self.llm = llm or get_shared_llm(api_key)
+            self.memory = BoundedSummaryMemory(
+                llm=self.llm,
                 memory_key="chat_history",
-                return_messages=True
+                return_messages=True,
+                k=MEMORY_RECENT_EXCHANGES,
+                max_token_limit=MEMORY_MAX_TOKENS
             )
+            self.last_turn_tokens = None
+            self.tools = self._create_tools()
             self.agent_executor = self._create_agent()
             logger.info("QueryAgent initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize QueryAgent: {str(e)}")
             raise
     
+    def _render(self, name, df, columns, title):
+        """Serialize a tool result and keep it so more_rows can page through it."""
+        self._results[name] = (df, columns, title)
+        with span('format', rows_returned=len(df)):
+            return serialize_result(df, columns, title, result_name=name)
+    
+    def _render_listing(self, name, df, **params):
+        """Render a row-listing tool result and keep it for more_rows."""
+        if not df.empty:
+            columns, title, _ = TOOL_RESULTS[name]
+            self._results[name] = (df, columns, title.format(**params))
+        return render_listing(name, df, result_name=name, **params)
+    
+    def _traced_tool(self, name, func):
+        """Wrap a tool function so each call is timed as a `tool.<name>` span."""
+        def run(query: str) -> str:
+            with span(f"tool.{name}") as current:
+                output = func(query)
+                current.attrs['output_chars'] = len(output)
+                return output
+        return run
+    
     def _create_tools(self):
         """Create tools for the agent to use."""
+        self._results = {}
         
         def get_students_no_homework(query: str) -> str:
             """Find students who haven't submitted their homework."""
             df = self.data_manager.query_students_no_homework(self.admin_role)
-            if df.empty:
-                return "No students found or no access to data."
-            return df[['name', 'grade', 'class', 'homework_date']].to_string(index=False)
+            return self._render_listing("students_no_homework", df)
         
         def get_performance_data(query: str) -> str:
             """Get performance data. Query should mention grade number."""
-            import re
-            grade_match = re.search(r'grade\s*(\d+)', query.lower())
-            if not grade_match:
+            grade = parse_grade(query)
+            if grade is None:
                 return "Please specify a grade number (e.g., Grade 8)"
             
-            grade = int(grade_match.group(1))
             df = self.data_manager.query_performance_by_grade(self.admin_role, grade)
-            if df.empty:
-                return f"No performance data found for Grade {grade} or no access."
-            return df[['name', 'grade', 'class', 'quiz_score', 'quiz_date']].to_string(index=False)
+            return self._render_listing("performance_data", df, grade=grade)
         
         def get_upcoming_quizzes(query: str) -> str:
             """Get upcoming quizzes scheduled for next week."""
             df = self.data_manager.query_upcoming_quizzes(self.admin_role)
-            if df.empty:
-                return "No upcoming quizzes found or no access to data."
-            return df[['title', 'grade', 'class', 'scheduled_date']].to_string(index=False)
+            return self._render_listing("upcoming_quizzes", df)
         
         def get_all_students(query: str) -> str:
             """Get all accessible students."""
             df = self.data_manager.get_filtered_students(self.admin_role)
+            return self._render_listing("all_students", df)
+        
+        def get_score_stats(query: str) -> str:
+            """Average/min/max quiz score per grade, class or region."""
+            by = parse_group_by(query)
+            df = self.analytics.score_stats(self.admin_role, by)
+            if df.empty:
+                return "No students accessible."
+            return self._render("score_stats", df, list(df.columns), f"Quiz score by {by}")
+        
+        def get_homework_rate(query: str) -> str:
+            """Homework submission rate per grade, class or region."""
+            by = parse_group_by(query)
+            df = self.analytics.homework_rate(self.admin_role, by)
             if df.empty:
                 return "No students accessible."
-            return df[['name', 'grade', 'class', 'region']].to_string(index=False)
+            return self._render("homework_rate", df, list(df.columns), f"Homework submission rate by {by}")
+        
+        def get_score_percentiles(query: str) -> str:
+            """Quiz score percentiles, overall or per grade, class or region."""
+            grouped = re.search(r'\b(by|per|each|across)\b', query, re.IGNORECASE)
+            by = parse_group_by(query, default=None) if grouped else None
+            df = self.analytics.score_percentiles(self.admin_role, by=by)
+            if df.empty:
+                return "No students accessible."
+            return self._render("score_percentiles", df, list(df.columns),
+                                f"Quiz score percentiles by {by}" if by else "Quiz score percentiles")
+        
+        def ranked_students(name, ascending):
+            def get_ranked(query: str) -> str:
+                k = parse_count(query)
+                df = self.analytics.top_k(self.admin_role, k, ascending=ascending)
+                if df.empty:
+                    return "No students accessible."
+                label = "Lowest" if ascending else "Highest"
+                return self._render(name, df, ['name', 'grade', 'class', 'quiz_score'], f"{label} {len(df)} quiz scores")
+            return get_ranked
         
-        return [
+        def get_more_rows(query: str) -> str:
+            """Page through the last result of another tool."""
+            match = re.match(r'\s*(\w+)\s+(\d+)', query)
+            if not match or match.group(1) not in self._results:
+                return "Use the form '<tool name> <row offset>' for a tool that was already called in this conversation."
+            df, columns, title = self._results[match.group(1)]
+            return serialize_result(df, columns, title, result_name=match.group(1), offset=int(match.group(2)))
+        
+        tools = [
             Tool(
                 name="students_no_homework",
                 func=get_students_no_homework,
@@ -94,12 +303,47 @@ class QueryAgent:
                 name="all_students",
                 func=get_all_students,
                 description="Use this to list all students you have access to"
+            ),
+            Tool(
+                name="score_stats",
+                func=get_score_stats,
+                description="Use this for exact average/min/max quiz scores; input names the grouping: grade, class or region"
+            ),
+            Tool(
+                name="homework_rate",
+                func=get_homework_rate,
+                description="Use this for exact homework submission rates; input names the grouping: grade, class or region"
+            ),
+            Tool(
+                name="score_percentiles",
+                func=get_score_percentiles,
+                description="Use this for quiz score percentiles/median; input may say 'by grade', 'by class' or 'by region'"
+            ),
+            Tool(
+                name="top_performers",
+                func=ranked_students("top_performers", ascending=False),
+                description="Use this to find the students with the highest quiz scores; input is how many (default 10)"
+            ),
+            Tool(
+                name="bottom_performers",
+                func=ranked_students("bottom_performers", ascending=True),
+                description="Use this to find the students with the lowest quiz scores; input is how many (default 10)"
+            ),
+            Tool(
+                name="more_rows",
+                func=get_more_rows,
+                description="Use this to see more rows of a previous result; input is '<tool name> <row offset>'"
             )
         ]
+        for tool in tools:
+            tool.func = self._traced_tool(tool.name, tool.func)
+            # Tool bodies filter DataFrames or wait on query workers, so ainvoke runs them in a thread
+            tool.coroutine = _in_thread(tool.func)
+        return tools
     
     def _create_agent(self):
         """Create the agent executor."""
-        tools = self._create_tools()
+        tools = self.tools
         
         prompt = ChatPromptTemplate.from_messages([
             ("system", f"""You are an AI assistant for the Dumroo Admin Panel. 
@@ -114,32 +358,194 @@ When answering queries:
 1. Use the appropriate tool to fetch data
 2. Present results in a clear, readable format
 3. If no data is found, explain it might be due to access restrictions
-4. Be helpful and conversational"""),
+4. For averages, rates, percentiles and rankings use the aggregate tools instead of computing from raw rows
+5. Be helpful and conversational"""),
             MessagesPlaceholder(variable_name="chat_history"),
             ("human", "{input}"),
             MessagesPlaceholder(variable_name="agent_scratchpad")
         ])
         
-        agent = create_openai_functions_agent(self.llm, tools, prompt)
+        # The tools agent lets the model request several tools in one step; ainvoke runs them concurrently
+        agent = create_openai_tools_agent(self.llm, tools, prompt)
         return AgentExecutor(
             agent=agent,
             tools=tools,
             memory=self.memory,
-            verbose=True,
+            verbose=AGENT_VERBOSE,
             handle_parsing_errors=True
         )
     
+    def _record_usage(self, usage, trace):
+        """Keep and log token counts for the LLM turn that just finished."""
+        self.last_turn_tokens = {
+            'history_tokens': self.memory.last_history_tokens,
+            'prompt_tokens': usage.prompt_tokens,
+            'completion_tokens': usage.completion_tokens,
+            'llm_calls': usage.llm_calls,
+        }
+        trace.prompt_tokens = usage.prompt_tokens
+        trace.completion_tokens = usage.completion_tokens
+        trace.llm_calls = usage.llm_calls
+        logger.info(f"Turn token usage: {self.last_turn_tokens}")
+    
+    def _cache_key(self):
+        return self.admin_role.get_scope_description(), self.data_manager.scope_version(self.admin_role)
+    
+    def _cached_answer(self, question):
+        """Return a cached answer for this admin's scope and the current data, or None."""
+        if self.cache is None:
+            return None
+        with span('cache_lookup') as current:
+            answer = self.cache.get(*self._cache_key(), question)
+            current.attrs['cache_hit'] = answer is not None
+        if answer is not None:
+            self.memory.save_context({"input": question}, {"output": answer})
+            logger.info("Query answered from response cache")
+        return answer
+    
+    def _cache_answer(self, question, answer):
+        if self.cache is not None:
+            self.cache.put(*self._cache_key(), question, answer)
+    
+    def _answer_locally(self, question):
+        """Answer a high-confidence common question straight from DataManager, or return None."""
+        if self.router is None:
+            return None
+        with span('intent_router') as current:
+            intent = self.router.route(question)
+            current.attrs['intent'] = intent
+        if intent is None:
+            return None
+        prepared = intent_query(self.data_manager, self.admin_role, intent, question)
+        if prepared is None:
+            return None
+        df, params = prepared
+        answer = render_local_answer(intent, df, self.admin_role.get_scope_description(), **params)
+        self.memory.save_context({"input": question}, {"output": answer})
+        logger.info(f"Query answered locally via intent '{intent}'")
+        return answer
+    
+    def _answer_without_llm(self, question, trace):
+        """Answer from the response cache or the intent router when possible, or return None."""
+        answer = self._cached_answer(question)
+        if answer is not None:
+            trace.path = 'cache'
+            return answer
+        answer = self._answer_locally(question)
+        if answer is not None:
+            trace.path = 'local'
+            self._cache_answer(question, answer)
+        return answer
+    
     def query(self, question):
         """Process a natural language query."""
         if not question or not question.strip():
             return "Please provide a valid question."
         
-        try:
-            logger.info(f"Processing query: {question[:100]}...")
-            response = self.agent_executor.invoke({"input": question})
-            logger.info("Query processed successfully")
-            return response['output']
-        except Exception as e:
-            error_msg = f"I encountered an error while processing your query. Please try rephrasing or contact support if the issue persists."
-            logger.error(f"Query processing error: {str(e)}", exc_info=True)
-            return error_msg
+        with start_trace(question, self.admin_role.admin_id) as trace:
+            try:
+                answer = self._answer_without_llm(question, trace)
+                if answer is not None:
+                    return answer
+                
+                logger.info(f"Processing query: {question[:100]}...")
+                trace.path = 'llm'
+                usage = _TokenUsageHandler(self.llm, trace)
+                with span('agent'):
+                    response = self.agent_executor.invoke({"input": question}, config={"callbacks": [usage]})
+                self._record_usage(usage, trace)
+                logger.info("Query processed successfully")
+                answer = response['output']
+                self._cache_answer(question, answer)
+                return answer
+            except Exception as e:
+                trace.path = 'error'
+                logger.error(f"Query processing error: {str(e)}", exc_info=True)
+                return ERROR_MESSAGE
+    
+    async def aquery(self, question):
+        """Process a natural language query without blocking a thread on the LLM round-trips.
+        
+        Must be awaited on llm_client.get_event_loop(); use llm_client.run_coroutine from sync code.
+        Cache lookups, local answers and tool calls block on pandas or the query workers, so they
+        run in worker threads and leave the loop free for other sessions' LLM calls.
+        """
+        if not question or not question.strip():
+            return "Please provide a valid question."
+        
+        with start_trace(question, self.admin_role.admin_id) as trace:
+            try:
+                answer = await asyncio.to_thread(self._answer_without_llm, question, trace)
+                if answer is not None:
+                    return answer
+                
+                logger.info(f"Processing async query: {question[:100]}...")
+                trace.path = 'llm'
+                usage = _TokenUsageHandler(self.llm, trace)
+                with span('agent'):
+                    response = await self.agent_executor.ainvoke({"input": question}, config={"callbacks": [usage]})
+                self._record_usage(usage, trace)
+                logger.info("Async query processed successfully")
+                answer = response['output']
+                await asyncio.to_thread(self._cache_answer, question, answer)
+                return answer
+            except Exception as e:
+                trace.path = 'error'
+                logger.error(f"Query processing error: {str(e)}", exc_info=True)
+                return ERROR_MESSAGE
+    
+    def stream(self, question):
+        """Process a query, yielding ('tool', name) progress events and ('token', text) answer chunks."""
+        if not question or not question.strip():
+            yield ('token', "Please provide a valid question.")
+            return
+        
+        with start_trace(question, self.admin_role.admin_id) as trace:
+            try:
+                answer = self._answer_without_llm(question, trace)
+            except Exception as e:
+                trace.path = 'error'
+                logger.error(f"Query processing error: {str(e)}", exc_info=True)
+                answer = ERROR_MESSAGE
+            if answer is not None:
+                yield ('token', answer)
+                return
+            
+            trace.path = 'llm'
+            events = queue.Queue()
+            result = {}
+            usage = _TokenUsageHandler(self.llm, trace)
+            
+            def run_agent():
+                try:
+                    with span('agent'):
+                        response = self.agent_executor.invoke(
+                            {"input": question},
+                            config={"callbacks": [_StreamingHandler(events), usage]}
+                        )
+                    result['output'] = response['output']
+                except Exception as e:
+                    result['error'] = e
+                finally:
+                    events.put(None)
+            
+            logger.info(f"Streaming query: {question[:100]}...")
+            # Run the agent in a copy of this context so its spans land on this trace
+            worker = threading.Thread(target=contextvars.copy_context().run, args=(run_agent,), daemon=True)
+            worker.start()
+            streamed = False
+            while (event := events.get()) is not None:
+                streamed = streamed or event[0] == 'token'
+                yield event
+            worker.join()
+            
+            if 'error' in result:
+                trace.path = 'error'
+                logger.error(f"Query processing error: {str(result['error'])}", exc_info=result['error'])
+                yield ('token', ERROR_MESSAGE)
+                return
+            self._record_usage(usage, trace)
+            if not streamed:
+                yield ('token', result['output'])
+            self._cache_answer(question, result['output'])
+            logger.info("Query streamed successfully")
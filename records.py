@@ -0,0 +1,407 @@
+"""Compact record model: typed struct-of-arrays tables with interned codes, and slotted row records.
+
+A ColumnTable owns one NumPy array per column. The scope columns (grade, class, region)
+are interned once and stored as small integer codes. The DataFrames
+DataManager queries are zero-copy views over these arrays, so each value is held once.
+"""
+import logging
+import sys
+from dataclasses import dataclass, fields
+from datetime import datetime
+from itertools import compress
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Column kinds: 'code' = interned categorical (the scope columns), 'text' = Python strings, 'number', 'bool', 'date'
+SCHEMAS = {
+    'students': {
+        'student_id': 'text',
+        'name': 'text',
+        'grade': 'code',
+        'class': 'code',
+        'region': 'code',
+        'homework_submitted': 'bool',
+        'homework_date': 'date',
+        'quiz_score': 'number',
+        'quiz_date': 'date',
+    },
+    'quizzes': {
+        'quiz_id': 'text',
+        'title': 'text',
+        'grade': 'code',
+        'class': 'code',
+        'region': 'code',
+        'scheduled_date': 'date',
+        'status': 'text',
+    },
+}
+
+
+class _RecordAccess:
+    """dict-style get() so slotted records work wherever raw record dicts were accepted."""
+
+    __slots__ = ()
+
+    def get(self, key, default=None):
+        return getattr(self, 'class_section' if key == 'class' else key, default)
+
+
+@dataclass(slots=True, frozen=True)
+class StudentRecord(_RecordAccess):
+    student_id: str
+    name: str
+    grade: int
+    class_section: str
+    region: str
+    homework_submitted: bool
+    homework_date: datetime
+    quiz_score: float
+    quiz_date: datetime
+
+
+@dataclass(slots=True, frozen=True)
+class QuizRecord(_RecordAccess):
+    quiz_id: str
+    title: str
+    grade: int
+    class_section: str
+    region: str
+    scheduled_date: datetime
+    status: str
+
+
+RECORD_TYPES = {'students': StudentRecord, 'quizzes': QuizRecord}
+
+# A trailing UTC offset ("Z", "+02:00", "-0500") on a timestamp string
+UTC_OFFSET_PATTERN = r'(?:Z|[+-]\d{2}:?\d{2})\s*$'
+
+# Python types accepted for each column kind; missing values (None) are always accepted
+ACCEPTED_TYPES = {
+    'code': [str, int],
+    'text': [str, int, float],
+    'number': [int, float],
+    'bool': [bool],
+    'date': [str],
+}
+
+
+def _code_dtype(n_categories):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _object_array(values):
+    """1-D object array of a column's values, even when the values are themselves lists."""
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+def _intern(values):
+    """Return (codes, categories) with categories sorted and missing values coded -1."""
+    raw, uniques = pd.factorize(_object_array(values))
+    categories = list(uniques)
+    try:
+        order = sorted(range(len(categories)), key=categories.__getitem__)
+    except TypeError:
+        order = list(range(len(categories)))
+    remap = np.empty(len(categories) + 1, dtype=np.int64)
+    remap[np.asarray(order, dtype=np.int64)] = np.arange(len(categories))
+    remap[-1] = -1
+    codes = remap[raw].astype(_code_dtype(len(categories)))
+    return codes, [categories[i] for i in order]
+
+
+def parse_dates(values):
+    """Parse date strings to datetime64[ns]; values with a UTC offset are converted to UTC.
+
+    Each distinct value is parsed once. ISO 8601 dates and timestamps of any precision
+    parse in vectorized passes, with and without an offset parsed separately (pandas would
+    otherwise carry one value's offset over to later values without one). Anything else is
+    retried with per-value format detection, so each value parses the same way whatever
+    else shares its chunk. Values that parse neither way become NaT.
+    """
+    codes, uniques = pd.factorize(_object_array(values))
+    uniques = _object_array(uniques)
+    parsed = np.full(len(uniques), np.datetime64('NaT'), dtype='datetime64[ns]')
+    has_offset = pd.Series(uniques, dtype=object).str.contains(UTC_OFFSET_PATTERN, na=False).to_numpy(dtype=bool)
+    if (~has_offset).any():
+        parsed[~has_offset] = pd.to_datetime(uniques[~has_offset], errors='coerce', format='ISO8601').to_numpy(dtype='datetime64[ns]')
+    if has_offset.any():
+        parsed[has_offset] = _to_naive_utc(pd.to_datetime(uniques[has_offset], errors='coerce', format='ISO8601', utc=True))
+    retry = np.isnat(parsed)
+    if retry.any():
+        parsed[retry] = _to_naive_utc(pd.to_datetime(uniques[retry], errors='coerce', format='mixed', utc=True))
+    return np.append(parsed, np.datetime64('NaT'))[codes]
+
+
+def _to_naive_utc(index):
+    return index.tz_localize(None).to_numpy(dtype='datetime64[ns]')
+
+
+def _encode(values, kind):
+    """Convert one column of Python values into its compact array form.
+
+    Values that don't fit the column's kind fall back to a Python-object column, as pandas would.
+    """
+    if kind == 'code':
+        return _intern(values)
+    if kind == 'date':
+        return parse_dates(_object_array(values)), None
+    types = set(map(type, values))
+    if kind == 'bool' and types <= {bool, np.bool_}:
+        return np.asarray(values, dtype=bool), None
+    if kind == 'number' and (types <= {int, float, type(None)} or all(
+        v is None or isinstance(v, (int, float, np.number)) and not isinstance(v, bool) for v in values
+    )):
+        has_missing = type(None) in types
+        return (np.asarray(values, dtype=float) if has_missing else np.asarray(values)), None
+    return _object_array(values), None
+
+
+def _record_columns(records, table):
+    """({name: list of values}, is_dict array) for a chunk: schema fields, then any others sorted.
+
+    Missing fields are None and non-dict records count as empty. Each column is read in one
+    C-level pass when every record has the field.
+    """
+    schema = list(SCHEMAS[table])
+    if set(map(type, records)) <= {dict}:
+        is_dict = np.ones(len(records), dtype=bool)
+        dicts = records
+    else:
+        is_dict = np.fromiter((isinstance(r, dict) for r in records), dtype=bool, count=len(records))
+        dicts = [r for r, ok in zip(records, is_dict) if ok]
+        records = [r if ok else {} for r, ok in zip(records, is_dict)]
+    columns = {}
+    complete = True
+    for name in schema:
+        try:
+            columns[name] = list(map(itemgetter(name), records))
+        except KeyError:
+            complete = False
+            columns[name] = [r.get(name) for r in records]
+    # Records holding every schema field and no more fields than the schema have no others
+    if dicts and not (complete and max(map(len, dicts)) == len(schema)):
+        for name in sorted(set().union(*map(dict.keys, dicts)) - set(schema)):
+            columns[name] = [r.get(name) for r in records]
+    return columns, is_dict
+
+
+def _check_columns(records, columns, is_dict, table, required=()):
+    """Type-check each schema column of a chunk at once.
+
+    Returns ({position: reason}, {date column: parsed datetime64 array}); the parsed dates are
+    reused when encoding, so each date column is parsed once.
+    """
+    reasons = {i: f"expected an object, got {type(records[i]).__name__}" for i in np.flatnonzero(~is_dict)}
+    dates = {}
+    for name, kind in SCHEMAS[table].items():
+        values = columns[name]
+        types = set(map(type, values))
+        if types & {type(None), float}:
+            present = pd.notna(_object_array(values))
+        else:
+            present = np.ones(len(values), dtype=bool)
+        accepted = set(ACCEPTED_TYPES[kind])
+        if types <= accepted | {type(None)}:
+            wrong_type = np.zeros(len(values), dtype=bool)
+        else:
+            matches = np.fromiter((type(v) in accepted for v in values), dtype=bool, count=len(values))
+            wrong_type = present & ~matches
+        unparsed = np.zeros(len(values), dtype=bool)
+        if kind == 'date':
+            dates[name] = parse_dates(np.where(wrong_type, None, _object_array(values)) if wrong_type.any() else values)
+            unparsed = present & ~wrong_type & np.isnat(dates[name])
+        missing = ~present & is_dict if name in required else np.zeros(len(values), dtype=bool)
+        for i in np.flatnonzero(wrong_type & is_dict):
+            reasons.setdefault(i, f"{name}: expected {kind}, got {type(values[i]).__name__}")
+        for i in np.flatnonzero(unparsed):
+            reasons.setdefault(i, f"{name}: unparseable date {values[i]!r}")
+        for i in np.flatnonzero(missing):
+            reasons.setdefault(i, f"missing {name}")
+    return reasons, dates
+
+
+def validate_records(records, table, required=()):
+    """Split a chunk of records into (valid records, [(position, reason)]) by the table's schema.
+
+    Each schema column is type-checked for the whole chunk at once. Missing values are allowed
+    except in `required` columns; dates must parse. Positions index into `records`.
+    """
+    columns, is_dict = _record_columns(records, table)
+    reasons, _ = _check_columns(records, columns, is_dict, table, required)
+    valid = [record for i, record in enumerate(records) if i not in reasons]
+    return valid, sorted((int(i), reason) for i, reason in reasons.items())
+
+
+def encode_records(records, table, required=()):
+    """Validate a chunk of records and encode the valid ones, reading each field only once.
+
+    Returns (ColumnTable, or None when no record is valid, [(position, reason)]) with the same
+    checks as validate_records and the same table as ColumnTable.from_records(valid records).
+    """
+    columns, is_dict = _record_columns(records, table)
+    reasons, dates = _check_columns(records, columns, is_dict, table, required)
+    rejected = sorted((int(i), reason) for i, reason in reasons.items())
+    if len(reasons) == len(records):
+        return None, rejected
+    if reasons:
+        keep = np.ones(len(records), dtype=bool)
+        keep[list(reasons)] = False
+        columns = {name: list(compress(values, keep)) for name, values in columns.items()}
+        dates = {name: values[keep] for name, values in dates.items()}
+    return ColumnTable.from_columns(columns, table, dates), rejected
+
+
+def _merge_codes(parts):
+    """Concatenate (codes, categories) pairs into one code array over the union of the categories."""
+    merged = list(dict.fromkeys(c for _, categories in parts for c in categories))
+    try:
+        merged.sort()
+    except TypeError:
+        pass
+    lookup = {c: i for i, c in enumerate(merged)}
+    dtype = _code_dtype(len(merged))
+    arrays = []
+    for codes, categories in parts:
+        remap = np.asarray([lookup[c] for c in categories] + [-1], dtype=np.int64)
+        arrays.append(remap[codes.astype(np.int64)].astype(dtype))
+    return np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype), merged
+
+
+class ColumnTable:
+    """One table as struct-of-arrays: a NumPy array per column plus category lists for coded columns."""
+
+    def __init__(self, table, columns, categories=None):
+        self.table = table
+        self.columns = columns
+        self.categories = categories or {}
+        self.rows = len(next(iter(columns.values()))) if columns else 0
+
+    @classmethod
+    def from_records(cls, records, table):
+        """Build from a list of record dicts, one column at a time.
+
+        Columns outside the table's schema are kept as generic Python-object columns.
+        """
+        columns, _ = _record_columns(records, table)
+        return cls.from_columns(columns, table)
+
+    @classmethod
+    def from_columns(cls, columns, table, dates=None):
+        """Build from {name: list of values}; `dates` holds date columns that are already parsed.
+
+        Fields outside the schema that are missing in every record are dropped.
+        """
+        schema = SCHEMAS[table]
+        dates = dates or {}
+        arrays, categories = {}, {}
+        for name, values in columns.items():
+            if name not in schema and all(v is None for v in values):
+                continue
+            if name in dates:
+                arrays[name] = dates[name]
+                continue
+            arrays[name], cats = _encode(values, schema.get(name, 'text'))
+            if cats is not None:
+                categories[name] = cats
+        return cls(table, arrays, categories)
+
+    @classmethod
+    def from_frame(cls, df, table):
+        """Wrap a DataFrame's column arrays (categorical codes for categoricals) without copying."""
+        columns, categories = {}, {}
+        for name in df.columns:
+            series = df[name]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                columns[name] = series.cat.codes.to_numpy()
+                categories[name] = series.cat.categories
+            else:
+                columns[name] = series.to_numpy()
+        return cls(table, columns, categories)
+
+    @classmethod
+    def concat(cls, tables, table):
+        """Stack tables encoded from consecutive chunks, in order, merging coded columns' categories.
+
+        Columns that only some chunks have (fields outside the schema) are filled with None elsewhere.
+        """
+        tables = [t for t in tables if len(t)]
+        if not tables:
+            return cls.from_records([], table)
+        names = list(dict.fromkeys(name for t in tables for name in t.columns))
+        columns, categories = {}, {}
+        for name in names:
+            if name in tables[0].categories:
+                columns[name], categories[name] = _merge_codes(
+                    [(t.columns[name], list(t.categories[name])) for t in tables]
+                )
+                continue
+            parts = []
+            for t in tables:
+                values = t.columns.get(name)
+                if values is None:
+                    values = np.full(len(t), None, dtype=object)
+                parts.append(values)
+            columns[name] = np.concatenate(parts)
+        return cls(table, columns, categories)
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def nbytes(self):
+        """Bytes held by the column arrays, including the Python strings in text columns."""
+        total = 0
+        for values in self.columns.values():
+            total += values.nbytes
+            if values.dtype == object:
+                total += sum(map(_object_size, values))
+        return total
+
+    def to_frame(self):
+        """DataFrame whose columns are views over this table's arrays (no copies)."""
+        data = {}
+        for name, values in self.columns.items():
+            if name in self.categories:
+                values = pd.Categorical.from_codes(values, categories=self.categories[name])
+            data[name] = values
+        return pd.DataFrame(data, index=pd.RangeIndex(self.rows), copy=False)
+
+    def record(self, i):
+        """Row i as a slotted record."""
+        record_type = RECORD_TYPES[self.table]
+        values = {}
+        for field in fields(record_type):
+            name = 'class' if field.name == 'class_section' else field.name
+            if name not in self.columns:
+                values[field.name] = None
+                continue
+            value = self.columns[name][i]
+            if name in self.categories:
+                value = self.categories[name][value] if value >= 0 else None
+            elif isinstance(value, np.datetime64):
+                value = None if np.isnat(value) else value.astype('datetime64[us]').item()
+            values[field.name] = value.item() if isinstance(value, np.generic) else value
+        return record_type(**values)
+
+    def records(self, rows=None):
+        """Slotted records for the given row positions (all rows by default)."""
+        for i in (range(self.rows) if rows is None else rows):
+            yield self.record(i)
+
+
+def _object_size(value):
+    return value.__sizeof__()
+
+
+def dict_records_nbytes(records):
+    """Deep size of a list of record dicts: the list, each dict and each value (keys are shared)."""
+    total = sys.getsizeof(records)
+    for record in records:
+        total += sys.getsizeof(record) + sum(sys.getsizeof(v) for v in record.values())
+    return total
@@ -0,0 +1,158 @@
+"""Exact and similarity-based cache for agent answers, partitioned by admin scope and data version."""
+import re
+import time
+import zlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from config import (
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL_SECONDS,
+    RESPONSE_CACHE_SIMILARITY,
+)
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 512
+
+# Tokens that flip a question's meaning even when the rest of the wording is nearly identical
+_GUARD_WORDS = {
+    'not', 'no', 'never', 'without', 'haven', 'hasn', 'didn', 'missing', 'upcoming', 'past', 'last', 'next',
+    'top', 'bottom', 'best', 'worst', 'highest', 'lowest', 'north', 'south', 'east', 'west',
+}
+
+
+def normalize_question(question):
+    """Lowercase, drop punctuation and collapse whitespace."""
+    text = re.sub(r"[^a-z0-9\s]", " ", question.lower())
+    return ' '.join(text.split())
+
+
+def embed_question(normalized):
+    """Local hashed bag of words and character trigrams, L2-normalized."""
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    words = normalized.split()
+    padded = f" {normalized} "
+    features = words + [padded[i:i + 3] for i in range(len(padded) - 2)]
+    for feature in features:
+        vector[zlib.crc32(feature.encode('utf-8')) % EMBEDDING_DIM] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _guard_tokens(normalized):
+    """Numbers, single letters (class sections) and meaning-flipping words that must agree for a similarity hit."""
+    return frozenset(w for w in normalized.split() if w.isdigit() or len(w) == 1 or w in _GUARD_WORDS)
+
+
+class _Entry:
+    __slots__ = ('answer', 'vector', 'guard', 'created')
+
+    def __init__(self, answer, vector, guard, created):
+        self.answer = answer
+        self.vector = vector
+        self.guard = guard
+        self.created = created
+
+
+class ResponseCache:
+    """Thread-safe LRU cache with TTL for answers, keyed by (scope, data version, question)."""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+                 similarity_threshold=RESPONSE_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expired(self, entry, now):
+        return self.ttl_seconds and now - entry.created > self.ttl_seconds
+
+    def get(self, scope, data_version, question):
+        """Return a cached answer for this scope and data version, or None."""
+        normalized = normalize_question(question)
+        namespace = (scope, data_version)
+        now = time.monotonic()
+        with self._lock:
+            key = (namespace, normalized)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry, now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry.answer
+                del self._entries[key]
+
+            match = self._most_similar(namespace, normalized, now)
+            if match is not None:
+                self._entries.move_to_end(match)
+                self.semantic_hits += 1
+                return self._entries[match].answer
+
+            self.misses += 1
+            return None
+
+    def _most_similar(self, namespace, normalized, now):
+        """Key of the closest live entry in the namespace above the similarity threshold."""
+        candidates = [
+            (key, entry) for key, entry in self._entries.items()
+            if key[0] == namespace and not self._expired(entry, now)
+        ]
+        if not candidates or self.similarity_threshold >= 1:
+            return None
+        guard = _guard_tokens(normalized)
+        vector = embed_question(normalized)
+        scores = np.stack([entry.vector for _, entry in candidates]) @ vector
+        best = int(np.argmax(scores))
+        key, entry = candidates[best]
+        if scores[best] >= self.similarity_threshold and entry.guard == guard:
+            return key
+        return None
+
+    def put(self, scope, data_version, question, answer):
+        """Store an answer, evicting the least recently used entries beyond max_entries."""
+        normalized = normalize_question(question)
+        entry = _Entry(answer, embed_question(normalized), _guard_tokens(normalized), time.monotonic())
+        with self._lock:
+            key = ((scope, data_version), normalized)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """Process-wide cache shared by every QueryAgent."""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = ResponseCache()
+        return _shared_cache
@@ -0,0 +1,104 @@
+"""Compact, size-capped serialization of query results for the LLM context."""
+import math
+import logging
+import pandas as pd
+from config import LOCAL_ANSWER_MAX_ROWS, TOOL_OUTPUT_PAGE_SIZE, TOOL_OUTPUT_TOKEN_BUDGET
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+MAX_CATEGORY_COUNTS = 5
+
+
+def estimate_tokens(text):
+    """Rough token estimate used for the output budget."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def summarize_frame(df):
+    """One line per column with count/mean/min/max for numbers, ranges for dates and top values otherwise."""
+    lines = []
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_bool_dtype(series):
+            lines.append(f"{col}: {int(series.sum())} true, {int((~series).sum())} false")
+        elif pd.api.types.is_numeric_dtype(series):
+            lines.append(
+                f"{col}: mean={series.mean():.1f} median={series.median():.1f} "
+                f"min={series.min()} max={series.max()}"
+            )
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            if series.notna().any():
+                lines.append(f"{col}: {series.min():%Y-%m-%d} to {series.max():%Y-%m-%d}")
+        elif series.nunique() < len(series):
+            counts = series.value_counts().head(MAX_CATEGORY_COUNTS)
+            lines.append(f"{col}: " + ", ".join(f"{value}={count}" for value, count in counts.items() if count))
+    return lines
+
+
+def _to_csv(df):
+    return df.to_csv(index=False, date_format='%Y-%m-%d').strip()
+
+
+def serialize_result(df, columns, title, result_name=None, offset=0, limit=TOOL_OUTPUT_PAGE_SIZE,
+                     token_budget=TOOL_OUTPUT_TOKEN_BUDGET):
+    """Render a result as a count, summary statistics and one CSV page of rows within a token budget.
+
+    Rows are dropped from the page until the text fits token_budget. If even no rows don't fit,
+    summary lines go next, then the empty page, and as a last resort the text is cut, so the
+    budget always holds. When more rows remain and result_name is given, the output says how to
+    fetch the next page with the more_rows tool.
+    """
+    df = df[columns]
+    total = len(df)
+    offset = min(max(offset, 0), total)
+    rows = df.iloc[offset:offset + limit]
+
+    header = [f"{title}: {total} rows"]
+    if offset == 0 and total > 1:
+        header += ["Summary:"] + [f"  {line}" for line in summarize_frame(df)]
+
+    while True:
+        end = offset + len(rows)
+        page = [f"Rows {offset + 1}-{end}:" if len(rows) else "Rows: none shown", _to_csv(rows)]
+        more = []
+        if end < total and result_name:
+            more.append(f"{total - end} more rows: call more_rows with \"{result_name} {end}\" to continue.")
+        text = "\n".join(header + page + more)
+        if estimate_tokens(text) <= token_budget:
+            return text
+        if len(rows) == 0:
+            return _fit_budget(header, page, more, token_budget)
+        rows = rows.iloc[:len(rows) // 2]
+
+
+def _fit_budget(header, page, more, token_budget):
+    """Shrink an output that is over budget with no rows: drop summary lines, then the empty page, then cut."""
+    title, summary = header[0], header[1:]
+    # Keep the "Summary:" label only while at least one summary line follows it
+    while len(summary) > 1:
+        summary = summary[:-1] if len(summary) > 2 else []
+        text = "\n".join([title] + summary + page + more)
+        if estimate_tokens(text) <= token_budget:
+            return text
+    text = "\n".join([title] + more)
+    return text[:token_budget * CHARS_PER_TOKEN]
+
+
+def _cell(value):
+    if pd.isna(value):
+        return ''
+    if isinstance(value, pd.Timestamp):
+        return f"{value:%Y-%m-%d}"
+    return str(value).replace('|', '\\|')
+
+
+def format_table(df, columns, limit=LOCAL_ANSWER_MAX_ROWS):
+    """Render rows as a Markdown table for end users, with at most `limit` rows and a count of the rest."""
+    shown = df[columns].head(limit)
+    header = [col.replace('_', ' ').capitalize() for col in columns]
+    lines = ["| " + " | ".join(header) + " |", "|" + " --- |" * len(columns)]
+    lines += ["| " + " | ".join(_cell(v) for v in row) + " |" for row in shown.itertuples(index=False)]
+    if len(df) > limit:
+        lines.append(f"\nShowing {limit} of {len(df)} rows.")
+    return "\n".join(lines)
@@ -0,0 +1,365 @@
+"""SQLite storage for DataManager: admin scopes become parameterized, indexed WHERE clauses."""
+import argparse
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import fields
+from datetime import datetime, timedelta
+from itertools import groupby
+import pandas as pd
+from access_control import SCOPE_COLUMNS
+from config import SQL_CACHE_KB, SQL_POOL_SIZE
+from records import RECORD_TYPES
+from storage import KEY_COLUMNS, TABLES, JsonBackend, normalize_table, read_change_feed
+from tracing import traced
+
+logger = logging.getLogger(__name__)
+
+SQL_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Rows fetched per connection checkout by iter_records
+ITER_BATCH_SIZE = 1000
+
+# Indexes backing the scope predicate and the date windows of each query method
+INDEXES = {
+    'students': [SCOPE_COLUMNS, ['region'], ['quiz_date']],
+    'quizzes': [SCOPE_COLUMNS, ['region'], ['scheduled_date']],
+}
+
+# Derived tables served by materialized(), computed in the database instead of in pandas
+MATERIALIZED_QUERIES = {
+    'student_rollup': (
+        'SELECT "grade", "class", "region", COUNT(*) AS students, COUNT("quiz_score") AS scored, '
+        'SUM("quiz_score") AS score_sum, MIN("quiz_score") AS score_min, MAX("quiz_score") AS score_max, '
+        'SUM("homework_submitted") AS homework_submitted '
+        'FROM "students" GROUP BY "grade", "class", "region"'
+    ),
+}
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def scope_predicate(policy):
+    """Return (WHERE clause, params) restricting rows to an AccessPolicy's scope."""
+    clauses, params = [], []
+    for col, values in policy.constraints():
+        clauses.append(f"{_quote(col)} IN ({', '.join('?' * len(values))})")
+        params.extend(values)
+    return (' AND '.join(clauses) or '1 = 1'), params
+
+
+def _sql_type(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.cat.categories
+    if pd.api.types.is_bool_dtype(series):
+        return 'BOOLEAN'
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'TIMESTAMP'
+    if pd.api.types.is_integer_dtype(series):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(series):
+        return 'REAL'
+    return 'TEXT'
+
+
+def _to_sql_frame(df):
+    """Copy of df with dates as sortable text and categoricals as plain values, ready to insert."""
+    df = df.copy()
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(df[col].cat.categories.dtype)
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime(DATE_FORMAT).astype(object).where(df[col].notna(), None)
+    return df
+
+
+def _record_value(value, sql_type):
+    """Python value of one SQLite cell as the in-memory records hold it."""
+    if value is None:
+        return None
+    if sql_type == 'BOOLEAN':
+        return bool(value)
+    if sql_type == 'TIMESTAMP':
+        return datetime.strptime(value, DATE_FORMAT)
+    return value
+
+
+def _create_table(conn, table, df):
+    key_col = KEY_COLUMNS[table]
+    columns = ', '.join(
+        f"{_quote(col)} {_sql_type(df[col])}" + (' PRIMARY KEY' if col == key_col else '')
+        for col in df.columns
+    )
+    conn.execute(f"CREATE TABLE {_quote(table)} ({columns})")
+    for cols in INDEXES[table]:
+        name = _quote(f"idx_{table}_{'_'.join(cols)}")
+        conn.execute(f"CREATE INDEX {name} ON {_quote(table)} ({', '.join(map(_quote, cols))})")
+
+
+def convert_json_to_sqlite(json_path, db_path):
+    """One-time conversion of the JSON export into an indexed SQLite database."""
+    if os.path.exists(db_path):
+        raise FileExistsError(f"Database already exists: {db_path}")
+    tables = JsonBackend(json_path).load()
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            for table, df in tables.items():
+                _create_table(conn, table, df)
+                _to_sql_frame(df).to_sql(table, conn, if_exists='append', index=False, chunksize=10000)
+        conn.execute('PRAGMA journal_mode=WAL')
+    finally:
+        conn.close()
+    logger.info(f"Converted {json_path} to SQLite database at {db_path}")
+
+
+class ConnectionPool:
+    """Fixed-size pool of SQLite connections shared across threads."""
+
+    def __init__(self, path, size=SQL_POOL_SIZE):
+        self.path = path
+        self._connections = queue.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(path, check_same_thread=False)
+            # WAL lets readers keep querying while an ingest writes; cache_size bounds per-connection memory
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'PRAGMA cache_size=-{SQL_CACHE_KB}')
+            self._connections.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._connections.get()
+        try:
+            yield conn
+        finally:
+            self._connections.put(conn)
+
+    def close(self):
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+
+class SqlDataManager:
+    """DataManager over a SQLite database.
+
+    Each query method is a single SQL statement whose scope predicate comes from the admin's
+    AccessPolicy and is served by the grade/class/region and date indexes, so only matching
+    rows are ever read into memory.
+    """
+
+    def __init__(self, data_file, pool_size=SQL_POOL_SIZE):
+        start = time.perf_counter()
+        if not os.path.exists(data_file):
+            raise FileNotFoundError(f"Data file not found: {data_file}")
+        self.data_file = data_file
+        stat = os.stat(data_file)
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        self.pool = ConnectionPool(data_file, pool_size)
+        self.revision = 0
+        self._materialized = {}
+        self._ingest_lock = threading.Lock()
+        with self.pool.connection() as conn:
+            self._columns = {
+                table: {row[1]: row[2] for row in conn.execute(f"PRAGMA table_info({_quote(table)})")}
+                for table in TABLES
+            }
+        missing = [table for table in TABLES if not self._columns[table]]
+        if missing:
+            raise ValueError(f"Invalid database: missing tables {', '.join(missing)}")
+        self.load_seconds = time.perf_counter() - start
+        counts = self._counts()
+        logger.info(f"SqlDataManager opened {data_file} with {counts['students']} students and {counts['quizzes']} quizzes")
+
+    @property
+    def data_version(self):
+        """Stamp identifying the loaded data; changes when the database is replaced or records are ingested."""
+        base = f"{self.signature[0]}-{self.signature[1]}"
+        return f"{base}.{self.revision}" if self.revision else base
+
+    def scope_version(self, admin_role):
+        """Data version as seen by one scope; any ingest changes every scope's version."""
+        return self.data_version
+
+    def _counts(self):
+        with self.pool.connection() as conn:
+            return {table: conn.execute(f"SELECT COUNT(*) FROM {_quote(table)}").fetchone()[0] for table in TABLES}
+
+    def memory_usage_bytes(self):
+        """Tables stay on disk; only query results are held in memory."""
+        return 0
+
+    def get_metrics(self):
+        """Load-time and size metrics for monitoring."""
+        counts = self._counts()
+        return {
+            'data_version': self.data_version,
+            'students': counts['students'],
+            'quizzes': counts['quizzes'],
+            'load_seconds': round(self.load_seconds, 4),
+            'memory_bytes': self.memory_usage_bytes(),
+            'database_bytes': os.path.getsize(self.data_file),
+        }
+
+    def _read(self, table, admin_role, where='', params=()):
+        """Run one scoped SELECT on `table` and return typed rows in insertion order."""
+        scope, scope_params = scope_predicate(admin_role.get_policy())
+        sql = f"SELECT * FROM {_quote(table)} WHERE {scope}{' AND ' + where if where else ''} ORDER BY rowid"
+        with self.pool.connection() as conn:
+            df = pd.read_sql_query(sql, conn, params=[*scope_params, *params])
+        if df.empty:
+            return pd.DataFrame()
+        for col, sql_type in self._columns[table].items():
+            if sql_type == 'BOOLEAN':
+                df[col] = df[col].astype(bool)
+        return normalize_table(df, table)
+
+    def iter_records(self, table, admin_role, batch_size=ITER_BATCH_SIZE):
+        """Yield the admin's rows of `table` as slotted StudentRecord/QuizRecord objects, in row order.
+
+        The scoped SELECT is read in rowid-ordered batches, each on its own pooled connection,
+        so at most one batch is in memory and a slow consumer never holds a connection.
+        """
+        record_type = RECORD_TYPES[table]
+        columns = {field.name: 'class' if field.name == 'class_section' else field.name for field in fields(record_type)}
+        sql_types = self._columns[table]
+        selected = [col for col in columns.values() if col in sql_types]
+        scope, scope_params = scope_predicate(admin_role.get_policy())
+        sql = (
+            f"SELECT rowid, {', '.join(map(_quote, selected))} FROM {_quote(table)} "
+            f"WHERE {scope} AND rowid > ? ORDER BY rowid LIMIT ?"
+        )
+        last_rowid = -2**63
+        while True:
+            with self.pool.connection() as conn:
+                rows = conn.execute(sql, [*scope_params, last_rowid, batch_size]).fetchall()
+            for row in rows:
+                values = dict(zip(selected, row[1:]))
+                yield record_type(**{
+                    field: _record_value(values.get(col), sql_types.get(col)) for field, col in columns.items()
+                })
+            if len(rows) < batch_size:
+                return
+            last_rowid = rows[-1][0]
+
+    def materialized(self, name, build):
+        """Return a derived table computed by SQL in the database, cached until the data changes.
+
+        `build` is the in-memory builder DataManager would use; here the known query in
+        MATERIALIZED_QUERIES runs instead so whole tables are never loaded.
+        """
+        version = self.data_version
+        cached = self._materialized.get(name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        if name not in MATERIALIZED_QUERIES:
+            raise KeyError(f"No SQL query for materialized table '{name}'")
+        with self.pool.connection() as conn:
+            value = pd.read_sql_query(MATERIALIZED_QUERIES[name], conn)
+        self._materialized[name] = (version, value)
+        return value
+
+    @traced('data.get_filtered_students')
+    def get_filtered_students(self, admin_role):
+        """Get students accessible to this admin."""
+        try:
+            return self._read('students', admin_role)
+        except Exception as e:
+            logger.error(f"Error filtering students: {str(e)}")
+            return pd.DataFrame()
+
+    @traced('data.get_filtered_quizzes')
+    def get_filtered_quizzes(self, admin_role):
+        """Get quizzes accessible to this admin."""
+        try:
+            return self._read('quizzes', admin_role)
+        except Exception as e:
+            logger.error(f"Error filtering quizzes: {str(e)}")
+            return pd.DataFrame()
+
+    @traced('data.query_students_no_homework')
+    def query_students_no_homework(self, admin_role):
+        """Find students who haven't submitted homework."""
+        try:
+            return self._read('students', admin_role, '"homework_submitted" = 0')
+        except Exception as e:
+            logger.error(f"Error querying homework data: {str(e)}")
+            return pd.DataFrame()
+
+    @traced('data.query_performance_by_grade')
+    def query_performance_by_grade(self, admin_role, grade, days_back=7):
+        """Get performance data for a specific grade from recent days."""
+        try:
+            cutoff_date = datetime.now() - timedelta(days=days_back)
+            return self._read('students', admin_role, '"grade" = ? AND "quiz_date" >= ?',
+                              (grade, cutoff_date.strftime(DATE_FORMAT)))
+        except Exception as e:
+            logger.error(f"Error querying performance data: {str(e)}")
+            return pd.DataFrame()
+
+    @traced('data.query_upcoming_quizzes')
+    def query_upcoming_quizzes(self, admin_role, days_ahead=7):
+        """Get upcoming quizzes scheduled within next N days."""
+        try:
+            today = datetime.now()
+            future_date = today + timedelta(days=days_ahead)
+            return self._read('quizzes', admin_role,
+                              '"status" = \'upcoming\' AND "scheduled_date" BETWEEN ? AND ?',
+                              (today.strftime(DATE_FORMAT), future_date.strftime(DATE_FORMAT)))
+        except Exception as e:
+            logger.error(f"Error querying upcoming quizzes: {str(e)}")
+            return pd.DataFrame()
+
+    def _upsert(self, conn, table, records):
+        """Insert or update records that all carry the same fields."""
+        incoming = _to_sql_frame(normalize_table(pd.DataFrame(records), table))
+        columns = [col for col in incoming.columns if col in self._columns[table]]
+        key_col = KEY_COLUMNS[table]
+        updates = ', '.join(f"{_quote(col)} = excluded.{_quote(col)}" for col in columns if col != key_col)
+        conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        sql = (
+            f"INSERT INTO {_quote(table)} ({', '.join(map(_quote, columns))}) "
+            f"VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT({_quote(key_col)}) {conflict}"
+        )
+        rows = incoming[columns].astype(object).where(incoming[columns].notna(), None)
+        conn.executemany(sql, rows.itertuples(index=False, name=None))
+
+    def ingest(self, students=None, quizzes=None):
+        """Upsert student and/or quiz records (matched on student_id / quiz_id) in one transaction.
+
+        A record may carry only some fields; the others keep their stored values.
+        """
+        changes = {'students': students or [], 'quizzes': quizzes or []}
+        with self._ingest_lock, self.pool.connection() as conn:
+            with conn:
+                for table in TABLES:
+                    # Consecutive records with the same fields share one statement, so a field a
+                    # record leaves out keeps its stored value and the records apply in order
+                    for _, group in groupby(changes[table], key=lambda record: tuple(record)):
+                        self._upsert(conn, table, list(group))
+            if any(changes.values()):
+                self.revision += 1
+        applied = {table: len(changes[table]) for table in TABLES}
+        logger.info(f"Ingested {applied} at revision {self.revision}")
+        return applied
+
+    def ingest_change_feed(self, path):
+        """Apply a JSON-lines change feed; see storage.read_change_feed for the format."""
+        changes, skipped = read_change_feed(path)
+        applied = self.ingest(**changes)
+        return {'applied': sum(applied.values()), 'skipped': skipped}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a JSON data export into a SQLite database.")
+    parser.add_argument("json_path", help="Path to the JSON export (e.g. data.json)")
+    parser.add_argument("db_path", help="Output SQLite database (e.g. data.db)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    convert_json_to_sqlite(args.json_path, args.db_path)
@@ -0,0 +1,521 @@
+"""Storage backends that load student and quiz tables for DataManager."""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from access_control import SCOPE_COLUMNS
+from config import LOAD_CHUNK_SIZE, LOAD_WORKERS
+from records import ColumnTable, encode_records, parse_dates
+
+logger = logging.getLogger(__name__)
+
+TABLES = ('students', 'quizzes')
+MANIFEST_FILE = 'manifest.json'
+STORE_VERSION = 2
+JSONL_SUFFIXES = ('.jsonl', '.ndjson')
+
+# Rejected records kept for the load report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+# JSON-lines exports smaller than this load in-process when LOAD_WORKERS is 0 (auto)
+PARALLEL_LOAD_MIN_BYTES = 64 * 2**20
+READ_BLOCK_SIZE = 2**20
+
+_WHITESPACE = re.compile(r'\s*')
+_NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+# Date columns are parsed once at load so queries never re-parse strings
+DATE_COLUMNS = {
+    'students': ['homework_date', 'quiz_date'],
+    'quizzes': ['scheduled_date'],
+}
+
+# Unique record id per table, used to match changed records during ingestion
+KEY_COLUMNS = {
+    'students': 'student_id',
+    'quizzes': 'quiz_id',
+}
+
+
+def _with_scope_categories(df):
+    """Store scope columns as categoricals so masks and group-bys work on small integer codes."""
+    for col in SCOPE_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    return df
+
+
+def _with_parsed_dates(df, table):
+    """Parse the table's date columns to datetime64; unparseable values become NaT."""
+    for col in DATE_COLUMNS[table]:
+        if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = parse_dates(df[col].to_numpy(dtype=object))
+    return df
+
+
+def normalize_table(df, table):
+    """Apply the in-memory column types every backend serves: scope categoricals and parsed dates."""
+    return _with_parsed_dates(_with_scope_categories(df), table)
+
+
+class _JsonStream:
+    """Reads successive JSON tokens and values from a text file one block at a time."""
+
+    def __init__(self, f, block_size=READ_BLOCK_SIZE):
+        self.f = f
+        self.block_size = block_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        # Offset in the file of buf[0], so positions survive refills
+        self.base = 0
+        self.eof = False
+
+    def _fill(self):
+        block = self.f.read(self.block_size)
+        if not block:
+            self.eof = True
+        self.base += self.pos
+        self.buf = self.buf[self.pos:] + block
+        self.pos = 0
+
+    def _skip_whitespace(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or self.eof:
+                return
+            self._fill()
+
+    def consume(self, char):
+        """Skip `char` if it is the next token and return whether it was."""
+        self._skip_whitespace()
+        if self.buf.startswith(char, self.pos):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, char):
+        if not self.consume(char):
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buf, self.pos)
+
+    def value(self):
+        """Decode the next complete JSON value, reading more blocks until it is whole."""
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # A number cut off by the end of the block decodes as a shorter number, so only
+                # accept a value once the character after it cannot continue a number
+                if self.eof or (end < len(self.buf) and self.buf[end] not in _NUMBER_CHARS):
+                    self.pos = end
+                    return value
+            self._fill()
+
+    def elements(self):
+        """Yield lists of the elements of the array whose '[' was just consumed, up to its ']'.
+
+        All complete elements in the buffer are decoded by one C-level raw_decode call over the
+        text up to the buffer's last '}', wrapped in brackets. That decodes to the end only
+        when the cut falls between two elements; if it falls inside a string or a nested
+        object, elements are decoded one at a time until past the cut.
+        """
+        one_at_a_time_until = -1
+        while not self.consume(']'):
+            if self.base + self.pos > one_at_a_time_until:
+                cut = self.buf.rfind('}', self.pos)
+                if cut < 0 and not self.eof:
+                    self._fill()
+                    continue
+                if cut >= 0:
+                    text = '[' + self.buf[self.pos:cut + 1] + ']'
+                    try:
+                        elements, end = self.decoder.raw_decode(text)
+                    except json.JSONDecodeError:
+                        one_at_a_time_until = self.base + cut
+                    else:
+                        if end < len(text):
+                            # The array itself closed before the cut; text[end - 1] is its ']'
+                            self.pos += end - 1
+                            yield elements
+                            return
+                        self.pos = cut + 1
+                        yield elements
+                        self.consume(',')
+                        continue
+            yield [self.value()]
+            self.consume(',')
+
+
+def iter_json_batches(path, seen=None):
+    """Yield (table, [records]) batches from a {"students": [...], "quizzes": [...]} export, in file order.
+
+    The file is read one block at a time and each block's records are decoded together, so
+    the whole document is never held in memory. Top-level keys other than the tables are
+    skipped. Each table key reached is added to the `seen` set, if given, so empty tables
+    are recorded too.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        stream = _JsonStream(f)
+        stream.expect('{')
+        while not stream.consume('}'):
+            key = stream.value()
+            stream.expect(':')
+            if key in TABLES:
+                if seen is not None:
+                    seen.add(key)
+                if not stream.consume('['):
+                    raise ValueError(f"Invalid data format: '{key}' is not a list")
+                for records in stream.elements():
+                    yield key, records
+            else:
+                stream.value()
+            stream.consume(',')
+
+
+def iter_json_export(path, seen=None):
+    """Yield (table, record) pairs from an export, in file order; see iter_json_batches."""
+    for table, records in iter_json_batches(path, seen):
+        for record in records:
+            yield table, record
+
+
+def _encode_chunk(records, positions, table):
+    """Validate one chunk and encode its valid records.
+
+    Returns (ColumnTable or None, [(table, position, reason)]) with positions taken from `positions`.
+    """
+    encoded, rejected = encode_records(records, table, required=(KEY_COLUMNS[table],))
+    errors = [(table, positions[i], reason) for i, reason in rejected]
+    return encoded, errors
+
+
+class _ChunkedLoad:
+    """Encoded chunks per table, in file order, plus rejected-record counts and the first errors."""
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.chunks = {table: [] for table in TABLES}
+        self.pending = {table: ([], []) for table in TABLES}
+        self.rejected = {}
+        self.errors = []
+
+    def reject(self, errors):
+        """Count (table, position, reason) entries per table and keep the first few."""
+        for table, _, _ in errors:
+            self.rejected[table] = self.rejected.get(table, 0) + 1
+        self.errors += errors[:MAX_REPORTED_ERRORS - len(self.errors)]
+
+    def add(self, table, record, position):
+        records, positions = self.pending[table]
+        records.append(record)
+        positions.append(position)
+        if len(records) >= self.chunk_size:
+            self.flush(table)
+
+    def extend(self, table, records, first_position):
+        """Add consecutive records numbered from first_position, encoding every full chunk."""
+        pending, positions = self.pending[table]
+        pending += records
+        positions += range(first_position, first_position + len(records))
+        while len(pending) >= self.chunk_size:
+            self.pending[table] = (pending[:self.chunk_size], positions[:self.chunk_size])
+            self.flush(table)
+            pending, positions = pending[self.chunk_size:], positions[self.chunk_size:]
+            self.pending[table] = (pending, positions)
+
+    def flush(self, table):
+        records, positions = self.pending[table]
+        if records:
+            encoded, errors = _encode_chunk(records, positions, table)
+            if encoded is not None:
+                self.chunks[table].append(encoded)
+            self.reject(errors)
+        self.pending[table] = ([], [])
+
+    def merge(self, other, offset=0):
+        """Append a later part of the file loaded separately, shifting its error positions by offset."""
+        for table in TABLES:
+            self.chunks[table] += other.chunks[table]
+        for table, count in other.rejected.items():
+            self.rejected[table] = self.rejected.get(table, 0) + count
+        shifted = [(table, offset + position, reason) for table, position, reason in other.errors]
+        self.errors += shifted[:MAX_REPORTED_ERRORS - len(self.errors)]
+
+    def tables(self):
+        for table in TABLES:
+            self.flush(table)
+        return {table: ColumnTable.concat(self.chunks[table], table).to_frame() for table in TABLES}
+
+
+class JsonBackend:
+    """Streams the row-oriented JSON export into compact column tables served as DataFrame views.
+
+    Records are validated against the table schema in chunks of `chunk_size`; invalid records
+    are counted in `rejected` (the first few kept in `errors`) and skipped instead of failing
+    the load. Malformed JSON still fails, since a single document cannot be resynchronized.
+    """
+
+    position_label = 'record'
+
+    def __init__(self, path, chunk_size=LOAD_CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.rejected = {}
+        self.errors = []
+
+    def _report(self, load):
+        self.rejected, self.errors = load.rejected, load.errors
+        total = sum(self.rejected.values())
+        if total:
+            table, position, reason = self.errors[0]
+            logger.warning(
+                f"Skipped {total} invalid records in {self.path} ({self.rejected}); "
+                f"first: {table} {self.position_label} {position}: {reason}"
+            )
+
+    def load(self):
+        """Return {'students': DataFrame, 'quizzes': DataFrame}."""
+        load = _ChunkedLoad(self.chunk_size)
+        seen = set()
+        counts = {table: 0 for table in TABLES}
+        try:
+            for table, records in iter_json_batches(self.path, seen):
+                load.extend(table, records, counts[table])
+                counts[table] += len(records)
+        except json.JSONDecodeError as e:
+            logger.error(f"Invalid JSON in data file: {str(e)}")
+            raise
+
+        if seen != set(TABLES):
+            raise ValueError("Invalid data format: missing 'students' or 'quizzes' key")
+        tables = load.tables()
+        self._report(load)
+        return tables
+
+
+def _load_jsonl_range(path, start, end, chunk_size):
+    """Parse, validate and encode the lines that start in [start, end) of a JSON-lines export.
+
+    Returns (_ChunkedLoad, line count); error positions are line numbers within the range,
+    starting at 1, and malformed lines are counted under 'malformed'.
+    """
+    load = _ChunkedLoad(chunk_size)
+    line_number = 0
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                table, record = entry['table'], entry['record']
+                if table not in TABLES:
+                    raise ValueError(f"unknown table {table!r}")
+            except (ValueError, KeyError, TypeError) as e:
+                load.reject([('malformed', line_number, str(e))])
+                continue
+            load.add(table, record, line_number)
+    for table in TABLES:
+        load.flush(table)
+    return load, line_number
+
+
+def _line_ranges(path, parts):
+    """Split a file into up to `parts` byte ranges that each start at the beginning of a line."""
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, parts):
+            f.seek(max(size * i // parts - 1, 0))
+            f.readline()
+            bounds.append(max(f.tell(), bounds[-1]))
+    bounds.append(size)
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+class JsonLinesBackend(JsonBackend):
+    """Loads a JSON-lines export of {"table": ..., "record": {...}} entries, one per line.
+
+    This is the change-feed format, so the whole export can be split at line boundaries and
+    parsed, validated and encoded by several worker processes at once. Malformed lines are
+    rejected like invalid records rather than failing the load; positions are line numbers.
+    """
+
+    position_label = 'line'
+
+    def __init__(self, path, chunk_size=LOAD_CHUNK_SIZE, workers=LOAD_WORKERS):
+        super().__init__(path, chunk_size)
+        self.workers = workers
+
+    def _worker_count(self):
+        if self.workers > 0:
+            return self.workers
+        if os.path.getsize(self.path) < PARALLEL_LOAD_MIN_BYTES:
+            return 1
+        return os.cpu_count() or 1
+
+    def load(self):
+        """Return {'students': DataFrame, 'quizzes': DataFrame}."""
+        workers = self._worker_count()
+        ranges = _line_ranges(self.path, workers)
+        args = [(self.path, start, end, self.chunk_size) for start, end in ranges]
+        if workers > 1 and len(ranges) > 1:
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=len(ranges), mp_context=context) as pool:
+                results = list(pool.map(_load_jsonl_range, *zip(*args)))
+        else:
+            results = [_load_jsonl_range(*a) for a in args]
+
+        load = _ChunkedLoad(self.chunk_size)
+        lines_before = 0
+        for part, lines in results:
+            load.merge(part, offset=lines_before)
+            lines_before += lines
+        tables = load.tables()
+        self._report(load)
+        return tables
+
+
+class ColumnarBackend:
+    """Reads a directory of memory-mapped NumPy column files written by convert_json_to_columnar().
+
+    Numeric, boolean and date columns are mapped directly; string columns are dictionary-encoded
+    as memory-mapped integer codes plus a small category list, so every process that opens
+    the store shares the same OS page cache. In memory only the scope columns stay categorical;
+    other text columns are decoded to plain strings, so the frames match the JSON backend's.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('version') != STORE_VERSION:
+            raise ValueError(f"Unsupported columnar store version: {self.manifest.get('version')}")
+
+    def _load_table(self, table):
+        spec = self.manifest['tables'][table]
+        columns = {}
+        for col in spec['columns']:
+            values = np.load(os.path.join(self.path, table, col['file']), mmap_mode='r')
+            if col['kind'] == 'categorical' and col['name'] in SCOPE_COLUMNS:
+                values = pd.Categorical.from_codes(values, categories=col['categories'])
+            elif col['kind'] == 'categorical':
+                # Code -1 (missing) picks the trailing None
+                values = np.asarray(col['categories'] + [None], dtype=object)[values]
+            columns[col['name']] = values
+        # copy=False keeps each column backed by its memory map instead of consolidating blocks
+        return pd.DataFrame(columns, index=pd.RangeIndex(spec['rows']), copy=False)
+
+    def load(self):
+        """Return {'students': DataFrame, 'quizzes': DataFrame} backed by memory maps."""
+        return {table: self._load_table(table) for table in TABLES}
+
+
+def open_backend(path):
+    """Pick the storage backend for a data path (columnar store directory, JSON-lines or JSON file)."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Data file not found: {path}")
+    if os.path.isdir(path):
+        return ColumnarBackend(path)
+    if path.lower().endswith(JSONL_SUFFIXES):
+        return JsonLinesBackend(path)
+    return JsonBackend(path)
+
+
+def read_change_feed(path):
+    """Parse a JSON-lines change feed of {"table": "students"|"quizzes", "record": {...}} entries.
+
+    Malformed lines are logged and skipped. Returns ({table: [records]}, skipped line count).
+    """
+    changes = {table: [] for table in TABLES}
+    skipped = 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                table, record = entry['table'], entry['record']
+                if table not in changes or KEY_COLUMNS[table] not in record:
+                    raise ValueError(f"unknown table or missing {KEY_COLUMNS.get(table, 'id')}")
+                changes[table].append(record)
+            except (ValueError, KeyError, TypeError) as e:
+                skipped += 1
+                logger.warning(f"Skipping change feed line {line_number}: {str(e)}")
+    return changes, skipped
+
+
+def _write_column(table_dir, name, series):
+    """Write one column and return its manifest entry."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        file_name = f"{name}.npy"
+        np.save(os.path.join(table_dir, file_name), series.to_numpy(dtype='datetime64[ns]'))
+        return {'name': name, 'kind': 'array', 'file': file_name}
+    if name in SCOPE_COLUMNS or not (pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series)):
+        categorical = pd.Categorical(series)
+        file_name = f"{name}.codes.npy"
+        np.save(os.path.join(table_dir, file_name), categorical.codes)
+        return {
+            'name': name,
+            'kind': 'categorical',
+            'file': file_name,
+            'categories': categorical.categories.tolist(),
+        }
+    file_name = f"{name}.npy"
+    np.save(os.path.join(table_dir, file_name), series.to_numpy())
+    return {'name': name, 'kind': 'array', 'file': file_name}
+
+
+def convert_json_to_columnar(json_path, store_path):
+    """One-time conversion of the JSON export into a columnar store directory."""
+    tables = JsonBackend(json_path).load()
+    manifest = {'version': STORE_VERSION, 'source': os.path.basename(json_path), 'tables': {}}
+    for table, df in tables.items():
+        table_dir = os.path.join(store_path, table)
+        os.makedirs(table_dir, exist_ok=True)
+        manifest['tables'][table] = {
+            'rows': len(df),
+            'columns': [_write_column(table_dir, name, df[name]) for name in df.columns],
+        }
+
+    # Write the manifest last so a partially written store is never opened
+    with open(os.path.join(store_path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    logger.info(f"Converted {json_path} to columnar store at {store_path}")
+    return manifest
+
+
+def convert_json_to_jsonl(json_path, jsonl_path):
+    """Rewrite the JSON export as JSON lines, streaming so neither file is held in memory."""
+    count = 0
+    with open(jsonl_path, 'w', encoding='utf-8') as f:
+        for table, record in iter_json_export(json_path):
+            f.write(json.dumps({'table': table, 'record': record}, ensure_ascii=False) + "\n")
+            count += 1
+    logger.info(f"Converted {json_path} to {count} JSON lines at {jsonl_path}")
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a JSON data export into a columnar store or JSON lines.")
+    parser.add_argument("json_path", help="Path to the JSON export (e.g. data.json)")
+    parser.add_argument("store_path", help="Output directory for the columnar store, or a .jsonl file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.store_path.lower().endswith(JSONL_SUFFIXES):
+        convert_json_to_jsonl(args.json_path, args.store_path)
+    else:
+        convert_json_to_columnar(args.json_path, args.store_path)
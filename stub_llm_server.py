@@ -0,0 +1,149 @@
+"""Deterministic OpenAI-compatible chat completions server for offline tests and benchmarks.
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8900/v1 and any API key.
+The stub picks tools with the intent router's rules (several at once when a question
+matches more than one) and answers from the tool outputs it is sent back.
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from intent_router import IntentRouter
+
+logger = logging.getLogger(__name__)
+
+_router = IntentRouter()
+
+
+def _pick_tools(question, available):
+    """All tools whose intent rules match the question, defaulting to listing students."""
+    names = [name for name, rules in _router.patterns.items() if any(r.search(question) for r in rules)]
+    names = [name for name in names if name in available]
+    if not names and 'all_students' in available:
+        names = ['all_students']
+    return names
+
+
+def build_reply(messages, tools):
+    """Return (content, tool_calls) for the next assistant turn of a conversation."""
+    last_user = max(i for i, m in enumerate(messages) if m.get('role') == 'user')
+    tool_results = [m for m in messages[last_user + 1:] if m.get('role') == 'tool']
+    if tool_results:
+        body = "\n\n".join(str(m.get('content', '')) for m in tool_results)
+        return f"Here is what I found:\n\n{body}", []
+
+    if not tools:
+        # Plain completions such as conversation summaries
+        return "The admin asked earlier questions about their students' homework, quizzes and performance.", []
+
+    question = str(messages[last_user].get('content', ''))
+    available = {t['function']['name'] for t in tools or []}
+    calls = [
+        {
+            'id': f"call_{i}",
+            'type': 'function',
+            'function': {'name': name, 'arguments': json.dumps({'__arg1': question})},
+        }
+        for i, name in enumerate(_pick_tools(question, available))
+    ]
+    if not calls:
+        return "I can only answer questions about your students' homework, quizzes and performance.", []
+    return None, calls
+
+
+def _usage(messages, content, tool_calls):
+    prompt_tokens = sum(len(str(m.get('content') or '').split()) for m in messages)
+    completion_tokens = len((content or '').split()) + sum(len(c['function']['arguments'].split()) for c in tool_calls)
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens,
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Handles POST /v1/chat/completions with optional SSE streaming."""
+
+    latency = 0.0
+    model = 'stub-model'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f"Unknown path {self.path}"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        messages = request.get('messages', [])
+        content, tool_calls = build_reply(messages, request.get('tools'))
+        if self.latency:
+            time.sleep(self.latency)
+
+        finish_reason = 'tool_calls' if tool_calls else 'stop'
+        base = {'id': 'chatcmpl-stub', 'created': int(time.time()), 'model': request.get('model', self.model)}
+        if not request.get('stream'):
+            message = {'role': 'assistant', 'content': content}
+            if tool_calls:
+                message['tool_calls'] = tool_calls
+            self._send_json(200, {
+                **base,
+                'object': 'chat.completion',
+                'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason}],
+                'usage': _usage(messages, content, tool_calls),
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        deltas = [{'role': 'assistant', 'content': ''}]
+        deltas += [{'tool_calls': [{'index': i, **call}]} for i, call in enumerate(tool_calls)]
+        if content:
+            deltas += [{'content': word if i == 0 else f" {word}"} for i, word in enumerate(content.split(' '))]
+        for i, delta in enumerate(deltas + [{}]):
+            chunk = {
+                **base,
+                'object': 'chat.completion.chunk',
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason if i == len(deltas) else None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def _make_server(host, port, latency):
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'latency': latency})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_stub_server(host='127.0.0.1', port=0, latency=0.0):
+    """Start the stub in a background thread; returns (server, base_url)."""
+    server = _make_server(host, port, latency)
+    threading.Thread(target=server.serve_forever, name="stub-llm-server", daemon=True).start()
+    base_url = f"http://{host}:{server.server_address[1]}/v1"
+    logger.info(f"Stub LLM server listening on {base_url}")
+    return server, base_url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a deterministic OpenAI-compatible stub server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Artificial delay per completion")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = _make_server(args.host, args.port, args.latency_ms / 1000)
+    logger.info(f"Stub LLM server listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
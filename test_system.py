@@ -1,9 +1,38 @@
 """Test script to verify the system is working correctly."""
+import json
 import os
+import asyncio
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import httpx
+import numpy as np
+import pandas as pd
 from dotenv import load_dotenv
-from access_control import DEMO_ADMINS
+from access_control import DEMO_ADMINS, AdminRole
+from analytics import Analytics
+from batch import BatchRunner
+from benchmark import compare_to_baseline, generate_dataset, run_benchmark
 from data_manager import DataManager
-from query_agent import QueryAgent
+from conversation_memory import BoundedSummaryMemory, compact_message
+from intent_router import IntentRouter
+from llm_client import get_shared_llm, run_coroutine
+from process_pool import ProcessDataManager
+from query_agent import QueryAgent, parse_count, parse_group_by
+from records import ColumnTable, StudentRecord, dict_records_nbytes
+from response_cache import ResponseCache
+from result_format import estimate_tokens, serialize_result
+from sql_backend import SqlDataManager, convert_json_to_sqlite
+from storage import JsonBackend, JsonLinesBackend, convert_json_to_columnar, convert_json_to_jsonl
+from tracing import get_registry
+from stub_llm_server import start_stub_server
+
+def load_raw_data():
+    """Load the raw JSON records used as the per-record reference."""
+    with open('data.json', 'r', encoding='utf-8') as f:
+        return json.load(f)
 
 def test_data_manager():
     """Test data manager functionality."""
@@ -26,6 +55,670 @@ def test_data_manager():
         print(f"✗ DataManager test failed: {str(e)}")
         return False
 
+def test_scope_index():
+    """Test that the partition index matches per-row access checks."""
+    print("\nTesting scope index...")
+    dm = DataManager()
+    raw = load_raw_data()
+    for admin in DEMO_ADMINS.values():
+        students = dm.get_filtered_students(admin)
+        expected = [s['student_id'] for s in raw['students'] if admin.can_access_student(s)]
+        assert list(students.get('student_id', [])) == expected, f"Student mismatch for {admin.admin_id}"
+        
+        quizzes = dm.get_filtered_quizzes(admin)
+        expected = [q['quiz_id'] for q in raw['quizzes'] if admin.can_access_quiz(q)]
+        assert list(quizzes.get('quiz_id', [])) == expected, f"Quiz mismatch for {admin.admin_id}"
+    
+    print("✓ Scope index matches per-row filtering")
+
+def test_access_policy():
+    """Test that compiled policy masks match the per-record reference checks."""
+    print("\nTesting AccessPolicy...")
+    dm = DataManager()
+    raw = load_raw_data()
+    admins = list(DEMO_ADMINS.values()) + [
+        AdminRole("multi", "Multi Scope", grade=[8, 9], region=["North", "South"]),
+        AdminRole("class_a", "Class A", class_section="A"),
+        AdminRole("all", "Unrestricted"),
+    ]
+    for admin in admins:
+        policy = admin.get_policy()
+        expected = [admin.can_access_student(s) for s in raw['students']]
+        assert list(policy.mask(dm.students_df)) == expected, f"Student mask mismatch for {admin.admin_id}"
+        
+        expected = [i for i, q in enumerate(raw['quizzes']) if admin.can_access_quiz(q)]
+        assert list(policy.row_index(dm.quizzes_df)) == expected, f"Quiz rows mismatch for {admin.admin_id}"
+        assert len(dm.get_filtered_students(admin)) == policy.mask(dm.students_df).sum()
+    
+    print("✓ AccessPolicy matches per-record checks")
+
+def test_columnar_backend():
+    """Test that the columnar store serves the same results as the JSON file."""
+    print("\nTesting columnar backend...")
+    json_dm = DataManager()
+    with tempfile.TemporaryDirectory() as store_path:
+        convert_json_to_columnar('data.json', store_path)
+        columnar_dm = DataManager(store_path)
+        for admin in DEMO_ADMINS.values():
+            for method in ('get_filtered_students', 'get_filtered_quizzes', 'query_students_no_homework'):
+                expected = getattr(json_dm, method)(admin)
+                actual = getattr(columnar_dm, method)(admin)
+                pd.testing.assert_frame_equal(actual, expected, obj=f"{method} for {admin.admin_id}")
+        assert str(columnar_dm.students_df['region'].dtype) == 'category'
+        for table in ('students', 'quizzes'):
+            # copy() reads the memory-mapped columns into plain arrays for the comparison
+            pd.testing.assert_frame_equal(getattr(columnar_dm, f"{table}_df").copy(), getattr(json_dm, f"{table}_df"))
+    
+    print("✓ Columnar backend matches JSON backend")
+
+def test_record_model():
+    """Test that compact column tables round-trip records and back the DataFrames without copies."""
+    print("\nTesting record model...")
+    raw = load_raw_data()
+    table = ColumnTable.from_records(raw['students'], 'students')
+    df = table.to_frame()
+    assert list(df['student_id']) == [s['student_id'] for s in raw['students']]
+    assert str(df['region'].dtype) == 'category'
+    assert np.shares_memory(df['region'].cat.codes.to_numpy(), table.columns['region']), "Scope codes were copied"
+    
+    record = table.record(0)
+    assert isinstance(record, StudentRecord) and not hasattr(record, '__dict__')
+    assert record.get('class') == raw['students'][0]['class']
+    assert table.nbytes < dict_records_nbytes(raw['students'])
+    
+    dm = DataManager()
+    for admin in DEMO_ADMINS.values():
+        records = list(dm.iter_records('students', admin))
+        expected = [s['student_id'] for s in raw['students'] if admin.can_access_student(s)]
+        assert [r.student_id for r in records] == expected, f"Record mismatch for {admin.admin_id}"
+        assert all(admin.can_access_student(r) for r in records)
+    
+    print(f"✓ Compact table uses {table.nbytes} bytes vs {dict_records_nbytes(raw['students'])} as dicts")
+
+def test_streaming_loader():
+    """Test that chunked JSON and parallel JSON-lines loading match and skip invalid records."""
+    print("\nTesting streaming loader...")
+    json_dm = DataManager()
+    with tempfile.TemporaryDirectory() as tmp:
+        jsonl_path = os.path.join(tmp, 'data.jsonl')
+        convert_json_to_jsonl('data.json', jsonl_path)
+        with open(jsonl_path, 'a', encoding='utf-8') as f:
+            f.write("not json\n")
+            f.write(json.dumps({"table": "students", "record": {"student_id": "S950", "grade": [8], "quiz_score": 70}}) + "\n")
+            f.write(json.dumps({"table": "students", "record": {"name": "No Id", "grade": 8}}) + "\n")
+            f.write(json.dumps({"table": "quizzes", "record": {"quiz_id": "Q950", "scheduled_date": "someday"}}) + "\n")
+        
+        backend = JsonLinesBackend(jsonl_path, chunk_size=2, workers=2)
+        jsonl_dm = DataManager(jsonl_path, backend=backend)
+        assert backend.rejected == {'malformed': 1, 'students': 2, 'quizzes': 1}, f"Unexpected rejects {backend.rejected}"
+        reasons = {reason for _, _, reason in backend.errors}
+        assert {"grade: expected code, got list", "missing student_id"} <= reasons, f"Unexpected reasons {reasons}"
+        assert jsonl_dm.get_metrics()['rejected_records'] == 4
+        for admin in DEMO_ADMINS.values():
+            for method in ('get_filtered_students', 'get_filtered_quizzes'):
+                expected = getattr(json_dm, method)(admin)
+                actual = getattr(jsonl_dm, method)(admin)
+                assert actual.astype(str).equals(expected.astype(str)), f"{method} mismatch for {admin.admin_id}"
+        
+        chunked = JsonBackend('data.json', chunk_size=3).load()
+        for table, df in chunked.items():
+            reference = getattr(json_dm, f"{table}_df")
+            assert df.astype(str).equals(reference.astype(str)), f"Chunked {table} differs"
+
+        empty_path = os.path.join(tmp, 'empty.json')
+        with open(empty_path, 'w', encoding='utf-8') as f:
+            json.dump({"students": load_raw_data()['students'][:2], "quizzes": []}, f)
+        empty = JsonBackend(empty_path).load()
+        assert len(empty['students']) == 2 and empty['quizzes'].empty, "An empty table should load"
+        with open(empty_path, 'w', encoding='utf-8') as f:
+            json.dump({"students": []}, f)
+        try:
+            JsonBackend(empty_path).load()
+            raise AssertionError("A missing table should fail the load")
+        except ValueError:
+            pass
+
+        mixed_path = os.path.join(tmp, 'mixed_dates.json')
+        dates = ['2025-11-10', '2025-11-08 14:30', '2025-11-10T09:00:00Z', '2025-11-10T09:00:00+02:00',
+                 '2025-11-10 09:00:00.123', '11/10/2025', None, 'someday']
+        students = [dict(load_raw_data()['students'][0], student_id=f"S{900 + i}", homework_date=d)
+                    for i, d in enumerate(dates)]
+        with open(mixed_path, 'w', encoding='utf-8') as f:
+            json.dump({"students": students, "quizzes": []}, f)
+        loads = []
+        for chunk_size in (len(dates), 1):
+            mixed = JsonBackend(mixed_path, chunk_size=chunk_size)
+            loads.append(mixed.load()['students']['homework_date'])
+            assert mixed.rejected == {'students': 1}, f"Only 'someday' should be rejected, got {mixed.rejected}"
+        pd.testing.assert_series_equal(loads[0], loads[1])
+        assert [str(d) for d in loads[0]] == ['2025-11-10 00:00:00', '2025-11-08 14:30:00', '2025-11-10 09:00:00',
+                                              '2025-11-10 07:00:00', '2025-11-10 09:00:00.123000',
+                                              '2025-11-10 00:00:00', 'NaT'], f"Unexpected dates {loads[0].tolist()}"
+
+    print(f"✓ Streaming loads match; rejected {backend.rejected}")
+
+def test_sql_backend():
+    """Test that the SQLite backend returns the same rows as the in-memory DataManager."""
+    print("\nTesting SQL backend...")
+    dm = DataManager()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'data.db')
+        convert_json_to_sqlite('data.json', db_path)
+        sql_dm = SqlDataManager(db_path, pool_size=2)
+        for admin in DEMO_ADMINS.values():
+            for method, args in [
+                ('get_filtered_students', ()),
+                ('get_filtered_quizzes', ()),
+                ('query_students_no_homework', ()),
+                ('query_performance_by_grade', (admin.grade or 8, 36500)),
+                ('query_upcoming_quizzes', (36500,)),
+            ]:
+                expected = getattr(dm, method)(admin, *args)
+                actual = getattr(sql_dm, method)(admin, *args)
+                assert len(actual) == len(expected), f"{method} row count differs for {admin.admin_id}"
+                if len(expected):
+                    key = expected.columns[0]
+                    assert list(actual[key]) == list(expected[key]), f"{method} rows differ for {admin.admin_id}"
+                    assert list(actual.dtypes.astype(str)) == list(expected.dtypes.astype(str)), f"{method} types differ"
+            for table in ('students', 'quizzes'):
+                expected = list(dm.iter_records(table, admin))
+                assert list(sql_dm.iter_records(table, admin, batch_size=2)) == expected, f"{table} records differ"
+            stats = Analytics(sql_dm).score_stats(admin, 'class').to_dict('list')
+            assert stats == Analytics(dm).score_stats(admin, 'class').to_dict('list'), "Rollup stats differ"
+        
+        admin2 = DEMO_ADMINS['admin2']
+        version = sql_dm.scope_version(admin2)
+        sql_dm.ingest(students=[{
+            "student_id": "S005", "name": "Emma Wilson", "grade": 9, "class": "A", "region": "South",
+            "homework_submitted": False, "homework_date": "2025-11-10", "quiz_score": 95, "quiz_date": "2025-11-08"
+        }])
+        assert sql_dm.scope_version(admin2) != version
+        assert 'S005' in set(sql_dm.query_students_no_homework(admin2)['student_id'])
+        sql_dm.ingest(students=[{"student_id": "S006", "quiz_score": 51}, {"student_id": "S005", "quiz_score": 90}])
+        rows = sql_dm.get_filtered_students(admin2).set_index('student_id')
+        assert rows.loc['S006', 'quiz_score'] == 51 and rows.loc['S006', 'name'] == "Frank Brown", "Partial update lost fields"
+        sql_dm.pool.close()
+    print("✓ SQL backend matches in-memory results")
+
+def test_intent_router():
+    """Test that common questions are routed and answered without the LLM."""
+    print("\nTesting intent router...")
+    router = IntentRouter()
+    cases = {
+        "Which students haven't submitted their homework yet?": 'students_no_homework',
+        "Show me performance data for Grade 8 from last week": 'performance_data',
+        "List all upcoming quizzes scheduled for next week": 'upcoming_quizzes',
+        "Who are my students?": 'all_students',
+        "Why did Grade 8 scores drop compared to last month?": None,
+        # Extra filters the lookups cannot apply go to the LLM instead of being dropped
+        "Which students in class B haven't submitted homework?": None,
+        "Grade 8 scores from the last 30 days": None,
+        "upcoming quizzes for the next 3 weeks": None,
+        "Show Grade 8 quiz results for Alice": None,
+        "Who are my students in class A?": None,
+        "Which grade 8 students haven't submitted homework?": None,
+    }
+    for question, intent in cases.items():
+        assert router.route(question) == intent, f"Wrong intent for: {question}"
+    
+    # Routed answers never reach the LLM, so a placeholder key is enough
+    agent = QueryAgent(DataManager(), DEMO_ADMINS['admin1'], "sk-offline-test")
+    answer = agent.query("Which students haven't submitted their homework yet?")
+    assert "Bob Smith" in answer and "David Lee" in answer and "Alice Johnson" not in answer
+    assert "| Name |" in answer and "Summary:" not in answer and "more_rows" not in answer and "```" not in answer
+    print("✓ Intent router answers common questions locally")
+
+def test_response_cache():
+    """Test cache hits, scope isolation, version invalidation and eviction."""
+    print("\nTesting response cache...")
+    cache = ResponseCache(max_entries=2, ttl_seconds=60, similarity_threshold=0.85)
+    cache.put("Grade 8, Region North", "v1", "Who are my students?", "answer-8")
+    assert cache.get("Grade 8, Region North", "v1", "who are my students") == "answer-8"
+    assert cache.get("Grade 8, Region North", "v1", "Who are all my students?") == "answer-8"
+    assert cache.get("Grade 9, Region South", "v1", "Who are my students?") is None, "Leaked across scopes"
+    assert cache.get("Grade 8, Region North", "v2", "Who are my students?") is None, "Stale after reload"
+    
+    cache.put("Grade 8, Region North", "v1", "Show performance for Grade 8", "perf-8")
+    assert cache.get("Grade 8, Region North", "v1", "Show performance for Grade 9") is None
+    cache.put("Grade 8, Region North", "v1", "List upcoming quizzes", "quizzes")
+    assert cache.stats()['entries'] == 2 and cache.stats()['evictions'] == 1
+    print(f"✓ Response cache working: {cache.stats()}")
+
+def test_async_agent():
+    """Test concurrent async queries with parallel tool calls against the stub LLM server."""
+    print("\nTesting async agent against stub LLM...")
+    server = None
+    try:
+        server, base_url = start_stub_server()
+        llm = get_shared_llm("sk-stub", base_url=base_url)
+        dm = DataManager()
+        agents = [QueryAgent(dm, DEMO_ADMINS[admin_id], "sk-stub", llm=llm) for admin_id in ('admin1', 'admin2', 'admin3')]
+        for agent in agents:
+            # Force the LLM path
+            agent.router = None
+            agent.cache = None
+        question = "Which students haven't submitted homework, and who are my students?"
+        
+        async def ask_all():
+            return await asyncio.gather(*(agent.aquery(question) for agent in agents))
+        
+        answers = run_coroutine(ask_all(), timeout=60)
+        # The stub requests both tools in one step, so each answer holds both tables
+        assert "Bob Smith" in answers[0] and "Alice Johnson" in answers[0]
+        assert "Alice Johnson" not in answers[1], "Admin2 saw admin1's students"
+        
+        # Tool bodies and local answers must not run on the event loop's thread
+        query_threads = []
+        class RecordingDataManager(DataManager):
+            def query_students_no_homework(self, admin_role):
+                query_threads.append(threading.get_ident())
+                return super().query_students_no_homework(admin_role)
+        
+        async def loop_thread():
+            return threading.get_ident()
+        
+        recording = RecordingDataManager()
+        tool_agent = QueryAgent(recording, DEMO_ADMINS['admin1'], "sk-stub", llm=llm, router=None)
+        tool_agent.cache = None
+        local_agent = QueryAgent(recording, DEMO_ADMINS['admin1'], "sk-stub", llm=llm, router=IntentRouter())
+        local_agent.cache = None
+        run_coroutine(tool_agent.aquery(question), timeout=60)
+        assert "Bob Smith" in run_coroutine(local_agent.aquery("Which students haven't submitted homework?"), timeout=60)
+        assert len(query_threads) == 2 and run_coroutine(loop_thread()) not in query_threads, "Blocked the event loop"
+        print("✓ Async agent answered concurrent queries with parallel tools")
+    finally:
+        if server:
+            server.shutdown()
+
+def test_conversation_memory():
+    """Test that history keeps the last K exchanges and compacts tables."""
+    print("\nTesting conversation memory...")
+    server = None
+    try:
+        server, base_url = start_stub_server()
+        memory = BoundedSummaryMemory(
+            llm=get_shared_llm("sk-stub", base_url=base_url),
+            memory_key="chat_history",
+            return_messages=True,
+            k=2,
+            max_token_limit=1000
+        )
+        table = "**Your students**:\n\n```\nname grade\nAlice 8\nBob 8\n```"
+        assert "Alice" not in compact_message(table) and "2 rows omitted" in compact_message(table)
+        
+        for i in range(5):
+            memory.save_context({"input": f"question {i}"}, {"output": table})
+        history = memory.load_memory_variables({})["chat_history"]
+        assert len(history) == 5, "Expected summary plus the last 2 exchanges"
+        assert history[1].content == "question 3" and memory.moving_summary_buffer
+        assert memory.last_history_tokens > 0
+        
+        # The async path used by aquery applies the same compaction and bound
+        async_memory = BoundedSummaryMemory(
+            llm=get_shared_llm("sk-stub", base_url=base_url),
+            memory_key="chat_history",
+            return_messages=True,
+            k=2,
+            max_token_limit=1000
+        )
+        
+        async def converse():
+            for i in range(5):
+                await async_memory.asave_context({"input": f"question {i}"}, {"output": table})
+            return (await async_memory.aload_memory_variables({}))["chat_history"]
+        
+        async_history = run_coroutine(converse())
+        assert len(async_history) == 5 and async_history[1].content == "question 3"
+        assert "Alice" not in async_history[2].content and async_memory.moving_summary_buffer
+        print(f"✓ Memory bounded to {len(history)} messages ({memory.last_history_tokens} tokens)")
+    finally:
+        if server:
+            server.shutdown()
+
+def test_result_format():
+    """Test that large results are summarized, capped and pageable."""
+    print("\nTesting result serializer...")
+    df = pd.DataFrame({
+        'name': [f"Student {i}" for i in range(5000)],
+        'grade': [7 + i % 3 for i in range(5000)],
+        'quiz_score': [40 + i % 60 for i in range(5000)],
+    })
+    first = serialize_result(df, ['name', 'quiz_score'], "Scores", result_name="all_students", token_budget=300)
+    assert estimate_tokens(first) <= 300, "Output exceeded token budget"
+    assert "5000 rows" in first and "quiz_score: mean=" in first
+    assert 'more_rows with "all_students' in first
+    
+    last = serialize_result(df, ['name', 'quiz_score'], "Scores", result_name="all_students", offset=4990)
+    assert "Student 4999" in last and "more rows" not in last
+
+    # Budgets too small for even the header and summary still hold
+    for budget in (0, 5, 20, 40):
+        tiny = serialize_result(df, ['name', 'grade', 'quiz_score'], "Scores", result_name="all_students", token_budget=budget)
+        assert estimate_tokens(tiny) <= budget, f"Output exceeded a {budget}-token budget"
+    tiny = serialize_result(df, ['name', 'grade', 'quiz_score'], "Scores", result_name="all_students", token_budget=25)
+    assert tiny.startswith("Scores: 5000 rows") and 'more_rows with "all_students 0"' in tiny, "Kept the wrong lines"
+    print("✓ Result serializer respects token budget and paginates")
+
+class _InMemoryBackend:
+    """Storage backend serving prebuilt DataFrames."""
+    
+    def __init__(self, tables):
+        self.tables = tables
+    
+    def load(self):
+        return self.tables
+
+def test_time_windows():
+    """Test that date-sorted window queries match a full scan."""
+    print("\nTesting time-window queries...")
+    from datetime import datetime, timedelta
+    now = datetime.now()
+    students = pd.DataFrame({
+        'student_id': [f"S{i}" for i in range(200)],
+        'name': [f"Student {i}" for i in range(200)],
+        'grade': [7 + i % 3 for i in range(200)],
+        'class': ['A', 'B'] * 100,
+        'region': ['North', 'South', 'East', 'West'] * 50,
+        'homework_submitted': [i % 2 == 0 for i in range(200)],
+        'homework_date': [now - timedelta(days=i % 20) for i in range(200)],
+        'quiz_score': [50 + i % 50 for i in range(200)],
+        'quiz_date': [now - timedelta(days=i % 30, hours=1) if i % 17 else pd.NaT for i in range(200)],
+    })
+    quizzes = pd.DataFrame({
+        'quiz_id': [f"Q{i}" for i in range(60)],
+        'title': [f"Quiz {i}" for i in range(60)],
+        'grade': [7 + i % 3 for i in range(60)],
+        'class': ['A', 'B'] * 30,
+        'region': ['North', 'South', 'East', 'West'] * 15,
+        'scheduled_date': [now + timedelta(days=i % 15 - 3, hours=1) for i in range(60)],
+        'status': ['upcoming', 'completed', 'upcoming'] * 20,
+    })
+    dm = DataManager(backend=_InMemoryBackend({'students': students, 'quizzes': quizzes}))
+    admin = AdminRole("multi", "Multi Scope", grade=[8, 9], region=["North", "South", "East"])
+    
+    mask = admin.get_policy().mask(students)
+    cutoff = datetime.now() - timedelta(days=7)
+    expected = students[mask & (students['grade'] == 8) & (students['quiz_date'] >= cutoff)]
+    actual = dm.query_performance_by_grade(admin, 8)
+    assert list(actual['student_id']) == list(expected['student_id']), "Performance window mismatch"
+    
+    mask = admin.get_policy().mask(quizzes)
+    today = datetime.now()
+    expected = quizzes[mask & (quizzes['scheduled_date'] >= today) &
+                       (quizzes['scheduled_date'] <= today + timedelta(days=7)) & (quizzes['status'] == 'upcoming')]
+    actual = dm.query_upcoming_quizzes(admin)
+    assert list(actual['quiz_id']) == list(expected['quiz_id']), "Upcoming window mismatch"
+    print(f"✓ Time windows match full scan ({len(actual)} upcoming quizzes)")
+
+def test_ingestion():
+    """Test that ingested records update results and only invalidate affected scopes."""
+    print("\nTesting incremental ingestion...")
+    dm = DataManager()
+    admin1, admin2 = DEMO_ADMINS['admin1'], DEMO_ADMINS['admin2']
+    dm.get_filtered_students(admin1)
+    version1, version2 = dm.scope_version(admin1), dm.scope_version(admin2)
+    
+    with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as feed:
+        feed.write(json.dumps({"table": "students", "record": {
+            "student_id": "S005", "name": "Emma Wilson", "grade": 9, "class": "A", "region": "South",
+            "homework_submitted": False, "homework_date": "2025-11-10", "quiz_score": 95, "quiz_date": "2025-11-08"
+        }}) + "\n")
+        feed.write(json.dumps({"table": "students", "record": {
+            "student_id": "S900", "name": "New Student", "grade": 9, "class": "B", "region": "South",
+            "homework_submitted": False, "homework_date": "2025-11-10", "quiz_score": 70, "quiz_date": "2025-11-08"
+        }}) + "\n")
+        feed.write("not json\n")
+    result = dm.ingest_change_feed(feed.name)
+    os.unlink(feed.name)
+    
+    assert result == {'applied': 2, 'skipped': 1}, f"Unexpected ingest result {result}"
+    students = dm.get_filtered_students(admin2)
+    assert list(students['student_id']) == ['S005', 'S006', 'S900']
+    assert set(dm.query_students_no_homework(admin2)['student_id']) == {'S005', 'S006', 'S900'}
+    assert dm.scope_version(admin2) != version2, "Admin2's cached answers should be invalidated"
+    assert dm.scope_version(admin1) == version1, "Admin1's scope was not touched"
+    assert len(dm.get_filtered_students(admin1)) == 4
+
+    before = dm.students_df
+    dm.ingest(students=[{
+        "student_id": "S900", "name": "New Student", "grade": 9, "class": "B", "region": "South",
+        "homework_submitted": True, "homework_date": "2025-11-10", "quiz_score": 70, "quiz_date": "2025-11-08"
+    }])
+    after = dm.students_df
+    assert list(before['homework_submitted'])[-1] == False, "The previous snapshot must not change"
+    assert list(after['homework_submitted'])[-1] == True
+    assert np.shares_memory(after['name'].to_numpy(), before['name'].to_numpy()), "Unchanged columns should be shared"
+
+    # Partial and full records in one batch: a field a record leaves out keeps its value
+    dm.ingest(students=[
+        {"student_id": "S006", "quiz_score": 51},
+        {"student_id": "S900", "name": "Renamed Student", "grade": 9, "class": "B", "region": "South",
+         "homework_submitted": False, "homework_date": "2025-11-11", "quiz_score": 72, "quiz_date": "2025-11-09"},
+        {"student_id": "S001", "homework_submitted": False},
+    ])
+    rows = dm.students_df.set_index('student_id')
+    assert rows.loc['S006', 'quiz_score'] == 51 and rows.loc['S006', 'name'] == before.set_index('student_id').loc['S006', 'name']
+    assert rows.loc['S006', 'homework_date'] == pd.Timestamp('2025-11-11'), "S006 kept its homework date"
+    assert rows.loc['S001', 'quiz_score'] == 85 and rows.loc['S001', 'homework_submitted'] == False
+    assert rows.loc['S900', 'name'] == "Renamed Student" and rows.loc['S900', 'quiz_score'] == 72
+    assert (dm.students_df.dtypes == before.dtypes).all(), "Partial records should not change column types"
+    print(f"✓ Ingestion applied {result['applied']} records at version {dm.data_version}")
+
+def test_process_pool():
+    """Test that worker processes over shared memory return the same rows and see ingested records."""
+    print("\nTesting process pool...")
+    pooled = None
+    try:
+        dm = DataManager()
+        expected = {
+            (admin.admin_id, method): getattr(dm, method)(admin)
+            for admin in DEMO_ADMINS.values()
+            for method in ('get_filtered_students', 'get_filtered_quizzes', 'query_students_no_homework')
+        }
+        pooled = ProcessDataManager(DataManager(), workers=2)
+        assert pooled.get_metrics()['shared_memory_bytes'] > 0
+        for (admin_id, method), df in expected.items():
+            actual = getattr(pooled, method)(DEMO_ADMINS[admin_id])
+            pd.testing.assert_frame_equal(actual, df, obj=f"{method} for {admin_id}")
+        
+        pooled.ingest(students=[{
+            "student_id": "S901", "name": "Pool Student", "grade": 9, "class": "B", "region": "South",
+            "homework_submitted": True, "homework_date": "2025-11-10", "quiz_score": 88, "quiz_date": "2025-11-08"
+        }])
+        assert 'S901' in set(pooled.get_filtered_students(DEMO_ADMINS['admin2'])['student_id'])
+        workers = set(pooled._executor._processes)
+        blocks = {block.name for block in pooled._shared.blocks}
+        pooled.ingest(students=[{
+            "student_id": "S901", "name": "Pool Student", "grade": 9, "class": "B", "region": "South",
+            "homework_submitted": False, "homework_date": "2025-11-10", "quiz_score": 88, "quiz_date": "2025-11-08"
+        }])
+        changed = {block.name for block in pooled._shared.blocks} - blocks
+        assert len(changed) == 1, f"Only the homework column should be republished, got {len(changed)} blocks"
+        missing = pooled.query_students_no_homework(DEMO_ADMINS['admin2'])
+        assert 'S901' in set(missing['student_id']), "Workers should see the update"
+        assert set(pooled._executor._processes) == workers, "Ingestion should not restart the workers"
+
+        try:
+            pooled._dispatch('query_performance_by_grade', DEMO_ADMINS['admin2'])
+            raise AssertionError("A failing query should raise instead of rerunning in-process")
+        except TypeError:
+            pass
+        pooled.close()
+        assert len(pooled.get_filtered_students(DEMO_ADMINS['admin2'])) > 0, "A closed pool should fall back"
+        print(f"✓ {pooled.workers} workers match the in-process DataManager")
+    finally:
+        if pooled is not None:
+            pooled.close()
+
+def test_analytics():
+    """Test that rollup-based aggregates match direct pandas computation and refresh on ingest."""
+    print("\nTesting analytics...")
+    dm = DataManager()
+    analytics = Analytics(dm)
+    for admin in DEMO_ADMINS.values():
+        students = dm.get_filtered_students(admin)
+        for by in ('grade', 'class', 'region'):
+            stats = analytics.score_stats(admin, by).set_index(by)
+            expected = students.groupby(by, observed=True)['quiz_score'].agg(['size', 'mean', 'min', 'max'])
+            assert list(stats['students']) == list(expected['size']), f"Counts differ by {by}"
+            assert (stats['avg_score'] - expected['mean'].round(2)).abs().max() < 1e-9
+            rate = analytics.homework_rate(admin, by).set_index(by)['submission_rate']
+            assert (rate - students.groupby(by, observed=True)['homework_submitted'].mean().round(4)).abs().max() < 1e-9
+        bottom = analytics.top_k(admin, 2, ascending=True)
+        assert list(bottom['quiz_score']) == sorted(students['quiz_score'])[:2]
+        median = analytics.score_percentiles(admin, percentiles=(50,))['p50'].iloc[0]
+        assert median == students['quiz_score'].median()
+    
+    admin2 = DEMO_ADMINS['admin2']
+    dm.ingest(students=[{
+        "student_id": "S900", "name": "New Student", "grade": 9, "class": "B", "region": "South",
+        "homework_submitted": True, "homework_date": "2025-11-10", "quiz_score": 100, "quiz_date": "2025-11-08"
+    }])
+    assert analytics.top_k(admin2, 1)['student_id'].iloc[0] == 'S900'
+    assert analytics.score_stats(admin2, 'class').set_index('class').loc['B', 'max_score'] == 100
+    
+    assert parse_group_by("by class for grade 8") == 'class'
+    assert parse_group_by("grade 8 by region") == 'region'
+    assert parse_group_by("grade") == 'grade'
+    assert parse_group_by("grade 8") == 'class', "A filtered dimension is not the grouping"
+    assert parse_count("grade 8 top 5") == 5
+    assert parse_count("3 students in grade 9") == 3
+    assert parse_count("grade 8") == 10, "A grade number is not the row count"
+    print("✓ Aggregates match pandas and refresh after ingestion")
+
+def test_tracing():
+    """Test that a query records per-stage spans, tokens and cache hits, and exports them."""
+    print("\nTesting tracing...")
+    server, base_url = start_stub_server()
+    try:
+        registry = get_registry()
+        registry.reset()
+        agent = QueryAgent(DataManager(), DEMO_ADMINS['admin1'], 'sk-test', llm=get_shared_llm('sk-test', base_url=base_url),
+                           cache=ResponseCache())
+        agent.router = None
+        question = "Which students haven't submitted homework?"
+        agent.query(question)
+        agent.query(question)
+        
+        cached, traced = registry.recent_traces()
+        assert (traced.path, cached.path) == ('llm', 'cache')
+        spans = {span.name: span for span in traced.spans}
+        for name in ('cache_lookup', 'llm_call', 'agent', 'tool.students_no_homework',
+                     'data.query_students_no_homework', 'format'):
+            assert name in spans, f"Missing span {name}"
+        assert spans['data.query_students_no_homework'].attrs == {'rows_scanned': 4, 'rows_returned': 2}
+        assert spans['data.query_students_no_homework'].parent == 'tool.students_no_homework'
+        assert traced.llm_calls == 2 and traced.prompt_tokens > 0 and traced.completion_tokens > 0
+        
+        metrics = registry.to_prometheus()
+        assert 'dumroo_queries_total{path="llm"} 1' in metrics
+        assert 'dumroo_cache_lookups_total{result="hit"} 1' in metrics
+        assert 'dumroo_stage_seconds_count{stage="llm_call"} 2' in metrics
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'traces.jsonl')
+            registry.write_jsonl(path)
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = [json.loads(line) for line in f]
+        assert [line['path'] for line in lines] == ['llm', 'cache']
+        print(f"✓ Traced {len(traced.spans)} spans over {traced.seconds * 1000:.1f} ms")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_batch():
+    """Test that batch answers match per-agent answers and identical scopes share LLM calls."""
+    print("\nTesting batch queries...")
+    server, base_url = start_stub_server()
+    try:
+        dm = DataManager()
+        llm = get_shared_llm('sk-test', base_url=base_url)
+        twin = AdminRole("admin4", "Twin of admin1", grade=8, region="North")
+        admins = list(DEMO_ADMINS.values()) + [twin]
+        questions = [
+            "Which students haven't submitted their homework?",
+            "Show me performance data for Grade 8",
+            "List all upcoming quizzes scheduled for next week",
+            "Why are some students behind?",
+            "Why are some  students behind?",
+        ]
+        registry = get_registry()
+        registry.reset()
+        results = BatchRunner(dm, llm=llm, concurrency=2).run(admins, questions)
+        
+        assert len(results) == len(admins) * 4, "Duplicate questions should be answered once"
+        assert len(registry.recent_traces()) == 3, "LLM questions should run once per distinct scope"
+        for result in results:
+            admin = next(a for a in admins if a.admin_id == result['admin_id'])
+            if result['source'] == 'local':
+                agent = QueryAgent(dm, admin, 'sk-test', llm=llm, cache=ResponseCache())
+                assert result['answer'] == agent._answer_locally(result['question']), f"Mismatch for {result}"
+            else:
+                assert result['source'] == 'llm' and result['answer'].startswith("Here is what I found")
+        by_admin = lambda admin_id: [r['answer'] for r in results if r['admin_id'] == admin_id]
+        assert by_admin('admin1') == by_admin('admin4')
+        print(f"✓ Batch answered {len(results)} pairs with {len(registry.recent_traces())} LLM questions")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_api():
+    """Test the headless API: light import, data endpoints and queries through the stub LLM."""
+    print("\nTesting headless API...")
+    server, base_url = start_stub_server()
+    try:
+        probe = "import api, sys; print(any(m in sys.modules for m in ('pandas', 'langchain', 'langchain_core')))"
+        heavy = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True).stdout.strip()
+        assert heavy == "False", "Importing api should not import pandas or langchain"
+        
+        from api import ApiApp
+        app = ApiApp(api_key='sk-test', base_url=base_url, warmup=False)
+        
+        async def exercise():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://api") as client:
+                assert (await client.get("/ready")).status_code == 503
+                students = (await client.get("/students", params={"admin_id": "admin2"})).json()
+                no_homework = (await client.get("/students/no-homework", params={"admin_id": "admin1"})).json()
+                stats = (await client.get("/analytics/score-stats", params={"admin_id": "admin1", "by": "class"})).json()
+                missing = await client.get("/performance", params={"admin_id": "admin1"})
+                unknown = await client.get("/students", params={"admin_id": "nobody"})
+                answer = (await client.post("/query", json={"admin_id": "admin1", "question": "Who are my students?"})).json()
+                app.warm_up()
+                ready = await client.get("/ready")
+                metrics = (await client.get("/metrics")).text
+                return students, no_homework, stats, missing, unknown, answer, ready, metrics
+        
+        students, no_homework, stats, missing, unknown, answer, ready, metrics = asyncio.run(exercise())
+        assert {s['student_id'] for s in students} == {'S005', 'S006'}
+        assert {s['name'] for s in no_homework} == {'Bob Smith', 'David Lee'}
+        assert [row['class'] for row in stats] == ['A', 'B']
+        assert missing.status_code == 400 and unknown.status_code == 404
+        assert 'Alice Johnson' in answer['answer'] and 'David Lee' in answer['answer']
+        assert ready.status_code == 200 and ready.json()['import_seconds']['query_agent'] >= 0
+        assert 'dumroo_api_ready 1' in metrics and 'dumroo_queries_total' in metrics
+        print(f"✓ API ready in {ready.json()['ready_seconds']:.2f}s")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_benchmark():
+    """Test the synthetic dataset generator and a small end-to-end benchmark run."""
+    print("\nTesting benchmark harness...")
+    students, quizzes = generate_dataset(500, seed=1)
+    assert len(students) == 500 and len(quizzes) == 50
+    assert students['student_id'].is_unique and set(quizzes['status']) <= {'upcoming', 'completed'}
+    
+    report = run_benchmark(students=2000, repeat=2, agent_rounds=1, concurrency=2, local_answers=False)
+    stages = report['stages']
+    for name in ('load', 'get_filtered_students', 'rbac_mask_scan', 'analytics_score_stats', 'agent_replay'):
+        assert name in stages, f"Missing stage {name}"
+    assert stages['agent_replay']['count'] == 2 * 8
+    assert compare_to_baseline(report, report) == []
+    slower = json.loads(json.dumps(report))
+    slower['stages']['load']['p50_ms'] = report['stages']['load']['p50_ms'] * 3 + 1
+    assert compare_to_baseline(slower, report), "A 3x slowdown should be flagged"
+    print(f"✓ Benchmark ran {len(stages)} stages; agent p50 {stages['agent_replay']['p50_ms']:.1f} ms")
+
 def test_query_agent():
     """Test query agent functionality."""
     print("\nTesting QueryAgent...")
@@ -33,25 +726,19 @@ def test_query_agent():
     api_key = os.getenv('OPENAI_API_KEY')
     
     if not api_key:
-        print("✗ No API key found in .env file")
-        return False
+        raise unittest.SkipTest("No API key found in .env file")
     
-    try:
-        dm = DataManager()
-        admin = DEMO_ADMINS['admin1']
-        agent = QueryAgent(dm, admin, api_key)
-        
-        print(f"✓ Agent initialized for {admin.name}")
-        
-        # Test a simple query
-        print("\nTesting query: 'Who are my students?'")
-        response = agent.query("Who are my students?")
-        print(f"Response: {response[:200]}...")
-        
-        return True
-    except Exception as e:
-        print(f"✗ QueryAgent test failed: {str(e)}")
-        return False
+    dm = DataManager()
+    admin = DEMO_ADMINS['admin1']
+    agent = QueryAgent(dm, admin, api_key)
+    
+    print(f"✓ Agent initialized for {admin.name}")
+    
+    # Test a simple query
+    print("\nTesting query: 'Who are my students?'")
+    response = agent.query("Who are my students?")
+    print(f"Response: {response[:200]}...")
+    assert response, "The agent returned an empty answer"
 
 def test_access_control():
     """Test access control functionality."""
@@ -71,15 +758,42 @@ def test_access_control():
         print(f"✗ Access control test failed: {str(e)}")
         return False
 
+def run_test(test):
+    """Run one test for the script summary; it fails by raising or, like the original checks, returning False."""
+    try:
+        return test() is not False
+    except Exception as e:
+        print(f"✗ {test.__name__} failed: {type(e).__name__}: {str(e)}")
+        return False
+
 if __name__ == "__main__":
     print("=" * 60)
     print("Dumroo Admin Panel - System Tests")
     print("=" * 60)
     
     results = []
-    results.append(("Data Manager", test_data_manager()))
-    results.append(("Access Control", test_access_control()))
-    results.append(("Query Agent", test_query_agent()))
+    results.append(("Data Manager", run_test(test_data_manager)))
+    results.append(("Access Control", run_test(test_access_control)))
+    results.append(("Scope Index", run_test(test_scope_index)))
+    results.append(("Access Policy", run_test(test_access_policy)))
+    results.append(("Columnar Backend", run_test(test_columnar_backend)))
+    results.append(("Record Model", run_test(test_record_model)))
+    results.append(("Streaming Loader", run_test(test_streaming_loader)))
+    results.append(("SQL Backend", run_test(test_sql_backend)))
+    results.append(("Intent Router", run_test(test_intent_router)))
+    results.append(("Response Cache", run_test(test_response_cache)))
+    results.append(("Async Agent", run_test(test_async_agent)))
+    results.append(("Conversation Memory", run_test(test_conversation_memory)))
+    results.append(("Result Format", run_test(test_result_format)))
+    results.append(("Time Windows", run_test(test_time_windows)))
+    results.append(("Ingestion", run_test(test_ingestion)))
+    results.append(("Process Pool", run_test(test_process_pool)))
+    results.append(("Analytics", run_test(test_analytics)))
+    results.append(("Tracing", run_test(test_tracing)))
+    results.append(("Batch", run_test(test_batch)))
+    results.append(("API", run_test(test_api)))
+    results.append(("Benchmark", run_test(test_benchmark)))
+    results.append(("Query Agent", run_test(test_query_agent)))
     
     print("\n" + "=" * 60)
     print("Test Results:")
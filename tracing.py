@@ -0,0 +1,257 @@
+"""Per-question tracing and process-wide metrics for the query hot path.
+
+A trace is opened around each QueryAgent call. Spans opened anywhere below it (tools,
+result formatting, DataManager queries, LLM round-trips) are attached to it through a
+context variable, so no tracing arguments have to be threaded through the call chain.
+Every span also feeds the process-wide registry exported as Prometheus text or JSON lines.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from config import TRACE_HISTORY, TRACE_LOG_FILE, TRACING_ENABLED
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROW_COUNTERS = ('rows_scanned', 'rows_returned')
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """One timed stage with free-form attributes such as row counts or tokens."""
+
+    def __init__(self, name, parent=None, **attrs):
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.offset = 0.0
+        self.seconds = 0.0
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'parent': self.parent,
+            'offset_ms': round(self.offset * 1000, 3),
+            'ms': round(self.seconds * 1000, 3),
+            **self.attrs,
+        }
+
+
+class Trace:
+    """Everything recorded while answering one question."""
+
+    def __init__(self, question, admin_id=None):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.question = question
+        self.admin_id = admin_id
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+        self.path = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_calls = 0
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, span):
+        # Parallel tool calls finish on executor threads
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'started_at': round(self.started_at, 3),
+            'admin_id': self.admin_id,
+            'question': self.question,
+            'path': self.path,
+            'ms': round(self.seconds * 1000, 3),
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'llm_calls': self.llm_calls,
+            'spans': [span.to_dict() for span in self.spans],
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe stage histograms and counters, plus the most recent traces."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, history=TRACE_HISTORY, log_file=TRACE_LOG_FILE):
+        self.buckets = buckets
+        self.log_file = log_file
+        self._lock = threading.Lock()
+        self._traces = deque(maxlen=history)
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+            self._counters = {}
+            self._traces.clear()
+
+    def _count(self, name, labels, value=1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe_span(self, span):
+        with self._lock:
+            stage = self._stages.get(span.name)
+            if stage is None:
+                stage = self._stages[span.name] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if span.seconds <= bound:
+                    stage['buckets'][i] += 1
+            stage['sum'] += span.seconds
+            stage['count'] += 1
+            for counter in ROW_COUNTERS:
+                if counter in span.attrs:
+                    self._count(f"{counter}_total", (('stage', span.name),), int(span.attrs[counter]))
+            if 'cache_hit' in span.attrs:
+                self._count('cache_lookups_total', (('result', 'hit' if span.attrs['cache_hit'] else 'miss'),))
+
+    def record_trace(self, trace):
+        with self._lock:
+            self._count('queries_total', (('path', trace.path or 'unknown'),))
+            self._count('llm_tokens_total', (('kind', 'prompt'),), trace.prompt_tokens)
+            self._count('llm_tokens_total', (('kind', 'completion'),), trace.completion_tokens)
+            self._count('llm_calls_total', (), trace.llm_calls)
+            self._traces.append(trace)
+        if self.log_file:
+            self.write_jsonl(self.log_file, [trace])
+
+    def recent_traces(self):
+        """Most recent traces, newest first."""
+        with self._lock:
+            return list(reversed(self._traces))
+
+    def write_jsonl(self, path, traces=None):
+        """Append traces (default: the recent history) to a JSON-lines file."""
+        traces = self.recent_traces()[::-1] if traces is None else traces
+        try:
+            with open(path, 'a', encoding='utf-8') as f:
+                for trace in traces:
+                    f.write(json.dumps(trace.to_dict(), default=str) + "\n")
+        except OSError as e:
+            logger.warning(f"Could not write traces to {path}: {str(e)}")
+
+    def snapshot(self):
+        """Stage statistics and counters as plain data."""
+        with self._lock:
+            stages = {
+                name: {'count': s['count'], 'total_ms': round(s['sum'] * 1000, 3),
+                       'mean_ms': round(s['sum'] * 1000 / s['count'], 3) if s['count'] else 0.0}
+                for name, s in self._stages.items()
+            }
+            counters = {
+                name + ''.join(f"[{k}={v}]" for k, v in labels): value
+                for (name, labels), value in sorted(self._counters.items())
+            }
+        return {'stages': stages, 'counters': counters}
+
+    def to_prometheus(self, prefix='dumroo'):
+        """Render all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [
+                f"# HELP {prefix}_stage_seconds Wall time spent in each traced stage.",
+                f"# TYPE {prefix}_stage_seconds histogram",
+            ]
+            for name, stage in sorted(self._stages.items()):
+                for bound, count in zip(self.buckets, stage['buckets']):
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {stage["count"]}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage["sum"]:.6f}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+            typed = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {prefix}_{name} counter")
+                    typed.add(name)
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{prefix}_{name}{{{label_text}}} {value}" if labels else f"{prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry():
+    """The process-wide metrics registry."""
+    return _registry
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(question, admin_id=None):
+    """Open a trace for one question; it is recorded in the registry when the block exits."""
+    if not TRACING_ENABLED:
+        yield Trace(question, admin_id)
+        return
+    trace = Trace(question, admin_id)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.seconds = time.perf_counter() - trace.start
+        _current_trace.reset(token)
+        _registry.record_trace(trace)
+        logger.debug(f"Trace {trace.trace_id} ({trace.path}) took {trace.seconds * 1000:.1f} ms")
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time a stage; attributes can be added to the yielded span or later through annotate()."""
+    parent = _current_span.get()
+    current = Span(name, parent.name if parent is not None else None, **attrs)
+    if not TRACING_ENABLED:
+        yield current
+        return
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.seconds = time.perf_counter() - start
+        _current_span.reset(token)
+        record_span(current, start)
+
+
+def record_span(current, start, trace=None):
+    """Record an already-timed span, for stages measured outside a `with span()` block."""
+    trace = trace or _current_trace.get()
+    if trace is not None:
+        current.offset = start - trace.start
+        trace.add_span(current)
+    _registry.observe_span(current)
+
+
+def annotate(**attrs):
+    """Add attributes (e.g. rows_scanned) to the innermost open span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def traced(name):
+    """Decorator timing each call as a span and recording rows_returned for DataFrame results."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name) as current:
+                result = func(*args, **kwargs)
+                if hasattr(result, 'shape'):
+                    current.attrs['rows_returned'] = len(result)
+                return result
+        return wrapper
+    return decorator